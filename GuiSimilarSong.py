@@ -2,118 +2,200 @@ import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 from tkinter.ttk import Progressbar
-import librosa
-import numpy as np
-import joblib
 import threading
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import soundfile as sf
 import subprocess
 import platform
-from scipy.spatial.distance import euclidean, cosine
 from feature_manager_gai import feature_manager_instance  # 导入 FeatureManager 实例
 import multiprocessing
+from audio_scanner import AudioScanner
+from supervised_pool import start_shared_pool, shutdown_shared_pool
+from result_view import ResultView, format_offset
+from audition import Auditioner, PREFETCH_COUNT
+
+# librosa、scipy、soundfile、numpy 等重量级依赖只在提取或搜索时才导入（见各函数内的 import），
+# 窗口可以尽快显示出来。tools/benchmark.py startup 会检查启动时间。
+
+# 兼容旧代码：from GuiSimilarSong import extract_features 等，按需从 audio_worker 导入
+def __getattr__(name):
+    if name in ('extract_features', 'calculate_similarity'):
+        import audio_worker
+        return getattr(audio_worker, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# 音频特征提取函数
-def extract_features(file_path, stop_event):
-    try:
-        y, sr = librosa.load(file_path, sr=None)
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_mean = np.mean(mfcc, axis=1)
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        chroma_mean = np.mean(chroma, axis=1)
-        # tempo = librosa.beat.tempo(y=y, sr=sr)[0]
-        return {
-            'mfcc': mfcc_mean,
-            'chroma': chroma_mean
-        }
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-        return None
-    
 # 特征缓存函数
-def cache_audio_features(search_path, feature_file, progress_bar, progress_label, stop_event):
+# keep_frames 为 True 时同时保存逐帧特征序列（<特征文件>.frames），用于片段定位
+# keep_fingerprints 为 True 时同时保存地标指纹倒排索引（<特征文件>.fp），用于查重
+# skip_silence 为 True 时特征均值跳过静音帧，不需要先用 tools/audio_clean.py 生成清洗后的副本
+def cache_audio_features(search_path, feature_file, progress_bar, progress_label, stop_event, th_n=None,
+                         keep_frames=True, keep_fingerprints=True, skip_silence=False):
+    from extraction_scheduler import ExtractionScheduler
+    from segment_search import FrameStoreWriter, get_frame_file, remove_frame_store
+    from fingerprint_index import FingerprintWriter, get_fingerprint_file, remove_fingerprint_index
+    from audio_worker import SILENCE_THRESH_DB
+
     audio_features = {}
-    total_files = sum([len(files) for _, _, files in os.walk(search_path) if files])
+    # 上次构建时提取失败且文件没有变化的，直接跳过，不再等待超时
+    previous_quarantine = feature_manager_instance.read_quarantine(feature_file)
+    quarantine = {}
+
+    # 跳过的文件不会经过 on_file_done，同样计入进度，否则有隔离文件时进度永远到不了总数
+    def skip(file_path):
+        nonlocal skipped
+        if feature_manager_instance.is_quarantined(file_path, previous_quarantine):
+            quarantine[file_path] = previous_quarantine[file_path]
+            skipped += 1
+            return True
+        return False
+
+    # 单次并行扫描，发现的文件直接进入调度器，总数随扫描进行不断更新
+    scanner = AudioScanner(search_path, stop_event=stop_event).start()
     current_progress = 0
-    
-    for root, _, files in os.walk(search_path):
-        if stop_event.is_set():
-            break
-        for file in files:
-            if stop_event.is_set():
-                break
-            if file.endswith(('.mp3', '.wav', '.flac', '.ogg', '.wma')):
-                file_path = os.path.join(root, file)
-                features = extract_features(file_path, stop_event)
-                if features is not None:
-                    audio_features[file_path] = features
-
-                # 更新进度条
-                current_progress += 1
-                progress_bar['value'] = (current_progress / total_files) * 100
-                progress_label.config(text=f"Extracting features: {current_progress}/{total_files} files")
-                progress_bar.update()
-    
+    skipped = 0  # 只在调度器的扫描线程中修改
+
+    # 更新进度条
+    def show_progress():
+        done = current_progress + skipped
+        total_files = max(scanner.total, 1)
+        progress_bar['value'] = (done / total_files) * 100
+        scanning = "" if scanner.done else " (scanning...)"
+        progress_label.config(text=f"Extracting features: {done}/{scanner.total} files{scanning}")
+        progress_bar.update()
+
+    def on_file_done(file_path, features, error):
+        nonlocal current_progress
+        if features is not None:
+            audio_features[file_path] = features
+        elif error is not None:
+            quarantine[file_path] = error
+        current_progress += 1
+        show_progress()
+
+    frame_writer = FrameStoreWriter(get_frame_file(feature_file)) if keep_frames else None
+    fingerprint_writer = FingerprintWriter(get_fingerprint_file(feature_file)) if keep_fingerprints else None
+    params = {'silence_thresh': SILENCE_THRESH_DB if skip_silence else None}
+
+    # 多进程提取，长文件优先派发，超长文件分段，每个片段有超时保护
+    ExtractionScheduler(max_workers=th_n, stop_event=stop_event, skip=skip,
+                        memory_budget=feature_manager_instance.get_memory_budget(), **params).run(
+        scanner, on_file_done,
+        frame_writer.add if frame_writer is not None else None,
+        fingerprint_writer.add if fingerprint_writer is not None else None)
+
     if not stop_event.is_set():
+        # 最后几个文件是被跳过的隔离文件时，进度在这里补齐
+        show_progress()
         feature_manager_instance.set_feature_file(feature_file)
-        feature_manager_instance.save_features(audio_features)
-        messagebox.showinfo("Caching Complete", f"Cached features to {feature_file}")
+        feature_manager_instance.save_features(audio_features, roots=[search_path], quarantine=quarantine, params=params)
+        feature_manager_instance.remember_feature_file()
+        # 不保存片段定位数据/指纹时删除上一次构建留下的文件，它们的条目与新索引不再对应，
+        # 否则片段定位、查重和目录监控会继续使用（并追加到）旧数据
+        if frame_writer is not None:
+            frame_writer.close(roots=[search_path])
+        else:
+            remove_frame_store(get_frame_file(feature_file))
+        if fingerprint_writer is not None:
+            fingerprint_writer.close(roots=[search_path])
+        else:
+            remove_fingerprint_index(get_fingerprint_file(feature_file))
+        message = f"Cached features to {feature_file}"
+        if quarantine:
+            message += f"\n{len(quarantine)} files failed and were quarantined"
+        messagebox.showinfo("Caching Complete", message)
         progress_label.config(text="Caching complete!")
     else:
+        # 取消时丢弃本次写了一半的帧序列和指纹，原有的文件保持不变
+        if frame_writer is not None:
+            frame_writer.abort()
+        if fingerprint_writer is not None:
+            fingerprint_writer.abort()
         progress_label.config(text="Task cancelled!")
 
+MAX_RESULTS = 10000  # 结果表格按需插入行，可以一次列出上万个结果
+RESULT_CACHE_DEPTH = 1000  # 每次搜索至少排序并缓存这么多个结果，之后改大 top_n 也能直接命中缓存
+
 # 相似音频查找函数
-def find_top_n_similar_audios(target_file, top_n, progress_bar, progress_label, stop_event, th_n):
-    target_features = extract_features(target_file, stop_event)
-    if target_features is None:
-        return []
-    
+# metric 为 similarity_metrics.METRICS 中的度量名，weights 为 {特征名: 权重}
+def find_top_n_similar_audios(target_file, top_n, progress_bar, progress_label, stop_event,
+                              metric=None, weights=None):
+    from extraction_scheduler import extract_files
+    from similarity_metrics import rank, DEFAULT_METRIC, DEFAULT_WEIGHTS
+    from result_cache import result_cache_instance, file_content_hash
+
+    metric = metric or DEFAULT_METRIC
     cached_features = feature_manager_instance.load_features()
     total_files = len(cached_features)
-    current_progress = 0
-    
-    similarities = []
-    with ProcessPoolExecutor(max_workers=th_n) as executor:
-        future_to_file = {executor.submit(calculate_similarity, file_path, target_features, features): file_path for file_path, features in cached_features.items()}
-        
-        for future in as_completed(future_to_file):
-            if stop_event.is_set():
-                break
-            file_path = future_to_file[future]
-            try:
-                result = future.result()
-                similarities.append(result)
-            except Exception as exc:
-                print(f'{file_path} generated an exception: {exc}')
-            finally:
-                # 更新进度条
-                current_progress += 1
-                progress_bar['value'] = (current_progress / total_files) * 100
-                progress_label.config(text=f"Comparing files: {current_progress}/{total_files} files")
-                progress_bar.update()
+    # 只比较与当前提取参数一致的特征列，一列都不能用时抛出 SchemaMismatch 拒绝搜索
+    weights = feature_manager_instance.query_weights(weights or DEFAULT_WEIGHTS, cached_features)
+
+    # 同一个目标在同一版本的索引上用同样的度量搜索过，直接使用缓存的排序结果
+    cache_key = result_cache_instance.make_key(file_content_hash(target_file), feature_manager_instance.get_feature_file(),
+                                               cached_features.version, metric, weights)
+    cached = result_cache_instance.get(cache_key)
+    if cached is not None and (len(cached[0]) >= top_n or len(cached[0]) == total_files):
+        rows, scores = cached
+        return [(cached_features.path(row), score) for row, score in zip(rows[:top_n], scores[:top_n])]
+
+    # 目标文件同样在有超时保护的子进程中提取，损坏的文件不会卡住或拖垮搜索
+    # 使用与构建索引时相同的提取参数（例如是否跳过静音）
+    extracted, failures = extract_files([target_file], max_workers=1, stop_event=stop_event,
+                                        **feature_manager_instance.get_extraction_params())
+    target_features = extracted.get(target_file)
+    if target_features is None:
+        if target_file in failures:
+            progress_label.config(text=f"Failed to extract target: {failures[target_file]}")
+        return []
+    if stop_event.is_set():
+        progress_label.config(text="Task cancelled!")
+        return []
 
-    if not stop_event.is_set():
-        similarities.sort(key=lambda x: x[1])
-        return similarities[:top_n]
-    else:
+    # 向量化比较：每种特征对整个库只做一次矩阵运算，不再需要进程池
+    progress_label.config(text=f"Comparing files: {total_files} files")
+    rows, scores = rank(cached_features, target_features, metric, weights, top_k=max(top_n, RESULT_CACHE_DEPTH))
+    result_cache_instance.put(cache_key, rows, scores)
+    progress_bar['value'] = 100
+    progress_bar.update()
+    # 只为前 top_n 个结果拼出完整路径
+    return [(cached_features.path(row), score) for row, score in zip(rows[:top_n], scores[:top_n])]
+
+# 片段定位函数：返回 [(路径, 匹配度, 起始秒数)]
+def locate_audio_clip(clip_file, top_n, progress_bar, progress_label, stop_event):
+    from segment_search import FrameStore, find_clip, get_frame_file
+
+    frame_file = get_frame_file(feature_manager_instance.get_feature_file())
+    if not FrameStore.exists(frame_file):
+        progress_label.config(text="当前特征文件没有帧序列数据，请勾选“保存片段定位数据”后重新提取特征")
+        return []
+
+    def progress(done, total):
+        progress_bar['value'] = (done / total) * 100
+        progress_label.config(text=f"Locating clip: {done}/{total} tracks")
+        progress_bar.update()
+
+    try:
+        matches = find_clip(clip_file, feature_manager_instance.load_features(), frame_file, top_n,
+                            stop_event=stop_event, progress=progress,
+                            silence_thresh=feature_manager_instance.get_extraction_params().get('silence_thresh'))
+    except RuntimeError as e:
+        progress_label.config(text=f"Failed to extract clip: {e}")
+        return []
+    if stop_event.is_set():
         progress_label.config(text="Task cancelled!")
         return []
+    return matches
 
-def calculate_similarity(file_path, target_features, features):
-    target_mix = []
-    source_mix = []
-    similarity_scores = [] # 
-    for feature in ['mfcc', 'chroma']:
-        if feature in target_features and feature in features:
-            # distance = np.linalg.norm(target_features[feature] - features[feature])
-            distance = abs(1/(1 - cosine(target_features[feature], features[feature])))
-            similarity_scores.append(distance)
-    
-    if similarity_scores:
-        return file_path, np.mean(similarity_scores)
-    else:
-        return file_path, float('inf')
+# 指纹查重函数：返回库中与目标是同一录音的文件 [(路径, 票数, 起始秒数)]
+def find_duplicate_audios(target_file, top_n, progress_label, stop_event):
+    from fingerprint_index import FingerprintIndex, find_duplicates, get_fingerprint_file
+
+    fingerprint_file = get_fingerprint_file(feature_manager_instance.get_feature_file())
+    if not FingerprintIndex.exists(fingerprint_file):
+        progress_label.config(text="当前特征文件没有指纹数据，请勾选“保存查重指纹”后重新提取特征")
+        return []
+    try:
+        return find_duplicates(target_file, fingerprint_file, top_n, stop_event=stop_event)
+    except RuntimeError as e:
+        progress_label.config(text=f"Failed to extract target: {e}")
+        return []
 
 # 打开文件的函数
 def open_audio_file(file_path):
@@ -143,6 +225,19 @@ class AudioSimilarityApp(tk.Tk):
         # 任务取消事件
         self.stop_event = threading.Event()
 
+        # 目录监控
+        self.watcher = None
+
+        # 后台启动并预热常驻的工作进程池，之后的提取和搜索都复用它
+        start_shared_pool()
+
+        # 窗口显示出来之后立即在后台开始加载上次使用的特征文件
+        if feature_manager_instance.get_feature_file() is None:
+            last_feature_file = feature_manager_instance.get_last_feature_file()
+            if last_feature_file:
+                feature_manager_instance.set_feature_file(last_feature_file)
+        self.after_idle(self.preload_index)
+
         # Target Audio File Selection
         self.label_target = tk.Label(self, text="需要寻找的文件:")
         # self.label_target.grid(row=0, column=0, sticky=tk.N)
@@ -178,11 +273,49 @@ class AudioSimilarityApp(tk.Tk):
         # self.button_cache.grid(row=6, column=0, columnspan=3, sticky=tk.N)
         self.button_cache.pack(pady=5)
 
+        # 提取特征时是否同时保存逐帧特征序列（片段定位需要，会占用额外的磁盘空间）
+        self.keep_frames_var = tk.BooleanVar(value=True)
+        self.check_keep_frames = tk.Checkbutton(self, text="保存片段定位数据", variable=self.keep_frames_var)
+        self.check_keep_frames.pack(pady=5)
+        self.keep_fingerprints_var = tk.BooleanVar(value=True)
+        self.check_keep_fingerprints = tk.Checkbutton(self, text="保存查重指纹", variable=self.keep_fingerprints_var)
+        self.check_keep_fingerprints.pack(pady=5)
+        # 提取时跳过静音帧（效果等同于先清洗静音，但只解码一次，也不产生中间文件）
+        self.skip_silence_var = tk.BooleanVar(value=False)
+        self.check_skip_silence = tk.Checkbutton(self, text="跳过静音", variable=self.skip_silence_var)
+        self.check_skip_silence.pack(pady=5)
+
+        # 监控目录按钮：目录有变化时自动增量更新特征文件
+        self.button_watch = tk.Button(self, text="监控目录", command=self.toggle_watch)
+        self.button_watch.pack(pady=5)
+
+        # 相似度度量选择和特征权重（例如 mfcc=2, chroma=1），保存在设置文件中
+        from similarity_metrics import METRICS, DEFAULT_METRIC, DEFAULT_WEIGHTS, format_weights
+        settings = feature_manager_instance.load_settings()
+        self.metric_names = {label: name for name, label in METRICS.items()}
+        self.metric_var = tk.StringVar(value=METRICS.get(settings.get('metric'), METRICS[DEFAULT_METRIC]))
+        frame_metric = tk.Frame(self)
+        frame_metric.pack(pady=5)
+        tk.Label(frame_metric, text="相似度度量:").pack(side=tk.LEFT)
+        tk.OptionMenu(frame_metric, self.metric_var, *METRICS.values()).pack(side=tk.LEFT)
+        tk.Label(frame_metric, text="权重:").pack(side=tk.LEFT)
+        self.entry_weights = tk.Entry(frame_metric, width=18)
+        self.entry_weights.insert(0, format_weights(settings.get('feature_weights', DEFAULT_WEIGHTS)))
+        self.entry_weights.pack(side=tk.LEFT)
+
         # Find Similar Audios Button
         self.button_find = tk.Button(self, text="寻找相似音频", command=self.find_similar_audios)
         # self.button_find.grid(row=7, column=0, columnspan=3, sticky=tk.N)
         self.button_find.pack(pady=5)
 
+        # 片段定位：查找目标片段来自哪首曲目以及在曲目中的位置
+        self.button_locate = tk.Button(self, text="片段定位", command=self.locate_clip)
+        self.button_locate.pack(pady=5)
+
+        # 指纹查重：判断目标是否已经在库中（重复上传、转码）
+        self.button_duplicates = tk.Button(self, text="指纹查重", command=self.find_duplicates)
+        self.button_duplicates.pack(pady=5)
+
         # Cancel Task Button
         self.button_cancel = tk.Button(self, text="取消", command=self.cancel_task)
         # self.button_cancel.grid(row=8, column=0, columnspan=3, sticky=tk.N)
@@ -218,16 +351,52 @@ class AudioSimilarityApp(tk.Tk):
         # self.label_feature_file.grid(row=14, column=0, columnspan=3, sticky=tk.N)
         self.label_feature_file.pack(pady=5)
 
-        # Result Display
-        self.listbox_result = tk.Listbox(self, height=8, width=60)
-        # self.listbox_result.grid(row=15, column=0, columnspan=3, sticky=tk.N)
-        self.listbox_result.pack(pady=5)
-        self.listbox_result.bind("<Double-1>", self.play_audio)
-        self.listbox_result.bind("<Button-3>", self.show_context_menu)  # 右键点击事件
+        # Result Display：结果表格按需插入行，路径保存在表格的模型中
+        self.result_view = ResultView(self, remap=self.remap_paths, on_open=self.play_audio,
+                                      on_context_menu=self.show_context_menu, height=8)
+        self.result_view.pack(pady=5, fill=tk.X)
+
+        # 程序内试听：预先解码前几个结果的片段，双击立即播放；不能程序内播放时使用外部播放器
+        self.auditioner = Auditioner(fallback=open_audio_file)
 
         # 创建右键菜单
         self.context_menu = tk.Menu(self, tearoff=0)
         self.context_menu.add_command(label="复制", command=self.copy_file_name)
+        self.context_menu.add_command(label="停止试听", command=self.auditioner.stop)
+
+    # 后台加载当前特征文件，第一次搜索时不用再等待。
+    # 加载期间标签显示读取进度，搜索按钮不可用；加载完成后显示索引中的曲目数
+    def preload_index(self):
+        feature_file = feature_manager_instance.get_feature_file()
+        if not feature_file:
+            return
+        search_buttons = (self.button_find, self.button_locate, self.button_duplicates)
+        for button in search_buttons:
+            button.config(state=tk.DISABLED)
+        self.label_feature_file.config(text=f"正在加载特征文件: {feature_file}")
+        shown = [-1]
+
+        # 在加载线程中调用，百分比变化时才交给界面线程更新标签
+        def progress(done, total):
+            percent = done * 100 // max(total, 1)
+            if percent != shown[0]:
+                shown[0] = percent
+                self.after(0, lambda: self.label_feature_file.config(
+                    text=f"正在加载特征文件 ({percent}%): {feature_file}"))
+
+        def finish(features, error):
+            # 加载期间又切换了特征文件时，以最新的一次为准
+            if feature_manager_instance.get_feature_file() != feature_file:
+                return
+            for button in search_buttons:
+                button.config(state=tk.NORMAL)
+            if error is not None:
+                self.label_feature_file.config(text=f"特征文件加载失败: {feature_file} ({error})")
+            else:
+                self.label_feature_file.config(text=f"当前使用的特征文件: {feature_file} ({len(features)} 首)")
+
+        feature_manager_instance.preload_features(
+            on_done=lambda features, error: self.after(0, finish, features, error), progress=progress)
 
     # 选择需要替换的路径
     def select_new_root_path(self):
@@ -268,7 +437,35 @@ class AudioSimilarityApp(tk.Tk):
         self.update()
 
         # 使用线程来执行特征提取任务
-        threading.Thread(target=cache_audio_features, args=(search_dir, feature_file, self.progress_bar, self.progress_label, self.stop_event)).start()
+        threading.Thread(target=cache_audio_features, args=(search_dir, feature_file, self.progress_bar, self.progress_label, self.stop_event),
+                         kwargs={'keep_frames': self.keep_frames_var.get(),
+                                 'keep_fingerprints': self.keep_fingerprints_var.get(),
+                                 'skip_silence': self.skip_silence_var.get()}).start()
+
+    def toggle_watch(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.button_watch.config(text="监控目录")
+            self.progress_label.config(text="已停止监控")
+            return
+
+        search_dir = self.entry_dir.get()
+        if not search_dir:
+            messagebox.showwarning("Input Error", "Please select a search directory.")
+            return
+
+        if feature_manager_instance.feature_file is None:
+            feature_file = filedialog.askopenfilename(filetypes=[("Pickle Files", "*.pkl")])
+            if not feature_file:
+                messagebox.showwarning("Input Error", "Please specify the feature file.")
+                return
+            self.use_feature_file(feature_file)
+
+        from library_watcher import LibraryWatcher
+        self.watcher = LibraryWatcher(search_dir,
+                                      status_callback=lambda text: self.progress_label.config(text=text)).start()
+        self.button_watch.config(text="停止监控")
 
     def find_similar_audios(self):
         target_file = self.entry_target.get()
@@ -281,18 +478,21 @@ class AudioSimilarityApp(tk.Tk):
             if not feature_file:
                 messagebox.showwarning("Input Error", "Please specify the feature file.")
                 return
-            feature_manager_instance.set_feature_file(feature_file)
-
-        self.label_feature_file.config(text=f"Current Feature File: {feature_manager_instance.get_feature_file()}")
+            self.use_feature_file(feature_file)
 
-        top_n = simpledialog.askinteger("最相似的n个结果", "输入需要列出多少个相似结果:", initialvalue=10, minvalue=1, maxvalue=100)
+        top_n = simpledialog.askinteger("最相似的n个结果", "输入需要列出多少个相似结果:", initialvalue=10, minvalue=1,
+                                        maxvalue=MAX_RESULTS)
         if not top_n:
             return
         
-        # 设置线程个数
-        th_n = simpledialog.askinteger("线程数", "输入线程个数:", initialvalue=15, minvalue=1, maxvalue=100)
-        if not th_n:
-            th_n = 15
+        from similarity_metrics import parse_weights
+        metric = self.metric_names[self.metric_var.get()]
+        try:
+            weights = parse_weights(self.entry_weights.get())
+        except ValueError:
+            messagebox.showwarning("Input Error", "权重格式错误，例如: mfcc=1, chroma=1")
+            return
+        feature_manager_instance.update_settings(metric=metric, feature_weights=weights)
 
         self.stop_event.clear()
         self.progress_bar['value'] = 0
@@ -300,56 +500,93 @@ class AudioSimilarityApp(tk.Tk):
         self.update()
 
         # 使用线程来执行音频匹配任务
-        threading.Thread(target=self.find_similar_audios_in_thread, args=(target_file, top_n, th_n)).start()
+        threading.Thread(target=self.find_similar_audios_in_thread, args=(target_file, top_n, metric, weights)).start()
+
+    def find_similar_audios_in_thread(self, target_file, top_n, metric, weights):
+        from feature_schema import SchemaMismatch
 
-    def find_similar_audios_in_thread(self, target_file, top_n, th_n):
-        similarities = find_top_n_similar_audios(target_file, top_n, self.progress_bar, self.progress_label, self.stop_event, th_n)
+        try:
+            similarities = find_top_n_similar_audios(target_file, top_n, self.progress_bar, self.progress_label,
+                                                     self.stop_event, metric, weights)
+        except SchemaMismatch as e:
+            self.progress_label.config(text="特征文件需要更新")
+            messagebox.showerror("特征文件不兼容", str(e))
+            return
         self.run_find_similar_continue(similarities)
 
-    # 将原本的路径进行替换
-    def remap_paths(self, path):
-        # 获取用户输入的路径、原始根文件夹名称以及新的根路径
-        old_path = path
-        root_folder_name = feature_manager_instance.new_root_name
-        new_root_path = feature_manager_instance.new_folder_path
+    def locate_clip(self):
+        clip_file = self.entry_target.get()
+        if not clip_file:
+            messagebox.showwarning("Input Error", "Please select a target audio file.")
+            return
 
-        # 校验用户输入
-        if new_root_path == "" or root_folder_name == "":
-            print("没有设置替换路径或根文件夹名称")
-            return path
+        if feature_manager_instance.feature_file is None:
+            feature_file = filedialog.askopenfilename(filetypes=[("Pickle Files", "*.pkl")])
+            if not feature_file:
+                messagebox.showwarning("Input Error", "Please specify the feature file.")
+                return
+            self.use_feature_file(feature_file)
 
-        if not old_path or not root_folder_name or not new_root_path:
-            print("输入错误", "请确保所有输入框已填写完整并选择了新的根路径")
-            return path
+        top_n = simpledialog.askinteger("最匹配的n个结果", "输入需要列出多少个匹配结果:", initialvalue=10, minvalue=1,
+                                        maxvalue=MAX_RESULTS)
+        if not top_n:
+            return
 
-        # 处理输入路径，将 Windows 风格路径转换为 macOS/Linux 风格路径
-        old_path = feature_manager_instance.convert_path_for_platform(old_path)
+        self.stop_event.clear()
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text="Starting clip search...")
+        self.update()
 
-        # 检查输入的路径是否包含指定的根文件夹名称
-        if root_folder_name not in old_path:
-            print("路径错误", "指定的根文件夹名称不在输入的路径中")
-            return path
+        threading.Thread(target=self.locate_clip_in_thread, args=(clip_file, top_n)).start()
 
-        try:
-            # 替换路径中的根文件夹为新的路径
-            index = old_path.index(root_folder_name)
-            new_path = os.path.join(new_root_path, old_path[index + len(root_folder_name):].lstrip(os.sep))
+    def locate_clip_in_thread(self, clip_file, top_n):
+        matches = locate_audio_clip(clip_file, top_n, self.progress_bar, self.progress_label, self.stop_event)
+        if not matches:
+            if not self.stop_event.is_set():
+                self.progress_label.config(text="No matching track found.")
+            return
+
+        self.result_view.show(matches, score_label="Match", score_format='{:.3f}', offset_label="位置")
+        self.auditioner.prefetch(self.result_view.top_items(PREFETCH_COUNT))
+
+        self.progress_label.config(text="Clip search complete!")
+
+    def find_duplicates(self):
+        target_file = self.entry_target.get()
+        if not target_file:
+            messagebox.showwarning("Input Error", "Please select a target audio file.")
+            return
+
+        if feature_manager_instance.feature_file is None:
+            feature_file = filedialog.askopenfilename(filetypes=[("Pickle Files", "*.pkl")])
+            if not feature_file:
+                messagebox.showwarning("Input Error", "Please specify the feature file.")
+                return
+            self.use_feature_file(feature_file)
 
-            # 根据当前平台，调整新路径的格式
-            new_path = feature_manager_instance.convert_path_for_platform(new_path)
+        self.stop_event.clear()
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text="Looking up fingerprints...")
+        self.update()
 
-            # 保存当前设置
-            # save_settings(root_folder_name, new_root_path)
+        threading.Thread(target=self.find_duplicates_in_thread, args=(target_file,)).start()
 
-            # 更新当前设置显示
-            # update_current_settings()
+    def find_duplicates_in_thread(self, target_file):
+        matches = find_duplicate_audios(target_file, 10, self.progress_label, self.stop_event)
+        if self.stop_event.is_set():
+            return
+        if not matches:
+            self.progress_label.config(text="库中没有相同的音频")
+            return
 
-            # 显示重映射后的路径
-            # messagebox.showinfo("重映射成功", f"原路径:\n{old_path}\n\n新路径:\n{new_path}")
-        except Exception as e:
-            print("错误", f"发生错误: {str(e)}")
+        self.result_view.show(matches, score_label="Matches", offset_label="位置")
+        self.auditioner.prefetch(self.result_view.top_items(PREFETCH_COUNT))
 
-        return new_path
+        self.progress_label.config(text=f"库中已有 {len(matches)} 个相同的音频")
+
+    # 将原本的路径进行替换（查表，映射规则见 path_remap.py）
+    def remap_paths(self, path):
+        return feature_manager_instance.remap_path(path)
 
     def run_find_similar_continue(self, top_n_similar_files):
         if not top_n_similar_files:
@@ -358,22 +595,10 @@ class AudioSimilarityApp(tk.Tk):
 
         target_file = self.entry_target.get() # 原曲路径
 
-        self.listbox_result.delete(0, tk.END)
-
-        source_path = self.remap_paths(target_file)
-        file_name = os.path.basename(source_path)  # 只显示文件名
-        self.listbox_result.insert(tk.END, f">>> 双击我试听原音频 - {file_name}")
-        self.listbox_result.insert(tk.END, source_path)  # 隐藏文件路径，用于打开文件
-        self.listbox_result.itemconfig(tk.END, {'foreground': 'white'})  # 隐藏文本
-        
-        count = 1
-        for file_path, similarity in top_n_similar_files:
-            new_path = self.remap_paths(file_path)
-            file_name = os.path.basename(new_path)  # 只显示文件名
-            self.listbox_result.insert(tk.END, f"[{count}] {file_name} - Distence: {similarity:.4f}")
-            self.listbox_result.insert(tk.END, new_path)  # 隐藏文件路径，用于打开文件
-            self.listbox_result.itemconfig(tk.END, {'foreground': 'white'})  # 隐藏文本
-            count += 1
+        # 路径映射和文件名只在行被插入（滚动到）时计算
+        self.result_view.show([(file_path, similarity, None) for file_path, similarity in top_n_similar_files],
+                              score_label="Distance", score_format='{:.4f}', source=target_file)
+        self.auditioner.prefetch(self.result_view.top_items(PREFETCH_COUNT))
 
         self.progress_label.config(text="Comparison complete!")
 
@@ -381,39 +606,38 @@ class AudioSimilarityApp(tk.Tk):
         self.stop_event.set()
         self.progress_label.config(text="Cancelling task...")
 
-    def play_audio(self, event):
-        selected_item = self.listbox_result.curselection()
-        if selected_item:
-            file_path_index = selected_item[0] + 1  # 获取隐藏的路径行
-            if "Distence" in self.listbox_result.get(selected_item):  # 确保选择的是显示相似度的行
-                file_path = self.listbox_result.get(file_path_index)
-                open_audio_file(file_path)
-            elif ">>> 双击我试听原音频" in self.listbox_result.get(selected_item):
-                file_path = self.listbox_result.get(file_path_index)
-                open_audio_file(file_path)
+    # 双击结果行（或原音频行）时试听：片段定位/查重结果从匹配位置开始。
+    # 缓存未命中时需要解码，放到后台线程中，界面不卡顿
+    def play_audio(self, file_path, offset=None):
+        if file_path:
+            threading.Thread(target=self.auditioner.play, args=(file_path, offset), daemon=True).start()
 
     def set_feature_file(self):
         feature_file = filedialog.askopenfilename(defaultextension=".pkl", filetypes=[("Pickle Files", "*.pkl")])
         if feature_file:
-            feature_manager_instance.set_feature_file(feature_file)
-            self.label_feature_file.config(text=f"Current Feature File: {feature_file}")
-            messagebox.showinfo("Feature File Set", f"Feature file set to {feature_file}")
+            self.use_feature_file(feature_file)
+
+    # 切换特征文件：记住选择（下次启动自动加载），并立即在后台加载
+    def use_feature_file(self, feature_file):
+        feature_manager_instance.set_feature_file(feature_file)
+        feature_manager_instance.remember_feature_file()
+        self.preload_index()
 
     def show_context_menu(self, event):
         self.context_menu.tk_popup(event.x_root, event.y_root)
 
+    # 复制选中结果的文件名（不含扩展名）
     def copy_file_name(self):
-        selected_item = self.listbox_result.get(self.listbox_result.curselection())
-        if selected_item.startswith('['):
-            file_name = selected_item.split(" - ")[0]
-            file_name = file_name.split('.')[0]
-            file_name = file_name.split(']')[1].strip()
-        else:
-            file_name = selected_item
-        copy_to_clipboard(file_name)
+        file_path = self.result_view.selected_path()
+        if file_path:
+            copy_to_clipboard(os.path.splitext(os.path.basename(file_path))[0])
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
     app = AudioSimilarityApp()
     app.mainloop()
+    if app.watcher is not None:
+        app.watcher.stop()
+    app.auditioner.shutdown()
+    shutdown_shared_pool()
 
@@ -0,0 +1,124 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+import soundfile as sf
+import librosa
+
+# 音频解码后端
+# 统一输出单声道 float32 PCM，并重采样到分析采样率。
+#   soundfile: libsndfile 直接读取 wav/flac/ogg，速度最快
+#   ffmpeg:    通过子进程管道输出已经混音为单声道、已重采样的 float32 PCM，适合 mp3/wma 等压缩格式
+#   librosa:   librosa.load（audioread 回退），最慢，作为最后的兜底
+
+ANALYSIS_SR = 22050  # 特征提取使用的采样率
+
+# 每种格式的后端优先级（靠前的更快），不可用或解码失败时依次尝试后面的后端
+BACKEND_PREFERENCE = {
+    '.wav': ('soundfile', 'ffmpeg', 'librosa'),
+    '.flac': ('soundfile', 'ffmpeg', 'librosa'),
+    '.ogg': ('soundfile', 'ffmpeg', 'librosa'),
+    '.mp3': ('ffmpeg', 'soundfile', 'librosa'),
+    '.wma': ('ffmpeg', 'librosa'),
+}
+DEFAULT_PREFERENCE = ('ffmpeg', 'soundfile', 'librosa')
+
+FFMPEG_BINARY = shutil.which('ffmpeg')
+_SOUNDFILE_FORMATS = {'.' + name.lower() for name in sf.available_formats()}
+
+class DecodeError(Exception):
+    pass
+
+def _downmix(y):
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+def decode_soundfile(file_path, sr=ANALYSIS_SR, offset=0.0, duration=None):
+    with sf.SoundFile(file_path) as f:
+        native_sr = f.samplerate
+        if offset:
+            f.seek(int(offset * native_sr))
+        frames = -1 if duration is None else int(duration * native_sr)
+        y = _downmix(f.read(frames, dtype='float32', always_2d=True))
+    if sr is not None and native_sr != sr:
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+        return y, sr
+    return y, native_sr
+
+# ffmpeg 的命令行参数：-ac 1 混音为单声道，-ar 重采样，输出原始 float32 小端 PCM
+def ffmpeg_command(file_path, sr=ANALYSIS_SR, offset=0.0, duration=None, channels=1):
+    command = [FFMPEG_BINARY, '-v', 'error', '-nostdin']
+    if offset:
+        command += ['-ss', str(offset)]
+    command += ['-i', file_path]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-vn', '-f', 'f32le', '-acodec', 'pcm_f32le']
+    if channels is not None:
+        command += ['-ac', str(channels)]
+    if sr is not None:
+        command += ['-ar', str(sr)]
+    return command + ['-']
+
+def decode_ffmpeg(file_path, sr=ANALYSIS_SR, offset=0.0, duration=None):
+    if sr is None:
+        # 需要原始采样率时先读取文件头
+        sr = probe_samplerate(file_path)
+    result = subprocess.run(ffmpeg_command(file_path, sr, offset, duration),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise DecodeError(result.stderr.decode('utf-8', 'replace').strip())
+    return np.frombuffer(result.stdout, dtype='<f4').astype(np.float32, copy=False), sr
+
+def decode_librosa(file_path, sr=ANALYSIS_SR, offset=0.0, duration=None):
+    y, sr = librosa.load(file_path, sr=sr, mono=True, offset=offset, duration=duration)
+    return y.astype(np.float32, copy=False), sr
+
+BACKENDS = {
+    'soundfile': decode_soundfile,
+    'ffmpeg': decode_ffmpeg,
+    'librosa': decode_librosa,
+}
+
+# 只读取文件头得到采样率
+def probe_samplerate(file_path):
+    try:
+        return sf.info(file_path).samplerate
+    except Exception:
+        pass
+    if FFMPEG_BINARY:
+        ffprobe = shutil.which('ffprobe')
+        if ffprobe:
+            result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'a:0',
+                                     '-show_entries', 'stream=sample_rate', '-of', 'csv=p=0', file_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                return int(result.stdout.decode().strip().splitlines()[0])
+            except (ValueError, IndexError):
+                pass
+    return librosa.get_samplerate(file_path)
+
+def backend_available(name, ext):
+    if name == 'ffmpeg':
+        return FFMPEG_BINARY is not None
+    if name == 'soundfile':
+        return ext in _SOUNDFILE_FORMATS
+    return name in BACKENDS
+
+# 当前环境下某种格式可用的后端，按速度从快到慢排列
+def backends_for(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    return [name for name in BACKEND_PREFERENCE.get(ext, DEFAULT_PREFERENCE) if backend_available(name, ext)]
+
+# 解码音频文件为单声道 float32，返回 (y, sr)
+# backend 为 None 时按格式自动选择最快的可用后端，失败时依次回退
+def decode_audio(file_path, sr=ANALYSIS_SR, offset=0.0, duration=None, backend=None):
+    names = [backend] if backend else backends_for(file_path)
+    errors = []
+    for name in names:
+        try:
+            return BACKENDS[name](file_path, sr=sr, offset=offset, duration=duration)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    raise DecodeError(f"Failed to decode {file_path} ({'; '.join(errors) or 'no backend available'})")
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 支持的音频文件扩展名（匹配时不区分大小写）
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.wma')
+
+DEFAULT_SCAN_THREADS = 16  # 并行列目录的线程数，网络共享盘上可以适当调大
+
+_SENTINEL = object()
+
+# 判断文件名是否为音频文件（不区分大小写）
+def is_audio_file(file_name, extensions=AUDIO_EXTENSIONS):
+    return os.path.splitext(file_name)[1].lower() in extensions
+
+# 单次遍历的并行目录扫描器
+# 用 os.scandir 列目录，每个子目录作为一个任务交给线程池，发现的音频文件立即放入队列，
+# 调用方迭代扫描器即可边扫描边处理。total 为目前已发现的音频文件数，done 为 True 时即为准确总数。
+# with_size 为 True 时产出 (路径, 文件大小)，大小取自 scandir 的目录项，不需要额外遍历一次。
+class AudioScanner:
+    def __init__(self, root, extensions=AUDIO_EXTENSIONS, max_workers=DEFAULT_SCAN_THREADS, stop_event=None,
+                 with_size=False):
+        self.root = root
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.max_workers = max_workers
+        self.stop_event = stop_event
+        self.with_size = with_size
+        self.total = 0
+        self.done = False
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._visited = set()
+        self._pending = 0
+        self._executor = None
+
+    # 用 (st_dev, st_ino) 识别目录，防止符号链接造成的循环和重复扫描
+    def _mark_visited(self, path):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            print(f"Error scanning {path}: {e}")
+            return False
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            if key in self._visited:
+                return False
+            self._visited.add(key)
+            return True
+
+    def _submit(self, path):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._scan_dir, path)
+
+    def _scan_dir(self, path):
+        try:
+            if self.stop_event is not None and self.stop_event.is_set():
+                return
+            audio_files = []
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if self._mark_visited(entry.path):
+                                self._submit(entry.path)
+                        elif entry.is_file() and is_audio_file(entry.name, self.extensions):
+                            audio_files.append((entry.path, entry.stat().st_size) if self.with_size else entry.path)
+                    except OSError as e:
+                        print(f"Error scanning {entry.path}: {e}")
+            if audio_files:
+                with self._lock:
+                    self.total += len(audio_files)
+                for file_path in audio_files:
+                    self._queue.put(file_path)
+        except OSError as e:
+            print(f"Error scanning {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                finished = self._pending == 0
+            if finished:
+                self.done = True
+                self._queue.put(_SENTINEL)
+
+    # 在后台开始扫描
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        if self._mark_visited(self.root):
+            self._submit(self.root)
+        else:
+            self.done = True
+            self._queue.put(_SENTINEL)
+        return self
+
+    # 逐个返回发现的音频文件路径（with_size 时为 (路径, 大小)）
+    def __iter__(self):
+        if self._executor is None:
+            self.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _SENTINEL:
+                    break
+                yield item
+        finally:
+            self._executor.shutdown(wait=False)
+
+# 扫描整个目录，返回全部音频文件路径列表
+def scan_audio_files(root, extensions=AUDIO_EXTENSIONS, max_workers=DEFAULT_SCAN_THREADS):
+    return list(AudioScanner(root, extensions, max_workers))
@@ -0,0 +1,155 @@
+import numpy as np
+import librosa
+from scipy.spatial.distance import cosine
+from scipy.ndimage import maximum_filter
+from audio_decoder import decode_audio
+from feature_schema import HOP_LENGTH, FEATURE_COLUMNS
+
+# 在工作进程中执行的函数
+# 本模块只导入计算需要的库（不导入 tkinter 和 GUI），spawn 方式启动的工作进程只需要导入它。
+
+FRAME_BLOCK = 8  # 帧序列每 8 帧（约 0.19 秒）取一次均值后保存，用于片段定位
+FRAME_FEATURES = ('chroma', 'mfcc')  # 帧序列中各特征的排列顺序
+SILENCE_THRESH_DB = -50.0  # 跳过静音时，RMS 低于该值（dBFS）的帧不参与特征均值
+
+# 各特征列的计算函数，参数见 feature_schema.FEATURE_COLUMNS
+FEATURE_FUNCTIONS = {
+    'mfcc': librosa.feature.mfcc,
+    'chroma': librosa.feature.chroma_stft,
+}
+
+# 逐帧的特征矩阵（特征维度, 帧数），columns 为需要计算的特征列（None 为全部）
+def compute_feature_frames(y, sr, columns=None):
+    return {name: FEATURE_FUNCTIONS[name](y=y, sr=sr, **FEATURE_COLUMNS[name])
+            for name in (FEATURE_COLUMNS if columns is None else columns)}
+
+# 非静音帧：RMS 不低于 silence_thresh（dBFS）的帧。与 mfcc/chroma 使用相同的窗长和帧移，逐帧对齐
+def non_silent_frames(y, silence_thresh):
+    rms = librosa.feature.rms(y=y, frame_length=2048, hop_length=HOP_LENGTH)[0]
+    return rms >= 10 ** (silence_thresh / 20)
+
+# 计算每种特征在所有帧上的和与帧数，分段提取的结果可以直接相加后再求均值
+# silence_thresh 不为 None 时跳过静音帧，效果与先清洗掉静音再提取相同，但只需解码一次
+def compute_feature_sums(y, sr, frames=None, silence_thresh=None):
+    if frames is None:
+        frames = compute_feature_frames(y, sr)
+    if silence_thresh is not None:
+        keep = non_silent_frames(y, silence_thresh)
+        frames = {name: matrix[:, keep[:matrix.shape[1]]] for name, matrix in frames.items()}
+    return {name: (matrix.sum(axis=1), matrix.shape[1]) for name, matrix in frames.items()}
+
+# 把逐帧特征按 FRAME_BLOCK 帧求均值并拼接成 (块数, 维度) 的 float16 序列
+def pool_frames(frames):
+    matrix = np.concatenate([frames[name] for name in FRAME_FEATURES], axis=0).T
+    blocks = len(matrix) // FRAME_BLOCK
+    if blocks == 0:
+        return np.zeros((0, matrix.shape[1]), dtype=np.float16)
+    pooled = matrix[:blocks * FRAME_BLOCK].reshape(blocks, FRAME_BLOCK, -1).mean(axis=1)
+    return pooled.astype(np.float16)
+
+FP_N_FFT = 2048  # 指纹频谱的窗长
+FP_HOP = 512  # 指纹频谱的帧移（约 23 毫秒）
+FP_NEIGHBORHOOD = (21, 21)  # 峰值需要是 (频率, 时间) 邻域内的最大值，控制峰值密度
+FP_FLOOR_DB = -50.0  # 比最大值低这么多的峰值不使用（静音和噪声）
+FP_PEAKS_PER_SECOND = 15  # 每秒最多保留的（最强）峰值数，控制指纹索引的大小
+FP_FAN_OUT = 3  # 每个锚点峰值与之后的几个峰值组成地标
+FP_MAX_DT = 63  # 地标两个峰值的最大时间差（帧，6 位）
+
+# 频谱峰值地标指纹：每对峰值 (f1, f2, dt) 打包成 26 位哈希，time 为锚点所在的帧
+# time_offset 为片段起点对应的帧数，分段提取的结果可以直接拼接
+def compute_landmarks(y, sr, time_offset=0):
+    spectrum = np.abs(librosa.stft(y, n_fft=FP_N_FFT, hop_length=FP_HOP))
+    if spectrum.size == 0 or spectrum.max() <= 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int32)
+    db = librosa.amplitude_to_db(spectrum, ref=np.max)
+    peaks = (db == maximum_filter(db, size=FP_NEIGHBORHOOD)) & (db > FP_FLOOR_DB)
+    freqs, times = np.nonzero(peaks)
+    # 每秒只保留最强的 FP_PEAKS_PER_SECOND 个峰值
+    buckets = times // max(int(round(sr / FP_HOP)), 1)
+    order = np.lexsort((-db[freqs, times], buckets))
+    bucket_start = np.searchsorted(buckets[order], buckets[order])
+    order = order[np.arange(len(order)) - bucket_start < FP_PEAKS_PER_SECOND]
+    freqs, times = freqs[order], times[order]
+    order = np.lexsort((freqs, times))
+    freqs, times = np.minimum(freqs[order], 1023), times[order]
+
+    hashes = []
+    anchors = []
+    for k in range(1, FP_FAN_OUT + 1):
+        f1, f2 = freqs[:-k], freqs[k:]
+        dt = times[k:] - times[:-k]
+        keep = (dt >= 1) & (dt <= FP_MAX_DT)
+        hashes.append((f1[keep].astype(np.uint32) << 16) | (f2[keep].astype(np.uint32) << 6) | dt[keep].astype(np.uint32))
+        anchors.append(times[:-k][keep])
+    return (np.concatenate(hashes).astype(np.uint32),
+            (np.concatenate(anchors) + time_offset).astype(np.int32))
+
+# 解码并提取一个片段的特征和。需要帧序列（片段定位）或地标指纹（查重）时返回 (特征和, {'frames': ..., 'landmarks': ...})
+# 帧序列保留静音部分，保证片段定位得到的时间位置不变
+# columns 只计算指定的特征列（重新计算过期的列时使用）
+def extract_segment(file_path, offset=0.0, duration=None, keep_frames=False, keep_landmarks=False, silence_thresh=None,
+                    columns=None):
+    y, sr = decode_audio(file_path, offset=offset, duration=duration)
+    needed = columns
+    if columns is not None and keep_frames:
+        # 帧序列需要 FRAME_FEATURES 中的全部特征
+        needed = list(columns) + [name for name in FRAME_FEATURES if name not in columns]
+    frames = compute_feature_frames(y, sr, needed)
+    sums = compute_feature_sums(y, sr, {name: frames[name] for name in (frames if columns is None else columns)}, silence_thresh)
+    if not (keep_frames or keep_landmarks):
+        return sums
+    extras = {}
+    if keep_frames:
+        extras['frames'] = pool_frames(frames)
+    if keep_landmarks:
+        extras['landmarks'] = compute_landmarks(y, sr, int(round(offset * sr / FP_HOP)))
+    return sums, extras
+
+# 合并多个片段的特征和
+def merge_feature_sums(total, part):
+    if total is None:
+        return dict(part)
+    merged = {}
+    for name, (values, count) in part.items():
+        if name in total:
+            merged[name] = (total[name][0] + values, total[name][1] + count)
+        else:
+            merged[name] = (values, count)
+    return merged
+
+# 特征和 -> 特征均值
+def finalize_features(sums):
+    features = {}
+    for name, (values, count) in sums.items():
+        if count > 0:
+            features[name] = (values / count).astype(np.float32)
+    return features
+
+# 音频特征提取函数
+def extract_features(file_path, stop_event=None, silence_thresh=None):
+    try:
+        # 按格式自动选择最快的解码后端，输出已混音为单声道并重采样到分析采样率
+        # 特征为 mfcc 和 chroma 在所有（非静音）帧上的均值
+        return finalize_features(extract_segment(file_path, silence_thresh=silence_thresh))
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+# 单条比较（旧接口），批量搜索使用 similarity_metrics.rank
+def calculate_similarity(row, target_features, features):
+    similarity_scores = []
+    for feature in ['mfcc', 'chroma']:
+        if feature in target_features and feature in features:
+            # distance = np.linalg.norm(target_features[feature] - features[feature])
+            distance = abs(1/(1 - cosine(target_features[feature], features[feature])))
+            similarity_scores.append(distance)
+
+    if similarity_scores:
+        return row, np.mean(similarity_scores)
+    else:
+        return row, float('inf')
+
+# 工作进程预热：提前导入 librosa 并编译 numba 内核，第一次真正提取时不再有额外延迟
+def warm_up():
+    y = np.random.default_rng(0).standard_normal(22050).astype(np.float32) * 1e-3
+    compute_feature_sums(y, 22050)
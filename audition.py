@@ -0,0 +1,152 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 程序内试听：结果出来后在后台把前几个结果的一小段（有匹配位置时从匹配位置开始）解码到内存，
+# 双击时直接从缓存播放，不需要启动外部播放器再从头解码。
+# 缓存按解码后的字节数限制大小，超出时淘汰最久没有用到的片段。
+# 播放使用可选依赖 sounddevice；没有安装（或没有可用的声卡）时回退到外部播放器。
+
+PREVIEW_SECONDS = 15.0  # 每个试听片段的长度
+PREVIEW_LEAD_IN = 1.0  # 有匹配位置时提前这么多秒开始，听得到匹配段的开头
+PREFETCH_COUNT = 20  # 结果出来后预先解码的结果数
+PREFETCH_WORKERS = 2
+CACHE_BYTES = 64 * 1024 * 1024  # 试听缓存的上限
+
+def _sounddevice():
+    try:
+        import sounddevice
+        return sounddevice
+    except (ImportError, OSError):
+        return None
+
+# 按字节数限制大小的 LRU 缓存：键为 (路径, 起始秒数)，值为 (PCM, 采样率)
+class ExcerptCache:
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, y, sr):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (y, sr)
+            self.size += y.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (old, _) = self.entries.popitem(last=False)
+                self.size -= old.nbytes
+
+class Auditioner:
+    def __init__(self, fallback=None, max_bytes=CACHE_BYTES):
+        self.fallback = fallback
+        self.cache = ExcerptCache(max_bytes)
+        self.executor = None
+        self.pending = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self._available = None
+
+    # 是否可以在程序内播放（安装了 sounddevice 并且有输出设备），只检查一次
+    def available(self):
+        if self._available is None:
+            sd = _sounddevice()
+            try:
+                self._available = sd is not None and bool(sd.query_devices(kind='output'))
+            except Exception:
+                self._available = False
+        return self._available
+
+    @staticmethod
+    def _key(file_path, offset):
+        start = max(offset - PREVIEW_LEAD_IN, 0.0) if offset else 0.0
+        return file_path, round(start, 2)
+
+    # 解码一个试听片段放入缓存；generation 为预取批次，已经换了一批结果时旧的预取任务直接跳过
+    def _decode(self, key, generation=None):
+        from audio_decoder import decode_audio
+
+        if generation is not None and generation != self.generation:
+            with self.lock:
+                self.pending.pop(key, None)
+            return
+        try:
+            if self.cache.get(key) is None:
+                y, sr = decode_audio(key[0], offset=key[1], duration=PREVIEW_SECONDS)
+                self.cache.put(key, y, sr)
+        except Exception as e:
+            print(f"Error decoding preview of {key[0]}: {e}")
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def _submit(self, key, generation):
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+            future = self.executor.submit(self._decode, key, generation)
+            self.pending[key] = future
+            return future
+
+    # 后台预先解码一组结果 [(路径, 匹配位置或 None)]，之前没开始的预取任务作废
+    def prefetch(self, items):
+        if not self.available():
+            return
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        for file_path, offset in list(items)[:PREFETCH_COUNT]:
+            key = self._key(file_path, offset)
+            if self.cache.get(key) is None:
+                self._submit(key, generation)
+
+    # 播放一个结果：命中缓存时立即播放，正在预取时等它完成，否则当场解码这一段；
+    # 不能在程序内播放时交给外部播放器。可能需要等待解码，界面上应在后台线程中调用
+    def play(self, file_path, offset=None):
+        if not self.available():
+            if self.fallback is not None:
+                self.fallback(file_path)
+            return
+        sd = _sounddevice()
+        key = self._key(file_path, offset)
+        entry = self.cache.get(key)
+        if entry is None:
+            with self.lock:
+                future = self.pending.get(key)
+            if future is not None:
+                future.result()
+                entry = self.cache.get(key)
+        if entry is None:
+            self._decode(key)
+            entry = self.cache.get(key)
+        if entry is None:
+            # 解码失败，交给外部播放器
+            if self.fallback is not None:
+                self.fallback(file_path)
+            return
+        y, sr = entry
+        sd.stop()
+        sd.play(y, sr)
+
+    def stop(self):
+        sd = _sounddevice()
+        if sd is not None:
+            try:
+                sd.stop()
+            except Exception:
+                pass
+
+    def shutdown(self):
+        self.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
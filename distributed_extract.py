@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import uuid
+import socket
+import argparse
+import threading
+import multiprocessing
+import joblib
+from extraction_scheduler import extract_files, default_memory_budget
+from supervised_pool import available_cores, plan_workers, get_shared_pool
+from audio_worker import SILENCE_THRESH_DB
+from audio_scanner import scan_audio_files
+from feature_manager_gai import feature_manager_instance
+
+# 分布式特征提取：把文件列表拆成若干工作单元放在共享目录（队列目录）里，
+# 多台机器/多个进程各自领取单元并提取特征，最后合并成一个特征文件。
+#
+# 队列目录结构:
+#   manifest.json          任务信息
+#   units/unit_000001.json 工作单元（文件路径列表）
+#   leases/unit_000001.lease  租约文件，mtime 即心跳时间
+#   shards/unit_000001.pkl    单元提取结果（部分特征）
+
+DEFAULT_UNIT_SIZE = 200  # 每个工作单元包含的文件数
+DEFAULT_LEASE_SECONDS = 600  # 租约超时时间（秒），超时未心跳的单元会被回收
+
+def _unit_dirs(queue_dir):
+    return (os.path.join(queue_dir, 'units'),
+            os.path.join(queue_dir, 'leases'),
+            os.path.join(queue_dir, 'shards'))
+
+# 写文件时先写临时文件再重命名，保证其他节点看不到写了一半的文件
+def _atomic_write_json(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# 创建队列：把文件列表切分成工作单元
+# silence_thresh 为提取参数，记录在 manifest.json 中，所有工作节点使用相同的参数
+def create_work_units(search_path, queue_dir, unit_size=DEFAULT_UNIT_SIZE, silence_thresh=None):
+    units_dir, leases_dir, shards_dir = _unit_dirs(queue_dir)
+    for d in (units_dir, leases_dir, shards_dir):
+        os.makedirs(d, exist_ok=True)
+
+    file_list = scan_audio_files(search_path)
+    unit_count = 0
+    for start in range(0, len(file_list), unit_size):
+        unit_count += 1
+        unit_path = os.path.join(units_dir, f"unit_{unit_count:06d}.json")
+        _atomic_write_json(unit_path, file_list[start:start + unit_size])
+
+    _atomic_write_json(os.path.join(queue_dir, 'manifest.json'), {
+        'search_path': search_path,
+        'unit_size': unit_size,
+        'units': unit_count,
+        'files': len(file_list),
+        'silence_thresh': silence_thresh,
+        'created': time.time(),
+    })
+    print(f"Created {unit_count} work units for {len(file_list)} files in {queue_dir}")
+    return unit_count
+
+def _unit_names(queue_dir):
+    units_dir, _, _ = _unit_dirs(queue_dir)
+    return sorted(name[:-len('.json')] for name in os.listdir(units_dir) if name.endswith('.json'))
+
+# 回收超时的租约：租约文件的 mtime 超过 lease_seconds 没有更新就认为领取者已经失效
+def reclaim_expired_leases(queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS):
+    _, leases_dir, shards_dir = _unit_dirs(queue_dir)
+    now = time.time()
+    reclaimed = 0
+    for name in os.listdir(leases_dir):
+        if not name.endswith('.lease'):
+            continue
+        lease_path = os.path.join(leases_dir, name)
+        try:
+            expired = now - os.path.getmtime(lease_path) > lease_seconds
+        except FileNotFoundError:
+            continue
+        unit_name = name[:-len('.lease')]
+        if os.path.exists(os.path.join(shards_dir, unit_name + '.pkl')):
+            continue
+        if expired:
+            # 先重命名再删除，重命名是原子操作，多个节点同时回收时只有一个会成功
+            tombstone = f"{lease_path}.expired.{uuid.uuid4().hex}"
+            try:
+                os.rename(lease_path, tombstone)
+                os.remove(tombstone)
+                reclaimed += 1
+                print(f"Reclaimed expired lease: {unit_name}")
+            except FileNotFoundError:
+                pass
+    return reclaimed
+
+# 领取一个未完成且未被占用的工作单元，返回单元名；没有可领取的单元时返回 None
+def claim_unit(queue_dir, worker_id):
+    _, leases_dir, shards_dir = _unit_dirs(queue_dir)
+    for unit_name in _unit_names(queue_dir):
+        if os.path.exists(os.path.join(shards_dir, unit_name + '.pkl')):
+            continue
+        lease_path = os.path.join(leases_dir, unit_name + '.lease')
+        try:
+            # O_EXCL 保证同一个单元只会被一个进程领取
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': worker_id, 'claimed_at': time.time()}, f)
+        return unit_name
+    return None
+
+# 租约当前的持有者；租约不存在或内容不完整时返回 None
+def _lease_owner(lease_path):
+    try:
+        with open(lease_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('worker')
+    except (FileNotFoundError, ValueError):
+        return None
+
+# 租约心跳线程：定期更新租约文件的 mtime
+# 租约超时被回收、又被其他节点重新领取后，租约文件属于新的领取者，不能再替它心跳
+def _heartbeat(lease_path, worker_id, interval, done_event):
+    while not done_event.wait(interval):
+        if _lease_owner(lease_path) != worker_id:
+            # 租约已被回收，结果仍会写入（写入是幂等的），只是可能重复计算
+            print(f"Lease lost: {lease_path}")
+            return
+        try:
+            os.utime(lease_path)
+        except FileNotFoundError:
+            print(f"Lease lost: {lease_path}")
+            return
+
+# 释放租约：只删除仍属于自己的租约，不删除其他节点重新领取后创建的租约
+def _release_lease(lease_path, worker_id):
+    if _lease_owner(lease_path) != worker_id:
+        return
+    try:
+        os.remove(lease_path)
+    except FileNotFoundError:
+        pass
+
+# 处理一个工作单元并写出特征分片
+# memory_budget 为本节点解码内存的上限（字节），None 时按物理内存自动确定
+def process_unit(queue_dir, unit_name, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, stop_event=None, workers=1,
+                 memory_budget=None):
+    units_dir, leases_dir, shards_dir = _unit_dirs(queue_dir)
+    lease_path = os.path.join(leases_dir, unit_name + '.lease')
+    with open(os.path.join(units_dir, unit_name + '.json'), 'r', encoding='utf-8') as f:
+        file_list = json.load(f)
+    with open(os.path.join(queue_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        silence_thresh = json.load(f).get('silence_thresh')
+
+    done_event = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(lease_path, worker_id, max(lease_seconds / 3, 1), done_event), daemon=True)
+    heartbeat.start()
+    try:
+        # 每个文件在有超时保护的子进程中提取，失败的文件记入隔离列表
+        audio_features, failures = extract_files(file_list, max_workers=workers, stop_event=stop_event,
+                                                 silence_thresh=silence_thresh, memory_budget=memory_budget)
+        if stop_event is not None and stop_event.is_set():
+            return False
+
+        shard_path = os.path.join(shards_dir, unit_name + '.pkl')
+        tmp_path = f"{shard_path}.{uuid.uuid4().hex}.tmp"
+        joblib.dump({'features': audio_features, 'quarantine': failures}, tmp_path)
+        os.replace(tmp_path, shard_path)
+        return True
+    finally:
+        done_event.set()
+        heartbeat.join()
+        _release_lease(lease_path, worker_id)
+
+# 本节点上 processes 个工作进程各自的 (提取进程数, 每个提取进程的内部线程数)：可用核心在工作进程之间平分，
+# 每个工作进程的进程池按分到的核心数开进程、每个进程一个线程，整个节点的线程总数不超过核心数
+def node_worker_plan(processes=1):
+    return plan_workers(cores=max(available_cores() // processes, 1))
+
+# 工作进程主循环：回收超时租约 -> 领取单元 -> 提取 -> 直到没有剩余单元
+# workers / threads_per_worker 为本进程的提取进程数和内部线程数，None 时按 node_worker_plan 独占本节点
+def run_worker(queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS, worker_id=None, memory_budget=None, workers=None,
+               threads_per_worker=None):
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    if workers is None:
+        workers, threads_per_worker = node_worker_plan()
+    # 先按计划创建共享进程池，之后的提取都使用它
+    get_shared_pool(workers, threads_per_worker)
+    processed = 0
+    while True:
+        reclaim_expired_leases(queue_dir, lease_seconds)
+        unit_name = claim_unit(queue_dir, worker_id)
+        if unit_name is None:
+            # 没有可领取的单元，但可能还有其他节点正在处理的单元，其租约过期后需要重新领取
+            if queue_status(queue_dir)['pending'] == 0:
+                break
+            time.sleep(min(lease_seconds / 3, 30))
+            continue
+        print(f"[{worker_id}] Processing {unit_name}")
+        if process_unit(queue_dir, unit_name, worker_id, lease_seconds, workers=workers, memory_budget=memory_budget):
+            processed += 1
+    print(f"[{worker_id}] Finished, processed {processed} units")
+    return processed
+
+# 在本机启动多个工作进程，内存预算和核心由各进程平分
+def run_local_workers(queue_dir, processes, lease_seconds=DEFAULT_LEASE_SECONDS, memory_budget=None):
+    if memory_budget is None:
+        memory_budget = default_memory_budget()
+    pool_workers, threads_per_worker = node_worker_plan(processes)
+    workers = [multiprocessing.Process(target=run_worker, args=(queue_dir, lease_seconds),
+                                       kwargs={'memory_budget': memory_budget // processes, 'workers': pool_workers,
+                                               'threads_per_worker': threads_per_worker})
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+# 队列状态统计
+def queue_status(queue_dir):
+    _, leases_dir, shards_dir = _unit_dirs(queue_dir)
+    units = _unit_names(queue_dir)
+    done = sum(1 for name in units if os.path.exists(os.path.join(shards_dir, name + '.pkl')))
+    leased = sum(1 for name in units
+                 if not os.path.exists(os.path.join(shards_dir, name + '.pkl'))
+                 and os.path.exists(os.path.join(leases_dir, name + '.lease')))
+    return {'units': len(units), 'done': done, 'leased': leased, 'pending': len(units) - done}
+
+# 合并所有分片为一个特征文件，FeatureManager 可以直接加载
+def merge_shards(queue_dir, feature_file, allow_partial=False):
+    _, _, shards_dir = _unit_dirs(queue_dir)
+    status = queue_status(queue_dir)
+    if status['pending'] and not allow_partial:
+        raise RuntimeError(f"{status['pending']} of {status['units']} work units are not finished")
+
+    audio_features = {}
+    quarantine = {}
+    for unit_name in _unit_names(queue_dir):
+        shard_path = os.path.join(shards_dir, unit_name + '.pkl')
+        if os.path.exists(shard_path):
+            shard = joblib.load(shard_path)
+            audio_features.update(shard['features'])
+            quarantine.update(shard['quarantine'])
+
+    with open(os.path.join(queue_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    feature_manager_instance.set_feature_file(feature_file)
+    feature_manager_instance.save_features(audio_features, roots=[manifest['search_path']], quarantine=quarantine,
+                                           params={'silence_thresh': manifest.get('silence_thresh')})
+    print(f"Merged {len(audio_features)} entries into {feature_file}, {len(quarantine)} files quarantined")
+    return len(audio_features)
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式音频特征提取")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_init = subparsers.add_parser('init', help="扫描目录并创建工作单元")
+    parser_init.add_argument('search_path')
+    parser_init.add_argument('queue_dir')
+    parser_init.add_argument('--unit-size', type=int, default=DEFAULT_UNIT_SIZE)
+    parser_init.add_argument('--skip-silence', action='store_true', help="特征均值跳过静音帧")
+
+    parser_worker = subparsers.add_parser('worker', help="领取并处理工作单元")
+    parser_worker.add_argument('queue_dir')
+    parser_worker.add_argument('--processes', type=int, default=1)
+    parser_worker.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+    parser_worker.add_argument('--memory-budget', type=int, default=None,
+                               help="本节点解码内存上限（MB），默认为物理内存的一半")
+
+    parser_status = subparsers.add_parser('status', help="查看队列进度")
+    parser_status.add_argument('queue_dir')
+
+    parser_merge = subparsers.add_parser('merge', help="合并分片为特征文件")
+    parser_merge.add_argument('queue_dir')
+    parser_merge.add_argument('feature_file')
+    parser_merge.add_argument('--allow-partial', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'init':
+        create_work_units(args.search_path, args.queue_dir, args.unit_size,
+                          SILENCE_THRESH_DB if args.skip_silence else None)
+    elif args.command == 'worker':
+        memory_budget = args.memory_budget << 20 if args.memory_budget else None
+        if args.processes > 1:
+            run_local_workers(args.queue_dir, args.processes, args.lease_seconds, memory_budget)
+        else:
+            run_worker(args.queue_dir, args.lease_seconds, memory_budget=memory_budget)
+    elif args.command == 'status':
+        print(queue_status(args.queue_dir))
+    elif args.command == 'merge':
+        merge_shards(args.queue_dir, args.feature_file, args.allow_partial)
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,229 @@
+import os
+import heapq
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+import soundfile as sf
+from audio_worker import extract_segment, merge_feature_sums, finalize_features
+from audio_decoder import ANALYSIS_SR
+from supervised_pool import get_shared_pool
+
+# 特征提取调度器
+# 并行提取时按时长从长到短派发任务（最长任务优先），超长文件切成多个片段分别提取再合并，
+# 避免最后剩下一个 90 分钟的文件让其他核心空闲。
+# 内存预算：每个片段解码后的内存按 文件头时长 x 采样率 x 声道数 x 4 字节（float32）估计，
+# 在途片段的估计内存之和不超过预算时才派发新片段；单个片段就超过预算的文件（高采样率、多声道的长录音）
+# 按预算切成更短的片段流式处理，不会一次解码整个文件。
+
+DEFAULT_SEGMENT_SECONDS = 300.0  # 超过该时长 1.5 倍的文件会被切成这么长的片段
+BASE_TIMEOUT_SECONDS = 60.0  # 每个片段的基础超时时间
+TIMEOUT_PER_AUDIO_SECOND = 0.5  # 每秒音频额外允许的处理时间
+
+# 根据文件大小粗略估计时长时使用的字节率（字节/秒）
+_BYTES_PER_SECOND = {
+    '.mp3': 16000,   # 约 128 kbps
+    '.wma': 16000,
+    '.ogg': 16000,
+    '.flac': 88200,  # 约为 wav 的一半
+    '.wav': 176400,  # 44.1 kHz 16 bit 立体声
+}
+_DEFAULT_STREAM = (44100, 2)  # 读不到文件头时假定的采样率和声道数
+
+MIN_SEGMENT_SECONDS = 30.0  # 按内存预算切分时片段的最短时长
+DECODE_BYTES_PER_SAMPLE = 4  # 解码为 float32
+
+# 默认内存预算：物理内存的一半，取不到物理内存大小时为 4 GB
+def default_memory_budget():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 << 30
+
+# 便宜地读取 (时长, 采样率, 声道数)：能读文件头的格式用 soundfile.info，否则按文件大小估算时长
+def probe_audio(file_path, size=None):
+    try:
+        info = sf.info(file_path)
+        if info.duration > 0:
+            return info.duration, info.samplerate, info.channels
+    except Exception:
+        pass
+    if size is None:
+        try:
+            size = os.stat(file_path).st_size
+        except OSError:
+            return (0.0,) + _DEFAULT_STREAM
+    ext = os.path.splitext(file_path)[1].lower()
+    return (size / _BYTES_PER_SECOND.get(ext, 16000),) + _DEFAULT_STREAM
+
+def estimate_duration(file_path, size=None):
+    return probe_audio(file_path, size)[0]
+
+# 每秒音频解码时占用的内存：原始采样率、声道数的 float32 数据，加上重采样后的单声道分析信号
+def decode_bytes_per_second(samplerate, channels):
+    return (samplerate * channels + ANALYSIS_SR) * DECODE_BYTES_PER_SAMPLE
+
+# 把文件拆成 (offset, duration) 片段，短文件只有一个片段 (0, None)
+def plan_segments(duration, segment_seconds=DEFAULT_SEGMENT_SECONDS):
+    if duration <= segment_seconds * 1.5:
+        return [(0.0, None)]
+    segments = []
+    offset = 0.0
+    while offset < duration:
+        length = min(segment_seconds, duration - offset)
+        # 最后一段不足半段时并入前一段
+        if duration - offset - length < segment_seconds / 2:
+            segments.append((offset, None))
+            break
+        segments.append((offset, length))
+        offset += length
+    return segments
+
+# 片段的墙钟超时时间随时长增加
+def segment_timeout(duration):
+    return BASE_TIMEOUT_SECONDS + duration * TIMEOUT_PER_AUDIO_SECOND
+
+# 在内存预算内允许的片段时长：单个片段最多占用预算的一半，留出给其他进程的余量
+def budget_segment_seconds(memory_budget, samplerate, channels):
+    return max(memory_budget / 2 / decode_bytes_per_second(samplerate, channels), MIN_SEGMENT_SECONDS)
+
+class _FileJob:
+    __slots__ = ('path', 'remaining', 'sums', 'extras', 'error')
+
+    def __init__(self, path, segments):
+        self.path = path
+        self.remaining = segments
+        self.sums = None
+        self.extras = []  # (offset, 帧序列/指纹)，片段完成顺序不固定，结束时按 offset 拼接
+        self.error = None
+
+# max_workers 只在共享进程池还没有创建时决定池的进程数；池已经启动时沿用池的大小。
+# 在途片段数始终按池实际的进程数计算，避免 max_workers 与池大小不一致时进程空闲，
+# 或者多出来的片段排在池的队列里、绕过内存预算的统计
+class ExtractionScheduler:
+    def __init__(self, max_workers=None, segment_seconds=DEFAULT_SEGMENT_SECONDS, stop_event=None, skip=None,
+                 silence_thresh=None, memory_budget=None, columns=None):
+        self.pool = get_shared_pool(max_workers)
+        self.segment_seconds = segment_seconds
+        self.memory_budget = memory_budget or default_memory_budget()  # 在途片段解码内存的上限（字节）
+        self.stop_event = stop_event or threading.Event()
+        self.heap = []  # (-片段时长, 序号, 文件任务, offset, duration, 片段时长, 估计内存)
+        self.lock = threading.Lock()
+        self.new_work = threading.Event()
+        self.feeding_done = False
+        self.counter = 0
+        self.skip = skip  # 返回 True 的文件不提取（例如隔离列表中的文件）
+        self.silence_thresh = silence_thresh  # 不为 None 时特征均值跳过静音帧
+        self.columns = columns  # 只提取这些特征列（None 为全部）
+
+    # 在后台线程里消费文件迭代器（可以是仍在扫描中的 AudioScanner），估计时长并放入优先队列
+    def _feed(self, file_iter):
+        try:
+            for file_path in file_iter:
+                if self.stop_event.is_set():
+                    break
+                if self.skip is not None and self.skip(file_path):
+                    continue
+                duration, samplerate, channels = probe_audio(file_path)
+                rate = decode_bytes_per_second(samplerate, channels)
+                segment_seconds = min(self.segment_seconds, budget_segment_seconds(self.memory_budget, samplerate, channels))
+                segments = plan_segments(duration, segment_seconds)
+                job = _FileJob(file_path, len(segments))
+                with self.lock:
+                    for offset, length in segments:
+                        seg_duration = length if length is not None else max(duration - offset, 0.0)
+                        heapq.heappush(self.heap, (-seg_duration, self.counter, job, offset, length, seg_duration,
+                                                   int(seg_duration * rate)))
+                        self.counter += 1
+                self.new_work.set()
+        finally:
+            self.feeding_done = True
+            self.new_work.set()
+
+    # 取出下一个片段；它的估计内存加上在途内存超过预算时先不派发（没有在途片段时总是派发，保证能继续）
+    def _pop(self, in_flight_bytes=0):
+        with self.lock:
+            if self.heap and (in_flight_bytes == 0 or in_flight_bytes + self.heap[0][-1] <= self.memory_budget):
+                return heapq.heappop(self.heap)
+        return None
+
+    # 执行提取，每个文件完成后调用 on_file_done(路径, 特征, 错误)，失败时特征为 None
+    # 每个片段在共享进程池的子进程中执行并有墙钟超时，卡住或崩溃的进程会被替换，只有当前文件失败
+    # 传入 on_frames 时同时保留帧序列（片段定位用），成功的文件在 on_file_done 之前调用 on_frames(路径, 帧序列)
+    # 传入 on_landmarks 时同时提取地标指纹（查重用），调用 on_landmarks(路径, (哈希, 时间))
+    def run(self, file_iter, on_file_done, on_frames=None, on_landmarks=None):
+        feeder = threading.Thread(target=self._feed, args=(file_iter,), daemon=True)
+        feeder.start()
+        in_flight = {}
+        in_flight_bytes = 0
+        pool = self.pool
+        keep_frames = on_frames is not None
+        keep_landmarks = on_landmarks is not None
+        while not self.stop_event.is_set():
+            # 在途任务数略多于池的进程数，保证进程不空闲，同时让后发现的长文件还能插队；
+            # 每轮重新读取，池被 resize 后随之调整
+            max_in_flight = pool.max_workers * 2
+            while len(in_flight) < max_in_flight:
+                item = self._pop(in_flight_bytes)
+                if item is None:
+                    break
+                _, _, job, offset, length, seg_duration, seg_bytes = item
+                future = pool.submit(extract_segment, job.path, offset, length, keep_frames=keep_frames,
+                                     keep_landmarks=keep_landmarks, silence_thresh=self.silence_thresh, columns=self.columns,
+                                     timeout=segment_timeout(seg_duration))
+                in_flight[future] = (job, offset, seg_bytes)
+                in_flight_bytes += seg_bytes
+
+            if not in_flight:
+                if self.feeding_done and not self.heap:
+                    break
+                self.new_work.wait(0.1)
+                self.new_work.clear()
+                continue
+
+            done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, offset, seg_bytes = in_flight.pop(future)
+                in_flight_bytes -= seg_bytes
+                try:
+                    result = future.result()
+                    if keep_frames or keep_landmarks:
+                        result, extras = result
+                        job.extras.append((offset, extras))
+                    job.sums = merge_feature_sums(job.sums, result)
+                except Exception as e:
+                    print(f"Error processing {job.path}: {e}")
+                    if job.error is None:
+                        job.error = f"{type(e).__name__}: {e}"
+                job.remaining -= 1
+                if job.remaining == 0:
+                    if job.error is not None:
+                        on_file_done(job.path, None, job.error)
+                    else:
+                        job.extras.sort(key=lambda item: item[0])
+                        if keep_frames:
+                            on_frames(job.path, np.concatenate([extras['frames'] for _, extras in job.extras]))
+                        if keep_landmarks:
+                            on_landmarks(job.path, (np.concatenate([extras['landmarks'][0] for _, extras in job.extras]),
+                                                    np.concatenate([extras['landmarks'][1] for _, extras in job.extras])))
+                        on_file_done(job.path, finalize_features(job.sums), None)
+
+        if self.stop_event.is_set():
+            # 共享进程池不关闭，只取消本次提交的任务，正在执行的任务所在进程会被替换
+            pool.cancel(in_flight)
+        feeder.join(timeout=1)
+
+# 提取一组文件，返回 ({路径: 特征}, {路径: 错误})
+def extract_files(file_paths, max_workers=None, stop_event=None, skip=None, on_frames=None, on_landmarks=None,
+                  silence_thresh=None, memory_budget=None, columns=None):
+    features = {}
+    failures = {}
+
+    def on_file_done(file_path, result, error):
+        if error is not None:
+            failures[file_path] = error
+        elif result is not None:
+            features[file_path] = result
+
+    ExtractionScheduler(max_workers=max_workers, stop_event=stop_event, skip=skip,
+                        silence_thresh=silence_thresh, memory_budget=memory_budget, columns=columns).run(file_paths, on_file_done, on_frames, on_landmarks)
+    return features, failures
@@ -0,0 +1,345 @@
+import os
+import pickle
+import numpy as np
+
+# 紧凑的特征索引
+# 路径不再逐条保存完整字符串，而是拆成三部分：
+#   根目录表 roots（通常只有一两个，如特征提取时选择的根目录）
+#   目录表：每个目录记录所属根目录序号和相对目录字符串
+#   条目：每个文件记录所属目录序号和文件名
+# 相对目录字符串和文件名都保存在同一个字符串 blob 中，用偏移量数组定位。
+# 特征按类型保存为矩阵（每行一个文件），只有需要显示的结果才拼出完整路径。
+
+INDEX_FORMAT = 'feature-index'
+INDEX_VERSION = 1
+
+# 每种特征每一维的 z-score 统计量（均值和标准差），构建索引时计算并保存在 meta['metric_stats'] 中。
+# 欧氏距离度量按标准差缩放各维度，避免数值范围大的维度主导距离
+def compute_metric_stats(matrices):
+    stats = {}
+    for name, matrix in matrices.items():
+        valid = matrix[~np.isnan(matrix[:, 0])] if len(matrix) else matrix
+        if len(valid) == 0:
+            continue
+        mean = valid.mean(axis=0, dtype=np.float64)
+        std = valid.std(axis=0, dtype=np.float64)
+        std[std < 1e-8] = 1.0
+        stats[name] = {'mean': mean.astype(np.float32), 'std': std.astype(np.float32)}
+    return stats
+
+# 增量日志：每次修改追加一条 pickle 记录，读取时依次读出，末尾写了一半的记录直接忽略
+def append_journal(journal_file, record):
+    with open(journal_file, 'ab') as f:
+        pickle.dump(record, f)
+
+def read_journal(journal_file):
+    records = []
+    if not os.path.exists(journal_file):
+        return records
+    with open(journal_file, 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError):
+                break
+    return records
+
+# 文件名从最后一个分隔符之后开始，同时兼容两种分隔符
+def _split_name(path):
+    k = max(path.rfind('/'), path.rfind('\\'))
+    return path[:k + 1], path[k + 1:]
+
+# 取所有路径的公共目录前缀作为默认根目录
+def common_root(paths):
+    prefix = None
+    for path in paths:
+        if prefix is None:
+            prefix = _split_name(path)[0]
+        elif not path.startswith(prefix):
+            i = 0
+            for a, b in zip(prefix, path):
+                if a != b:
+                    break
+                i += 1
+            prefix = _split_name(prefix[:i])[0]
+        if not prefix:
+            return ''
+    return prefix or ''
+
+class PathTable:
+    def __init__(self, roots, dir_root, dir_offsets, entry_dir, name_offsets, blob):
+        self.roots = list(roots)
+        self.dir_root = dir_root
+        self.dir_offsets = dir_offsets
+        self.entry_dir = entry_dir
+        self.name_offsets = name_offsets
+        self.blob = blob
+
+    @classmethod
+    def from_paths(cls, paths, roots=None):
+        paths = list(paths)
+        if roots is None:
+            roots = [common_root(paths)]
+        roots = list(roots)
+        # 优先匹配最长的根目录
+        root_order = sorted(range(len(roots)), key=lambda r: len(roots[r]), reverse=True)
+
+        dir_lookup = {}
+        dir_root = []
+        dir_parts = []
+        entry_dir = np.empty(len(paths), dtype=np.int32)
+        names = []
+        for i, path in enumerate(paths):
+            root_index = None
+            for r in root_order:
+                if path.startswith(roots[r]):
+                    root_index = r
+                    break
+            if root_index is None:
+                if '' not in roots:
+                    roots.append('')
+                    root_order.append(len(roots) - 1)
+                root_index = roots.index('')
+            rel_dir, name = _split_name(path[len(roots[root_index]):])
+            key = (root_index, rel_dir)
+            d = dir_lookup.get(key)
+            if d is None:
+                d = len(dir_parts)
+                dir_lookup[key] = d
+                dir_root.append(root_index)
+                dir_parts.append(rel_dir)
+            entry_dir[i] = d
+            names.append(name)
+
+        dir_lengths = np.fromiter((len(part) for part in dir_parts), dtype=np.int64, count=len(dir_parts))
+        name_lengths = np.fromiter((len(name) for name in names), dtype=np.int64, count=len(names))
+        dir_offsets = np.zeros(len(dir_parts) + 1, dtype=np.int64)
+        np.cumsum(dir_lengths, out=dir_offsets[1:])
+        name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(name_lengths, out=name_offsets[1:])
+        name_offsets += dir_offsets[-1]
+        blob = ''.join(dir_parts) + ''.join(names)
+        return cls(roots, np.asarray(dir_root, dtype=np.int32), dir_offsets, entry_dir, name_offsets, blob)
+
+    def __len__(self):
+        return len(self.entry_dir)
+
+    # 目录的完整路径（带末尾分隔符）
+    def directory(self, d):
+        return self.roots[self.dir_root[d]] + self.blob[self.dir_offsets[d]:self.dir_offsets[d + 1]]
+
+    def directories(self):
+        return [self.directory(d) for d in range(len(self.dir_root))]
+
+    def name(self, i):
+        return self.blob[self.name_offsets[i]:self.name_offsets[i + 1]]
+
+    # 拼出第 i 个条目的完整路径
+    def path(self, i):
+        return self.directory(self.entry_dir[i]) + self.name(i)
+
+    def iter_paths(self):
+        directories = self.directories()
+        for i in range(len(self.entry_dir)):
+            yield directories[self.entry_dir[i]] + self.name(i)
+
+    def to_state(self):
+        return {
+            'roots': self.roots,
+            'dir_root': self.dir_root,
+            'dir_offsets': self.dir_offsets,
+            'entry_dir': self.entry_dir,
+            'name_offsets': self.name_offsets,
+            'blob': self.blob,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['roots'], state['dir_root'], state['dir_offsets'],
+                   state['entry_dir'], state['name_offsets'], state['blob'])
+
+class FeatureIndex:
+    def __init__(self, paths, features, meta=None):
+        self.paths = paths  # PathTable
+        self.features = features  # 特征名 -> (条目数, 维度) 矩阵
+        self.meta = meta if meta is not None else {}  # 其他随索引保存的信息
+        self.version = 0  # 常驻内存时由 FeatureManager 分配的版本号（不保存到文件）
+        self._lookup = None
+        self._metric_arrays = {}
+
+    # 由 {路径: {特征名: 向量}} 的字典构建索引（旧格式的特征文件也通过这里转换）
+    @classmethod
+    def from_dict(cls, audio_features, roots=None, meta=None):
+        paths = list(audio_features.keys())
+        feature_names = []
+        for features in audio_features.values():
+            for name in features:
+                if name not in feature_names:
+                    feature_names.append(name)
+        matrices = {}
+        for name in feature_names:
+            dim = next(len(np.ravel(f[name])) for f in audio_features.values() if name in f)
+            matrix = np.full((len(paths), dim), np.nan, dtype=np.float32)
+            for i, path in enumerate(paths):
+                value = audio_features[path].get(name)
+                if value is not None:
+                    matrix[i] = np.ravel(value)
+            matrices[name] = matrix
+        return cls(PathTable.from_paths(paths, roots), matrices, meta)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.lookup()
+
+    def path(self, i):
+        return self.paths.path(i)
+
+    def iter_paths(self):
+        return self.paths.iter_paths()
+
+    def feature_names(self):
+        return list(self.features.keys())
+
+    # 路径 -> 行号，只有增量更新等需要按路径查找时才构建
+    def lookup(self):
+        if self._lookup is None:
+            self._lookup = {path: i for i, path in enumerate(self.iter_paths())}
+        return self._lookup
+
+    # 第 i 个条目的特征字典，缺失的特征（NaN）不返回
+    def row_features(self, i):
+        result = {}
+        for name, matrix in self.features.items():
+            row = matrix[i]
+            if not np.isnan(row[0]):
+                result[name] = row
+        return result
+
+    # 没有统计量时（增量更新后的新索引）按当前的全部条目计算一次；refresh 为 True 时总是重新计算（保存时使用）
+    def metric_stats(self, refresh=False):
+        stats = self.meta.get('metric_stats')
+        if refresh or stats is None or any(name not in stats for name in self.features):
+            stats = compute_metric_stats(self.features)
+            self.meta['metric_stats'] = stats
+        return stats
+
+    # 度量计算用的每行预计算量，第一次搜索时计算一次（索引更新后是新对象，会重新计算）：
+    #   inv_norm: 行向量 L2 范数的倒数，乘上点积即为单位化向量的点积
+    #   scaled_sq: 按 z-score 标准差缩放后的行向量平方范数
+    #   valid: 该特征存在（不是 NaN）的行
+    # 距离都可以由一次矩阵-向量乘法加上这些量得到，不需要保存第二份单位化矩阵
+    def metric_arrays(self, name):
+        arrays = self._metric_arrays.get(name)
+        if arrays is None:
+            matrix = self.features[name]
+            stats = self.metric_stats().get(name)
+            std = stats['std'] if stats is not None else np.ones(matrix.shape[1], dtype=np.float32)
+            valid = ~np.isnan(matrix[:, 0])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inv_norm = 1.0 / np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+            scaled = matrix / std
+            arrays = {
+                'inv_norm': inv_norm.astype(np.float32),
+                'scaled_sq': np.einsum('ij,ij->i', scaled, scaled).astype(np.float32),
+                'valid': valid,
+            }
+            self._metric_arrays[name] = arrays
+        return arrays
+
+    # 返回应用增量修改后的新索引，原索引保持不变
+    def apply_changes(self, upserts, removals, renames):
+        paths = list(self.iter_paths())
+        lookup = {path: i for i, path in enumerate(paths)}
+        keep = np.ones(len(paths), dtype=bool)
+        for old_path, new_path in renames.items():
+            i = lookup.pop(old_path, None)
+            if i is not None:
+                j = lookup.pop(new_path, None)
+                if j is not None:
+                    keep[j] = False
+                paths[i] = new_path
+                lookup[new_path] = i
+        for path in removals:
+            i = lookup.pop(path, None)
+            if i is not None:
+                keep[i] = False
+
+        feature_names = self.feature_names()
+        for features in upserts.values():
+            for name in features:
+                if name not in feature_names:
+                    feature_names.append(name)
+
+        matrices = {}
+        for name in feature_names:
+            matrix = self.features.get(name)
+            if matrix is None:
+                dim = next(len(np.ravel(f[name])) for f in upserts.values() if name in f)
+                matrix = np.full((len(paths), dim), np.nan, dtype=np.float32)
+            matrices[name] = matrix.copy()
+
+        new_paths = []
+        new_rows = []
+        for path, features in upserts.items():
+            i = lookup.get(path)
+            if i is not None:
+                for name, matrix in matrices.items():
+                    matrix[i] = np.ravel(features[name]) if name in features else np.nan
+            else:
+                new_paths.append(path)
+                new_rows.append(features)
+
+        kept = [path for path, k in zip(paths, keep) if k]
+        for name in feature_names:
+            matrix = matrices[name][keep]
+            if new_rows:
+                dim = matrix.shape[1]
+                extra = np.full((len(new_rows), dim), np.nan, dtype=np.float32)
+                for r, features in enumerate(new_rows):
+                    if name in features:
+                        extra[r] = np.ravel(features[name])
+                matrix = np.vstack([matrix, extra])
+            matrices[name] = matrix
+
+        table = PathTable.from_paths(kept + new_paths, [root for root in self.paths.roots if root])
+        # 条目变化后旧的 z-score 统计量不再代表整个库（例如从空索引开始逐批加入时只反映第一批），
+        # 不沿用，第一次搜索时按新的条目重新计算
+        meta = dict(self.meta)
+        meta.pop('metric_stats', None)
+        return FeatureIndex(table, matrices, meta)
+
+    # 用整列重新计算的结果替换（或加入）特征列，返回新索引，路径表和其他列不变
+    # columns: {特征名: (条目数, 维度) 矩阵}；schema 为新的完整列 schema；drop 为需要删除的列
+    def replace_columns(self, columns, schema=None, drop=()):
+        features = {name: matrix for name, matrix in self.features.items() if name not in drop}
+        features.update(columns)
+        meta = dict(self.meta)
+        stats = meta.get('metric_stats')
+        if stats is not None:
+            meta['metric_stats'] = {name: value for name, value in stats.items() if name in features and name not in columns}
+        if schema is not None:
+            meta['schema'] = {name: params for name, params in schema.items() if name in features}
+        return FeatureIndex(self.paths, features, meta)
+
+    # 修改根目录只需要改写根目录表
+    def change_root(self, old_root, new_root):
+        self.paths.roots = [new_root if root == old_root else root for root in self.paths.roots]
+        self._lookup = None
+
+    def to_state(self):
+        return {
+            'format': INDEX_FORMAT,
+            'version': INDEX_VERSION,
+            'paths': self.paths.to_state(),
+            'features': self.features,
+            'meta': self.meta,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        # 旧格式：{路径: {特征名: 向量}}
+        if not (isinstance(state, dict) and state.get('format') == INDEX_FORMAT):
+            return cls.from_dict(state)
+        return cls(PathTable.from_state(state['paths']), state['features'], state.get('meta', {}))
@@ -1,13 +1,60 @@
-import joblib
 import json
 import os
+import pickle
+import threading
+import itertools
+from path_remap import PathRemapper
+from result_cache import result_cache_instance
+
+_index_versions = itertools.count(1)  # 每次常驻索引内容变化时分配新的版本号，用于搜索结果缓存
+
+JOURNAL_COMPACT_RECORDS = 20  # 加载时增量日志超过这么多条记录就合并回特征文件
+
+# 统计已读取字节数的文件包装，joblib.load 读取时回调 progress(已读字节, 总字节)
+class _ProgressReader:
+    def __init__(self, f, total, progress):
+        self.f = f
+        self.total = total
+        self.progress = progress
+        self.done = 0
+
+    def _advance(self, n):
+        self.done += n
+        self.progress(self.done, self.total)
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self._advance(len(data))
+        return data
+
+    def readinto(self, b):
+        n = self.f.readinto(b)
+        self._advance(n or 0)
+        return n
+
+    def readline(self, *args):
+        line = self.f.readline(*args)
+        self._advance(len(line))
+        return line
+
+    def seek(self, *args):
+        position = self.f.seek(*args)
+        self.done = position
+        return position
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
 
 class FeatureManager:
     def __init__(self):
         self.feature_file = None
+        self.features = None  # 常驻内存的特征索引
+        self.features_stamp = None  # 常驻索引对应的特征文件状态，用于判断是否需要重新加载
+        self.lock = threading.Lock()
         self.setting_file = 'path_mappings.json'
         self.new_folder_path = self.load_folder_path_settings()
         self.new_root_name = self.load_root_name_settings()
+        self.remapper = PathRemapper.from_settings(self.load_settings())
 
     # 加载持久化设置
     def load_settings(self):
@@ -26,25 +73,45 @@ class FeatureManager:
         map = self.load_settings()
         return map.get('root_folder_name',"")
 
+    # 更新部分设置项，保留文件中的其他设置（如 rules）
+    def update_settings(self, **values):
+        settings = self.load_settings()
+        settings.update(values)
+        with open(self.setting_file, 'w') as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+        return settings
+
+    # 路径映射设置变化后重新编译规则，已加载的索引路径表也一并重新映射
+    def _rebuild_remapper(self, settings):
+        self.remapper = PathRemapper.from_settings(settings)
+        if self.features is not None:
+            self.remapper.remap_all(self.features.paths.directories())
+
     # 保存持久化设置
     def save_settings(self, root_name, new_root):
-        settings = {"root_folder_name": root_name, "new_root_path": new_root}
-        with open(self.setting_file, 'w') as f:
-            json.dump(settings, f)
+        self._rebuild_remapper(self.update_settings(root_folder_name=root_name, new_root_path=new_root))
 
     # 保存持久化根目录名称设置
     def save_root_name_settings(self, root_name):
         self.new_root_name = root_name
-        settings = {"root_folder_name": root_name, "new_root_path": self.new_folder_path}
-        with open(self.setting_file, 'w') as f:
-            json.dump(settings, f)
+        self.save_settings(root_name, self.new_folder_path)
 
     # 保存持久化替换路径设置
     def save_new_folder_path_settings(self, folder_path):
         self.new_folder_path = folder_path
-        settings = {"root_folder_name": self.new_root_name, "new_root_path": folder_path}
-        with open(self.setting_file, 'w') as f:
-            json.dump(settings, f)
+        self.save_settings(self.new_root_name, folder_path)
+
+    # 保存多条有序的路径映射规则，例如 [{"from": "D:\\音乐", "to": "/Volumes/音乐"}, ...]
+    def save_rules_settings(self, rules):
+        self._rebuild_remapper(self.update_settings(rules=rules))
+
+    # 查表得到重映射后的路径，索引中的路径在加载时已经全部映射过
+    def remap_path(self, path):
+        return self.remapper.remap(path)
+
+    # 常驻索引第 i 行映射后的路径，按目录序号查表，不再解析路径字符串
+    def remap_row(self, i):
+        return self.remapper.remap_entry(self.features.paths, i)
 
     # 将 Windows 风格路径转换为 macOS/Linux 风格路径
     def convert_to_unix_path(self, path):
@@ -98,18 +165,328 @@ class FeatureManager:
             print("错误", f"发生错误: {str(e)}")
 
     def set_feature_file(self, feature_file):
+        if feature_file != self.feature_file:
+            self.features = None
+            self.features_stamp = None
         self.feature_file = feature_file
 
     def get_feature_file(self):
         return self.feature_file
 
-    def save_features(self, features):
+    # 本机提取时的解码内存上限（字节），设置文件中的 memory_budget_mb，未设置时返回 None（按物理内存自动确定）
+    def get_memory_budget(self):
+        memory_budget_mb = self.load_settings().get('memory_budget_mb')
+        return int(memory_budget_mb) << 20 if memory_budget_mb else None
+
+    # 上次使用的特征文件（保存在设置文件中），文件已不存在时返回 None
+    def get_last_feature_file(self):
+        feature_file = self.load_settings().get('last_feature_file')
+        if feature_file and os.path.exists(feature_file):
+            return feature_file
+        return None
+
+    # 记住当前特征文件，下次启动时自动加载
+    def remember_feature_file(self):
+        if self.feature_file:
+            self.update_settings(last_feature_file=self.feature_file)
+
+    # 增量更新日志文件，与特征文件放在一起
+    def get_journal_file(self):
+        return self.feature_file + '.journal'
+
+    # 特征文件和增量日志的状态（mtime 与大小），任一变化都说明文件被外部修改过
+    def _file_stamp(self):
+        stamp = []
+        for path in (self.feature_file, self.get_journal_file()):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    # 保存特征，features 可以是 FeatureIndex 或 {路径: 特征} 字典（roots 为路径表使用的根目录）
+    # quarantine 为 {路径: 错误}，记录提取失败的文件；params 为提取参数（如 silence_thresh），之后的增量更新和查询使用相同的参数
+    def save_features(self, features, roots=None, quarantine=None, params=None):
+        # joblib 和 numpy 在第一次读写特征文件时才导入，不拖慢程序启动
+        import joblib
+        from feature_index import FeatureIndex
+
         if self.feature_file is not None:
-            joblib.dump(features, self.feature_file)
+            if not isinstance(features, FeatureIndex):
+                features = FeatureIndex.from_dict(features, roots)
+            # 保存（包括合并增量日志）时按全部条目重新计算相似度度量用的 z-score 统计量，随索引保存
+            features.metric_stats(refresh=True)
+            if quarantine is not None:
+                features.meta['quarantine'] = self.make_quarantine_records(quarantine)
+            if params is not None:
+                # 完整构建：记录提取参数和每一列的 schema
+                from feature_schema import feature_schema
+                features.meta['extraction'] = dict(params)
+                features.meta['schema'] = feature_schema(params.get('silence_thresh'))
+            with self.lock:
+                joblib.dump(features.to_state(), self.feature_file)
+                # 完整写入后增量日志已经包含在特征文件中
+                if os.path.exists(self.get_journal_file()):
+                    os.remove(self.get_journal_file())
+                self._install(features)
+                self.features_stamp = self._file_stamp()
 
-    def load_features(self):
-        if self.feature_file is not None and os.path.exists(self.feature_file):
-            return joblib.load(self.feature_file)
-        return {}
+    # 替换常驻索引。新的索引对象分配新版本号，并清除旧版本的搜索结果缓存
+    # （修改根目录或合并增量日志时还是同一个对象，行号不变，缓存仍然有效）
+    def _install(self, features):
+        if features is not self.features:
+            features.version = next(_index_versions)
+            result_cache_instance.invalidate(self.feature_file)
+        self.remapper.remap_all(features.paths.directories())
+        self.features = features
+
+    # 加载（或返回已常驻的）特征索引，progress(已读字节, 总字节) 报告读取特征文件的进度
+    def load_features(self, progress=None):
+        import joblib
+        from feature_index import FeatureIndex
+
+        if self.feature_file is None or not os.path.exists(self.feature_file):
+            return FeatureIndex.from_dict({})
+        with self.lock:
+            stamp = self._file_stamp()
+            if self.features is None or stamp != self.features_stamp:
+                if progress is None:
+                    state = joblib.load(self.feature_file)
+                else:
+                    with open(self.feature_file, 'rb') as f:
+                        state = joblib.load(_ProgressReader(f, os.path.getsize(self.feature_file), progress))
+                features = FeatureIndex.from_state(state)
+                features, records = self._replay_journal(features)
+                self._install(features)
+                self.features_stamp = stamp
+                compact = records > JOURNAL_COMPACT_RECORDS
+            else:
+                compact = False
+        # 增量日志记录过多时合并回特征文件，加快下次加载
+        if compact:
+            self.save_features(features)
+        return self.features
+
+    # 在后台线程中加载特征文件，完成后调用 on_done(索引, 错误)，加载过程中调用 progress(已读字节, 总字节)
+    def preload_features(self, on_done=None, progress=None):
+        def run():
+            try:
+                features = self.load_features(progress)
+            except Exception as e:
+                print(f"Error loading {self.feature_file}: {e}")
+                if on_done is not None:
+                    on_done(None, e)
+                return
+            if on_done is not None:
+                on_done(features, None)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    # 依次应用增量日志中的记录，末尾写了一半的记录直接忽略
+    def _replay_journal(self, features):
+        journal_file = self.get_journal_file()
+        records = 0
+        if not os.path.exists(journal_file):
+            return features, records
+        with open(journal_file, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                upserts, removals, renames = record[:3]
+                quarantine = record[3] if len(record) > 3 else {}
+                features = features.apply_changes(upserts, removals, renames)
+                self._update_quarantine(features, upserts, removals, renames, quarantine)
+                records += 1
+        return features, records
+
+    # 增量更新常驻索引并追加写入增量日志，不重写整个特征文件
+    # upserts: {路径: 特征}，removals: 需要删除的路径，renames: {旧路径: 新路径}，quarantine: {路径: 错误}
+    def apply_changes(self, upserts=None, removals=None, renames=None, quarantine=None):
+        upserts = upserts or {}
+        removals = list(removals or [])
+        renames = renames or {}
+        quarantine = self.make_quarantine_records(quarantine or {})
+        if self.feature_file is None or not (upserts or removals or renames or quarantine):
+            return
+        current = self.load_features()
+        upserts = self._compatible_upserts(current, upserts)
+        # 生成新的索引对象，正在进行的搜索仍然使用旧的索引，不会受影响
+        features = current.apply_changes(upserts, removals, renames)
+        self._update_quarantine(features, upserts, removals, renames, quarantine)
+        if not os.path.exists(self.feature_file):
+            self.save_features(features)
+            return
+        with self.lock:
+            with open(self.get_journal_file(), 'ab') as f:
+                pickle.dump((upserts, removals, renames, quarantine), f)
+            self._install(features)
+            self.features_stamp = self._file_stamp()
+            journal_size = os.path.getsize(self.get_journal_file())
+            feature_size = os.path.getsize(self.feature_file)
+        # 增量日志过大时合并回特征文件
+        if journal_size > max(feature_size // 4, 1 << 20):
+            self.save_features(features)
+
+    # 新提取的向量只写入与索引 schema 一致的列：过期的列（参数已经改变）不能混入不同参数的向量，
+    # 缺失的列只写入少数新文件也没有意义，这些列都需要用 recompute_columns 整列重新计算
+    @staticmethod
+    def _compatible_upserts(index, upserts):
+        from feature_schema import compatible_columns
+
+        if not upserts:
+            return upserts
+        usable = set(compatible_columns(index))
+        if all(name in usable for features in upserts.values() for name in features):
+            return upserts
+        print(f"Feature columns not matching the index schema are not updated: "
+              f"{sorted({name for features in upserts.values() for name in features} - usable)}")
+        return {path: {name: value for name, value in features.items() if name in usable}
+                for path, features in upserts.items()}
+
+    # 查询使用的特征权重：只保留与当前提取参数一致的列（过期列的向量与新提取的目标不可比较）；
+    # 一列都不能用时抛出 SchemaMismatch
+    def query_weights(self, weights, index=None):
+        from feature_schema import compatible_columns, compare_schema, SchemaMismatch
+
+        index = index if index is not None else self.load_features()
+        usable = set(compatible_columns(index))
+        filtered = {name: weight for name, weight in weights.items() if name in usable}
+        if not any(weight > 0 for weight in filtered.values()):
+            stale, missing = compare_schema(index)
+            raise SchemaMismatch(f"特征文件的提取参数与当前版本不一致（过期: {', '.join(stale) or '-'}，"
+                                 f"缺失: {', '.join(missing) or '-'}），请运行 tools/upgrade_index.py 重新计算")
+        return filtered
+
+    # 只重新计算过期和缺失的特征列（修改了某种特征的参数或新增了特征类型之后），路径表和其他列保持不变。
+    # columns 为 None 时按 schema 比较结果自动决定；不再提取的旧列直接删除。
+    # 取消时不修改特征文件，返回 None；否则返回重新计算的列
+    def recompute_columns(self, columns=None, max_workers=None, stop_event=None, on_file_done=None):
+        import numpy as np
+        from feature_schema import compare_schema, index_schema, feature_schema, FEATURE_COLUMNS, COLUMN_DIMS
+        from extraction_scheduler import ExtractionScheduler
+
+        index = self.load_features()
+        params = self.get_extraction_params()
+        stale, missing = compare_schema(index)
+        drop = [name for name in stale if name not in FEATURE_COLUMNS]
+        if columns is None:
+            columns = [name for name in stale + missing if name in FEATURE_COLUMNS]
+        if not columns and not drop:
+            return []
+
+        paths = list(index.iter_paths())
+        # 隔离列表中没有变化的文件不再提取（与完整构建一致），这些行在重新计算的列中保持为空
+        quarantine = index.meta.get('quarantine', {})
+        rows = {self.remap_row(i): i for i, path in enumerate(paths) if not self.is_quarantined(path, quarantine)}
+        schema = feature_schema(params.get('silence_thresh'), columns)
+        matrices = {name: np.full((len(paths), COLUMN_DIMS[name](schema[name])), np.nan, dtype=np.float32)
+                    for name in columns}
+        failures = {}
+
+        def done(file_path, features, error):
+            if error is not None:
+                failures[paths[rows[file_path]]] = error
+            elif features is not None:
+                for name in columns:
+                    if name in features:
+                        matrices[name][rows[file_path]] = np.ravel(features[name])
+            if on_file_done is not None:
+                on_file_done(file_path, features, error)
+
+        stop_event = stop_event or threading.Event()
+        if columns:
+            # 只删除旧列时不需要解码
+            ExtractionScheduler(max_workers=max_workers, stop_event=stop_event, memory_budget=self.get_memory_budget(),
+                                columns=columns, **params).run(list(rows), done)
+        if stop_event.is_set():
+            return None
+        new_schema = dict(index_schema(index))
+        new_schema.update(schema)
+        features = index.replace_columns(matrices, new_schema, drop)
+        quarantine = dict(features.meta.get('quarantine', {}))
+        quarantine.update(failures)
+        self.save_features(features, quarantine=quarantine)
+        return columns
+
+    # 隔离列表：提取失败（超时、崩溃、无法解码）的文件及其错误，随索引一起保存
+    # 记录文件的大小和修改时间，文件被替换后会重新尝试提取
+    @staticmethod
+    def make_quarantine_records(failures):
+        records = {}
+        for path, error in failures.items():
+            if isinstance(error, dict):
+                # 已经是隔离记录（沿用上次构建的记录）
+                records[path] = error
+                continue
+            try:
+                st = os.stat(path)
+                stamp = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                stamp = None
+            records[path] = {'error': error, 'stamp': stamp}
+        return records
+
+    @staticmethod
+    def _update_quarantine(features, upserts, removals, renames, quarantine):
+        records = dict(features.meta.get('quarantine', {}))
+        for old_path, new_path in renames.items():
+            if old_path in records:
+                records[new_path] = records.pop(old_path)
+        for path in list(upserts) + list(removals):
+            records.pop(path, None)
+        records.update(quarantine)
+        features.meta['quarantine'] = records
+
+    # 构建当前索引时使用的提取参数，作为 extract_files 的关键字参数
+    def get_extraction_params(self):
+        return dict(self.load_features().meta.get('extraction', {}))
+
+    def get_quarantine(self):
+        return self.load_features().meta.get('quarantine', {})
+
+    # 读取指定特征文件的隔离列表（不影响当前使用的特征文件）
+    def read_quarantine(self, feature_file):
+        import joblib
+        from feature_index import FeatureIndex
+
+        if feature_file == self.feature_file:
+            return self.get_quarantine()
+        if not os.path.exists(feature_file):
+            return {}
+        return FeatureIndex.from_state(joblib.load(feature_file)).meta.get('quarantine', {})
+
+    # 文件在隔离列表中且没有被修改过时跳过
+    def is_quarantined(self, path, quarantine=None):
+        if quarantine is None:
+            quarantine = self.get_quarantine()
+        record = quarantine.get(path)
+        if record is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return record['stamp'] == (st.st_size, st.st_mtime_ns)
+
+    # 音频库整体移动后修改根目录，只需要改写路径表中的根目录表
+    def change_root(self, old_root, new_root):
+        from segment_search import FrameStore, get_frame_file
+        from fingerprint_index import FingerprintIndex, get_fingerprint_file
+
+        features = self.load_features()
+        features.change_root(old_root, new_root)
+        self.save_features(features)
+        # 片段定位用的帧序列文件和查重用的指纹索引有自己的路径表，同样修改根目录
+        frame_file = get_frame_file(self.feature_file)
+        if FrameStore.exists(frame_file):
+            FrameStore(frame_file).change_root(old_root, new_root)
+        fingerprint_file = get_fingerprint_file(self.feature_file)
+        if FingerprintIndex.exists(fingerprint_file):
+            FingerprintIndex(fingerprint_file).change_root(old_root, new_root)
 
 feature_manager_instance = FeatureManager()
@@ -0,0 +1,67 @@
+# 特征列的模式（schema）：每一列特征由哪些提取参数产生。
+# 构建索引时把每列的参数写入 meta['schema']，查询和增量更新时与当前代码的参数比较：
+#   参数一致的列可以直接比较；参数不同（例如 n_mfcc 改了）的列是“过期”列，查询时不使用，增量更新时不写入；
+#   当前代码有而索引中没有的列是“缺失”列。过期和缺失的列可以单独重新计算（tools/upgrade_index.py），不需要全部重建。
+# 本模块不导入 numpy/librosa，界面启动和加载索引时可以直接使用。
+
+SCHEMA_VERSION = 1
+HOP_LENGTH = 512  # librosa 默认的帧移
+
+# 每种特征的计算参数（直接作为 librosa.feature 函数的关键字参数）。
+# 修改参数或新增特征后，已有索引中对应的列会被识别为过期/缺失，只重新计算这些列
+FEATURE_COLUMNS = {
+    'mfcc': {'n_mfcc': 13, 'n_fft': 2048, 'hop_length': HOP_LENGTH},
+    'chroma': {'n_chroma': 12, 'n_fft': 2048, 'hop_length': HOP_LENGTH},
+}
+
+# 每种特征的向量维度，用于识别没有记录 schema 的旧索引
+COLUMN_DIMS = {
+    'mfcc': lambda params: params['n_mfcc'],
+    'chroma': lambda params: params['n_chroma'],
+}
+
+# 当前代码提取每一列时使用的完整参数（包括采样率和静音处理，它们影响所有列）
+def feature_schema(silence_thresh=None, columns=None):
+    from audio_decoder import ANALYSIS_SR
+
+    return {name: dict(FEATURE_COLUMNS[name], sr=ANALYSIS_SR, silence_thresh=silence_thresh, version=SCHEMA_VERSION)
+            for name in (FEATURE_COLUMNS if columns is None else columns)}
+
+# 索引记录的 schema；没有记录的旧索引按维度推断：
+#   记录了提取参数（meta['extraction']）的索引是按 ANALYSIS_SR 解码提取的，维度与当前参数一致的列认为是当前参数产生的；
+#   连提取参数都没有记录的更早的索引无法确定采样率（最初的版本按文件原始采样率提取，sr=None），
+#   这些列记为 sr=None，与当前参数比较时总是过期，查询时不使用，需要用 tools/upgrade_index.py 重新计算
+def index_schema(index):
+    schema = index.meta.get('schema')
+    if schema is not None:
+        return schema
+    extraction = index.meta.get('extraction')
+    current = feature_schema((extraction or {}).get('silence_thresh'))
+    if not index.features:
+        # 空索引（例如下载流水线新建的索引）还没有任何列，按当前参数写入
+        return current
+    schema = {}
+    for name, matrix in index.features.items():
+        if name in current and matrix.shape[1] == COLUMN_DIMS[name](current[name]):
+            schema[name] = current[name] if extraction is not None else dict(current[name], sr=None)
+        else:
+            schema[name] = {'unknown': True}
+    return schema
+
+# 与当前代码比较，返回 (过期的列, 缺失的列)
+def compare_schema(index):
+    recorded = index_schema(index)
+    current = feature_schema(index.meta.get('extraction', {}).get('silence_thresh'))
+    stale = [name for name, params in recorded.items() if name in current and params != current[name]]
+    # 当前代码已经不再提取的列同样不能与新提取的向量比较
+    stale += [name for name in recorded if name not in current]
+    missing = [name for name in current if name not in recorded]
+    return stale, missing
+
+# 可以与当前代码提取的向量直接比较的列
+def compatible_columns(index):
+    stale, _ = compare_schema(index)
+    return [name for name in index_schema(index) if name not in stale]
+
+class SchemaMismatch(Exception):
+    pass
@@ -0,0 +1,291 @@
+import os
+import threading
+import numpy as np
+import joblib
+from feature_index import PathTable, append_journal, read_journal
+from audio_worker import FP_HOP
+from audio_decoder import ANALYSIS_SR
+
+# 地标指纹倒排索引：用于“库里是不是已经有这首歌”的快速查重（重复上传、转码后的文件）。
+# 特征提取时每首曲目提取频谱峰值对组成的哈希和锚点时间，全部按哈希排序后保存为 <特征文件>.fp：
+#   hashes（有序）、tracks（曲目序号）、times（锚点帧）三个等长数组 + 曲目路径表。
+# 查询时对片段的每个哈希用二分查找（searchsorted）取出所有相同哈希的记录，
+# 按 (曲目, 时间差) 投票，真正的匹配会在同一个时间差上集中大量票数，耗时与库大小基本无关。
+# 增量更新不重写 .fp：新曲目的地标、删除和重命名追加到 <特征文件>.fp.journal，加载时新曲目的地标单独排序，
+# 查询时与主索引一起查找并排除已删除的曲目；日志超过主索引大小的 1/4（至少 1MB）时才合并重写（compact_fingerprint_index）。
+
+FINGERPRINT_FORMAT = 'fingerprint-index'
+FINGERPRINT_VERSION = 1
+FP_SECONDS = FP_HOP / ANALYSIS_SR  # 指纹时间单位（帧）对应的秒数
+MIN_MATCHES = 10  # 最佳时间差上的票数达到这个数才认为是同一首歌
+MAX_POSTINGS = 2000  # 出现次数过多的哈希（例如纯音、静音附近）区分度低，查询时跳过
+
+_update_lock = threading.Lock()
+_resident = {}  # 常驻内存的指纹索引：文件绝对路径 -> (主文件状态, 增量日志状态, 索引)
+_resident_lock = threading.Lock()
+
+def get_fingerprint_file(feature_file):
+    return feature_file + '.fp'
+
+def _journal_file(fingerprint_file):
+    return fingerprint_file + '.journal'
+
+# 文件的 (mtime, 大小)，不存在时为 None
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+# 加载（或返回已常驻的）指纹索引。文件没有变化时直接返回常驻的索引，
+# 只有增量日志变化时复用已加载的主索引，只重新应用日志，查询不再每次完整读取 .fp
+def load_fingerprint_index(fingerprint_file):
+    key = os.path.abspath(fingerprint_file)
+    stamp = (_file_stamp(fingerprint_file), _file_stamp(_journal_file(fingerprint_file)))
+    with _resident_lock:
+        cached = _resident.get(key)
+        if cached is not None and cached[:2] == stamp:
+            return cached[2]
+        state = cached[2].state if cached is not None and cached[0] == stamp[0] else None
+        index = FingerprintIndex(fingerprint_file, state)
+        _resident[key] = stamp + (index,)
+        return index
+
+# 写入后让常驻索引失效；只追加了增量日志时（base=False）保留已加载的主索引
+def _invalidate(fingerprint_file, base=True):
+    key = os.path.abspath(fingerprint_file)
+    with _resident_lock:
+        cached = _resident.pop(key, None)
+        if cached is not None and not base:
+            _resident[key] = (cached[0], None, cached[2])
+
+# 收集每首曲目的地标，close() 时排序并写入文件，取消时直接丢弃
+class FingerprintWriter:
+    def __init__(self, fingerprint_file):
+        self.fingerprint_file = fingerprint_file
+        self.paths = []
+        self.hashes = []
+        self.times = []
+        self.aborted = False
+
+    def add(self, path, landmarks):
+        hashes, times = landmarks
+        self.paths.append(path)
+        self.hashes.append(np.asarray(hashes, dtype=np.uint32))
+        self.times.append(np.asarray(times, dtype=np.int32))
+
+    def close(self, roots=None):
+        if self.aborted:
+            return
+        lengths = [len(h) for h in self.hashes]
+        hashes = np.concatenate(self.hashes) if self.hashes else np.zeros(0, dtype=np.uint32)
+        times = np.concatenate(self.times) if self.times else np.zeros(0, dtype=np.int32)
+        tracks = np.repeat(np.arange(len(self.paths), dtype=np.int32), lengths)
+        order = np.argsort(hashes, kind='stable')
+        state = {
+            'format': FINGERPRINT_FORMAT,
+            'version': FINGERPRINT_VERSION,
+            'paths': PathTable.from_paths(self.paths, roots).to_state(),
+            'hashes': hashes[order],
+            'tracks': tracks[order],
+            'times': times[order],
+        }
+        tmp_file = self.fingerprint_file + '.tmp'
+        joblib.dump(state, tmp_file)
+        os.replace(tmp_file, self.fingerprint_file)
+        # 完整写入后增量日志已经包含在文件中
+        if os.path.exists(_journal_file(self.fingerprint_file)):
+            os.remove(_journal_file(self.fingerprint_file))
+        _invalidate(self.fingerprint_file)
+
+    # 取消构建：地标只保存在内存中，丢弃即可，原有的指纹文件不变；之后的 close() 不再写入
+    def abort(self):
+        self.paths = []
+        self.hashes = []
+        self.times = []
+        self.aborted = True
+
+# 删除指纹文件和增量日志（重新构建时不再保存指纹）
+def remove_fingerprint_index(fingerprint_file):
+    with _update_lock:
+        for path in (fingerprint_file, _journal_file(fingerprint_file)):
+            if os.path.exists(path):
+                os.remove(path)
+    _invalidate(fingerprint_file)
+
+class FingerprintIndex:
+    # state 为已经读入的主索引内容（常驻索引只有增量日志变化时复用），None 时从文件读取
+    def __init__(self, fingerprint_file, state=None):
+        if state is None:
+            state = joblib.load(fingerprint_file)
+        self.fingerprint_file = fingerprint_file
+        self.paths = PathTable.from_state(state['paths'])
+        self.state = state
+        # 主索引和增量日志中新增曲目的地标，各自按哈希排序：[(hashes, tracks, times)]
+        self.parts = [(state['hashes'], state['tracks'], state['times'])]
+        self.track_paths = None  # 应用增量日志后每个曲目序号的路径（没有日志时直接用路径表）
+        self.alive = None  # 应用增量日志后仍然有效的曲目
+        self.journal_records = self._replay_journal()
+
+    # 应用增量日志：重命名只改路径，删除和重新提取的曲目标记为无效，新曲目分配新的序号
+    def _replay_journal(self):
+        records = read_journal(_journal_file(self.fingerprint_file))
+        if not records:
+            return 0
+        paths = list(self.paths.iter_paths())
+        alive = [True] * len(paths)
+        lookup = {path: track for track, path in enumerate(paths)}
+        hashes, tracks, times = [], [], []
+        for added, removals, renames in records:
+            moved = [(lookup.pop(old), new) for old, new in renames.items() if old in lookup]
+            for track, new in moved:
+                # 重命名到已有路径时，移动过去的曲目覆盖原来的曲目
+                if new in lookup:
+                    alive[lookup[new]] = False
+                lookup[new] = track
+                paths[track] = new
+            for path in list(removals) + list(added):
+                track = lookup.pop(path, None)
+                if track is not None:
+                    alive[track] = False
+            for path, (track_hashes, track_times) in added.items():
+                lookup[path] = len(paths)
+                hashes.append(track_hashes)
+                times.append(track_times)
+                tracks.append(np.full(len(track_hashes), len(paths), dtype=np.int32))
+                paths.append(path)
+                alive.append(True)
+        if hashes:
+            hashes = np.concatenate(hashes)
+            order = np.argsort(hashes, kind='stable')
+            self.parts.append((hashes[order], np.concatenate(tracks)[order], np.concatenate(times)[order]))
+        self.track_paths = paths
+        self.alive = np.asarray(alive, dtype=bool)
+        return len(records)
+
+    @staticmethod
+    def exists(fingerprint_file):
+        return os.path.exists(fingerprint_file)
+
+    def __len__(self):
+        return len(self.paths) if self.alive is None else int(self.alive.sum())
+
+    def path(self, track):
+        return self.paths.path(track) if self.track_paths is None else self.track_paths[track]
+
+    # 按曲目取出地标（合并和增量更新时使用），只包括仍然有效的曲目
+    def landmarks_by_track(self):
+        hashes = np.concatenate([part[0] for part in self.parts])
+        tracks = np.concatenate([part[1] for part in self.parts])
+        times = np.concatenate([part[2] for part in self.parts])
+        count = len(self.paths) if self.track_paths is None else len(self.track_paths)
+        order = np.argsort(tracks, kind='stable')
+        bounds = np.searchsorted(tracks[order], np.arange(count + 1))
+        for i in range(count):
+            if self.alive is None or self.alive[i]:
+                rows = order[bounds[i]:bounds[i + 1]]
+                yield self.path(i), (hashes[rows], times[rows])
+
+    # 查询一组地标，返回按票数从高到低的 [(曲目序号, 票数, 片段在曲目中的起始秒数)]
+    def query(self, landmarks, top_n=10):
+        query_hashes, query_times = landmarks
+        bounds = [(np.searchsorted(part[0], query_hashes, side='left'),
+                   np.searchsorted(part[0], query_hashes, side='right')) for part in self.parts]
+        total = sum(hi - lo for lo, hi in bounds)
+        keep = (total > 0) & (total <= MAX_POSTINGS)
+        if total[keep].sum() == 0:
+            return []
+        offsets, tracks = [], []
+        for (part_hashes, part_tracks, part_times), (lo, hi) in zip(self.parts, bounds):
+            lo, counts, part_query_times = lo[keep], (hi - lo)[keep], query_times[keep]
+            if counts.sum() == 0:
+                continue
+            # 展开每个查询哈希对应的全部记录：rows = lo[i] + 0..counts[i]-1
+            starts = np.repeat(lo, counts)
+            steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            rows = starts + steps
+            offsets.append(part_times[rows].astype(np.int64) - np.repeat(part_query_times, counts).astype(np.int64))
+            tracks.append(part_tracks[rows].astype(np.int64))
+        offsets = np.concatenate(offsets)
+        tracks = np.concatenate(tracks)
+        if self.alive is not None:
+            valid = self.alive[tracks]
+            offsets, tracks = offsets[valid], tracks[valid]
+            if len(tracks) == 0:
+                return []
+
+        # 按 (曲目, 时间差) 计票，每首曲目取票数最多的时间差
+        keys, votes = np.unique(tracks << 32 | (offsets + (1 << 31)), return_counts=True)
+        key_tracks = keys >> 32
+        order = np.lexsort((-votes, key_tracks))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key_tracks[order][1:] != key_tracks[order][:-1]
+        best = order[first]
+        best = best[np.argsort(-votes[best], kind='stable')][:top_n]
+        return [(int(key_tracks[k]), int(votes[k]), max(int((keys[k] & 0xFFFFFFFF) - (1 << 31)), 0) * FP_SECONDS)
+                for k in best]
+
+    def change_root(self, old_root, new_root):
+        if self.journal_records:
+            # 增量日志中记录的是完整路径，先合并进指纹文件的路径表
+            compact_fingerprint_index(self.fingerprint_file)
+            FingerprintIndex(self.fingerprint_file).change_root(old_root, new_root)
+            return
+        self.paths.roots = [new_root if root == old_root else root for root in self.paths.roots]
+        self.state['paths'] = self.paths.to_state()
+        joblib.dump(self.state, self.fingerprint_file)
+        _invalidate(self.fingerprint_file)
+
+# 合并增量日志：只保留有效的曲目，重新排序后整体写入
+def compact_fingerprint_index(fingerprint_file, landmarks=None, removals=(), renames=None):
+    landmarks = landmarks or {}
+    renames = renames or {}
+    removed = set(removals) | set(landmarks)
+    targets = set(renames.values())
+    writer = FingerprintWriter(fingerprint_file)
+    roots = None
+    if FingerprintIndex.exists(fingerprint_file):
+        index = FingerprintIndex(fingerprint_file)
+        roots = [root for root in index.paths.roots if root]
+        for original, track_landmarks in index.landmarks_by_track():
+            path = renames.get(original, original)
+            # 被重命名覆盖的曲目不再保留
+            if path not in removed and not (path == original and path in targets):
+                writer.add(path, track_landmarks)
+    for path, track_landmarks in landmarks.items():
+        writer.add(path, track_landmarks)
+    writer.close(roots)
+
+# 增量更新指纹索引：删除、重命名并加入新提取的曲目。
+# 变化追加到增量日志，每次更新只写入新曲目的地标；日志超过主索引大小的 1/4（至少 1MB）时合并重写
+def update_fingerprint_index(fingerprint_file, landmarks, removals=(), renames=None):
+    renames = renames or {}
+    if not (landmarks or removals or renames):
+        return
+    with _update_lock:
+        if not FingerprintIndex.exists(fingerprint_file):
+            compact_fingerprint_index(fingerprint_file, landmarks, removals, renames)
+            return
+        added = {path: (np.asarray(hashes, dtype=np.uint32), np.asarray(times, dtype=np.int32))
+                 for path, (hashes, times) in landmarks.items()}
+        journal_file = _journal_file(fingerprint_file)
+        append_journal(journal_file, (added, list(removals), dict(renames)))
+        _invalidate(fingerprint_file, base=False)
+        if os.path.getsize(journal_file) > max(os.path.getsize(fingerprint_file) // 4, 1 << 20):
+            compact_fingerprint_index(fingerprint_file)
+
+# 查重：提取目标文件的地标并在指纹索引中投票，返回 [(路径, 票数, 起始秒数)]，只保留票数达到 MIN_MATCHES 的曲目
+def find_duplicates(target_file, fingerprint_file, top_n=10, stop_event=None):
+    from extraction_scheduler import extract_files
+
+    query = {}
+    extracted, failures = extract_files([target_file], max_workers=1, stop_event=stop_event,
+                                        on_landmarks=lambda path, landmarks: query.update(landmarks=landmarks))
+    if target_file in failures:
+        raise RuntimeError(failures[target_file])
+    if 'landmarks' not in query:
+        return []
+    index = load_fingerprint_index(fingerprint_file)
+    return [(index.path(track), votes, offset)
+            for track, votes, offset in index.query(query['landmarks'], top_n) if votes >= MIN_MATCHES]
@@ -0,0 +1,380 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from audio_scanner import AudioScanner, is_audio_file
+from feature_manager_gai import feature_manager_instance
+from extraction_scheduler import extract_files
+from segment_search import FrameStore, get_frame_file, update_frame_store
+from fingerprint_index import FingerprintIndex, get_fingerprint_file, update_fingerprint_index
+
+# 监控音频库目录，新增/修改/移动/删除的音频文件在防抖之后增量更新到特征索引
+# Linux 下使用 inotify，其他平台或 inotify 不可用时退回到定时轮询
+
+DEFAULT_DEBOUNCE_SECONDS = 2.0  # 最后一个事件之后等待多久再处理
+DEFAULT_MAX_DELAY_SECONDS = 30.0  # 持续有事件时最长等待多久必须处理一次
+DEFAULT_POLL_INTERVAL = 10.0  # 轮询模式的扫描间隔
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 文件变化事件类型
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+# 基于 inotify 的监控后端
+# 回调 on_change(kind, path) / on_rename(old_path, new_path) / on_resync()
+class InotifyBackend:
+    def __init__(self, root, libc, on_change, on_rename, on_resync):
+        self.root = root
+        self.libc = libc
+        self.on_change = on_change
+        self.on_rename = on_rename
+        self.on_resync = on_resync
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd_to_path = {}
+        self.pending_moves = {}  # cookie -> (path, is_dir, time)
+        self._add_tree(root)
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                print("inotify watch limit reached, increase fs.inotify.max_user_watches")
+            return
+        self.wd_to_path[wd] = path
+
+    # 递归监控目录，返回目录下已存在的音频文件（新目录移入时需要处理这些文件）
+    def _add_tree(self, path):
+        audio_files = []
+        self._add_watch(path)
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        audio_files.extend(self._add_tree(entry.path))
+                    elif entry.is_file() and is_audio_file(entry.name):
+                        audio_files.append(entry.path)
+        except OSError as e:
+            print(f"Error watching {path}: {e}")
+        return audio_files
+
+    # 目录被移动后更新 wd -> 路径的映射
+    def _rename_tree(self, old_path, new_path):
+        prefix = old_path + os.sep
+        for wd, path in list(self.wd_to_path.items()):
+            if path == old_path:
+                self.wd_to_path[wd] = new_path
+            elif path.startswith(prefix):
+                self.wd_to_path[wd] = new_path + path[len(old_path):]
+
+    # 超时未配对的 MOVED_FROM 说明文件被移出了监控目录，按删除处理
+    def _expire_moves(self, max_age=1.0):
+        now = time.monotonic()
+        for cookie, (path, is_dir, moved_at) in list(self.pending_moves.items()):
+            if now - moved_at > max_age:
+                del self.pending_moves[cookie]
+                self.on_change(DELETE, path)
+
+    def _handle_event(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            self.on_resync()
+            return
+        if mask & IN_IGNORED:
+            self.wd_to_path.pop(wd, None)
+            return
+        base = self.wd_to_path.get(wd)
+        if base is None:
+            return
+        path = os.path.join(base, name) if name else base
+        is_dir = bool(mask & IN_ISDIR)
+
+        if mask & IN_MOVED_FROM:
+            self.pending_moves[cookie] = (path, is_dir, time.monotonic())
+        elif mask & IN_MOVED_TO:
+            moved = self.pending_moves.pop(cookie, None)
+            if moved is not None:
+                old_path = moved[0]
+                if is_dir:
+                    self._rename_tree(old_path, path)
+                if is_dir or is_audio_file(os.path.basename(old_path)):
+                    self.on_rename(old_path, path)
+                elif is_audio_file(name):
+                    # 临时文件（.part、rsync 临时名）改名为音频文件：旧路径从未入索引，按新增处理
+                    self.on_change(UPSERT, path)
+            elif is_dir:
+                for file_path in self._add_tree(path):
+                    self.on_change(UPSERT, file_path)
+            elif is_audio_file(name):
+                self.on_change(UPSERT, path)
+        elif is_dir and mask & IN_CREATE:
+            for file_path in self._add_tree(path):
+                self.on_change(UPSERT, file_path)
+        elif mask & IN_DELETE:
+            self.on_change(DELETE, path)
+        elif mask & (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE) and not is_dir and is_audio_file(name):
+            self.on_change(UPSERT, path)
+
+    def run(self, stop_event):
+        try:
+            while not stop_event.is_set():
+                readable, _, _ = select.select([self.fd], [], [], 0.5)
+                self._expire_moves()
+                if not readable:
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                    offset += _EVENT_HEADER.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    self._handle_event(wd, mask, cookie, name)
+        finally:
+            os.close(self.fd)
+
+# 定时轮询的监控后端：比较两次扫描得到的 (mtime, size) 快照
+class PollingBackend:
+    def __init__(self, root, on_change, interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.on_change = on_change
+        self.interval = interval
+        self.snapshot = None
+
+    def _scan(self):
+        snapshot = {}
+        for file_path in AudioScanner(self.root):
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def run(self, stop_event):
+        self.snapshot = self._scan()
+        while not stop_event.wait(self.interval):
+            snapshot = self._scan()
+            for file_path, stamp in snapshot.items():
+                if self.snapshot.get(file_path) != stamp:
+                    self.on_change(UPSERT, file_path)
+            for file_path in self.snapshot.keys() - snapshot.keys():
+                self.on_change(DELETE, file_path)
+            self.snapshot = snapshot
+
+# 音频库监控：收集事件、防抖、只对受影响的文件提取特征，然后增量写入特征索引
+class LibraryWatcher:
+    def __init__(self, root, status_callback=None, use_polling=False,
+                 debounce=DEFAULT_DEBOUNCE_SECONDS, max_delay=DEFAULT_MAX_DELAY_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.status_callback = status_callback
+        self.use_polling = use_polling
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = {}  # 路径 -> UPSERT/DELETE，同一文件的多次事件只保留最后一次
+        self.renames = {}  # 旧路径 -> 新路径
+        self.needs_resync = True  # 启动时先与磁盘同步一次
+        self.first_event_time = None
+        self.last_event_time = None
+        self.threads = []
+
+    def _status(self, text):
+        if self.status_callback is not None:
+            self.status_callback(text)
+
+    def _touch(self):
+        now = time.monotonic()
+        if self.first_event_time is None:
+            self.first_event_time = now
+        self.last_event_time = now
+
+    def on_change(self, kind, path):
+        with self.lock:
+            self.pending[path] = kind
+            self._touch()
+
+    def on_rename(self, old_path, new_path):
+        with self.lock:
+            # 还未处理的事件跟随文件/目录一起移动
+            prefix = old_path + os.sep
+            for path in list(self.pending):
+                if path == old_path or path.startswith(prefix):
+                    self.pending[new_path + path[len(old_path):]] = self.pending.pop(path)
+            self.renames[old_path] = new_path
+            self._touch()
+
+    def on_resync(self):
+        with self.lock:
+            self.needs_resync = True
+            self._touch()
+
+    # 把目录重命名展开为索引中每个条目的重命名，返回 (重命名, 需要提取的新路径)
+    # 源路径不在索引中时（先写临时文件再改名，例如 rsync 的临时文件、下载的 .part 文件），
+    # 目标文件从未被提取过，按新增处理
+    def _expand_renames(self, renames, index_paths):
+        expanded = {}
+        upserts = []
+        for old_path, new_path in renames.items():
+            if old_path in index_paths:
+                expanded[old_path] = new_path
+                continue
+            prefix = old_path + os.sep
+            moved = {path: new_path + path[len(old_path):] for path in index_paths if path.startswith(prefix)}
+            expanded.update(moved)
+            if os.path.isdir(new_path):
+                moved_to = set(moved.values())
+                upserts.extend(path for path in AudioScanner(new_path, stop_event=self.stop_event)
+                               if path not in moved_to and path not in index_paths)
+            elif is_audio_file(new_path) and new_path not in index_paths:
+                upserts.append(new_path)
+        return expanded, upserts
+
+    # 全量对比磁盘和索引：补上未索引的文件，删除已不存在的条目
+    def _resync_changes(self, index_paths):
+        root_prefix = self.root + os.sep
+        disk_paths = set(AudioScanner(self.root, stop_event=self.stop_event))
+        quarantine = feature_manager_instance.get_quarantine()
+        upserts = {path: UPSERT for path in disk_paths - index_paths
+                   if not feature_manager_instance.is_quarantined(path, quarantine)}
+        removals = {path: DELETE for path in index_paths - disk_paths if path.startswith(root_prefix)}
+        return {**upserts, **removals}
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            renames, self.renames = self.renames, {}
+            resync, self.needs_resync = self.needs_resync, False
+            self.first_event_time = None
+            self.last_event_time = None
+
+        index_paths = set(feature_manager_instance.load_features().iter_paths())
+        if resync:
+            pending = {**self._resync_changes(index_paths), **pending}
+        renames, renamed_in = self._expand_renames(renames, index_paths)
+        for path in renamed_in:
+            pending.setdefault(path, UPSERT)
+
+        removals = []
+        to_extract = []
+        for path, kind in pending.items():
+            if kind == DELETE:
+                if path in index_paths:
+                    removals.append(path)
+                else:
+                    # 删除或移出的是目录，删除索引中该目录下的所有条目
+                    prefix = path + os.sep
+                    removals.extend(p for p in index_paths if p.startswith(prefix))
+            elif os.path.isfile(path):
+                to_extract.append(path)
+
+        # 特征文件带有片段定位用的帧序列文件时，同时保留新提取文件的帧序列
+        frame_file = get_frame_file(feature_manager_instance.get_feature_file())
+        keep_frames = FrameStore.exists(frame_file)
+        frames = {}
+        # 同样，带有指纹索引时同时提取新文件的地标指纹
+        fingerprint_file = get_fingerprint_file(feature_manager_instance.get_feature_file())
+        keep_fingerprints = FingerprintIndex.exists(fingerprint_file)
+        landmarks = {}
+
+        upserts, failures = {}, {}
+        if to_extract:
+            self._status(f"监控中: 正在提取 {len(to_extract)} 个文件")
+            quarantine = feature_manager_instance.get_quarantine()
+            # 在有超时保护的子进程中提取，隔离列表中未变化的文件直接跳过
+            upserts, failures = extract_files(to_extract, max_workers=min(len(to_extract), os.cpu_count() or 1),
+                                              stop_event=self.stop_event,
+                                              skip=lambda p: feature_manager_instance.is_quarantined(p, quarantine),
+                                              on_frames=frames.__setitem__ if keep_frames else None,
+                                              on_landmarks=landmarks.__setitem__ if keep_fingerprints else None,
+                                              memory_budget=feature_manager_instance.get_memory_budget(),
+                                              **feature_manager_instance.get_extraction_params())
+        if self.stop_event.is_set():
+            return
+
+        if upserts or removals or renames or failures:
+            feature_manager_instance.apply_changes(upserts, removals, renames, quarantine=failures)
+            if keep_frames:
+                update_frame_store(frame_file, frames, removals + list(failures), renames)
+            if keep_fingerprints:
+                update_fingerprint_index(fingerprint_file, landmarks, removals + list(failures), renames)
+        self._status(f"监控中: 新增/更新 {len(upserts)}, 删除 {len(removals)}, 移动 {len(renames)}, 失败 {len(failures)}")
+
+    def _debounce_loop(self):
+        while not self.stop_event.wait(0.2):
+            with self.lock:
+                if self.last_event_time is None and not self.needs_resync:
+                    continue
+                now = time.monotonic()
+                quiet = self.last_event_time is None or now - self.last_event_time >= self.debounce
+                overdue = self.first_event_time is not None and now - self.first_event_time >= self.max_delay
+            if quiet or overdue:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error updating feature index: {e}")
+
+    def start(self):
+        libc = None if self.use_polling else _load_libc()
+        backend = None
+        if libc is not None:
+            try:
+                backend = InotifyBackend(self.root, libc, self.on_change, self.on_rename, self.on_resync)
+                self._status(f"监控中 (inotify): {self.root}")
+            except OSError as e:
+                print(f"inotify unavailable, falling back to polling: {e}")
+        if backend is None:
+            backend = PollingBackend(self.root, self.on_change, self.poll_interval)
+            self._status(f"监控中 (轮询): {self.root}")
+
+        self.threads = [threading.Thread(target=backend.run, args=(self.stop_event,), daemon=True),
+                        threading.Thread(target=self._debounce_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
@@ -0,0 +1,129 @@
+import os
+import re
+
+# 多规则路径重映射
+# 规则按顺序排列，靠前的规则优先。两种规则：
+#   {"from": "D:\\音乐", "to": "/Volumes/音乐"}    前缀规则，路径以 from 开头时替换为 to
+#   {"root_name": "群里的歌", "to": "/Users/home/Downloads/音乐"}  根目录名规则，路径中任意位置出现该目录名时替换
+# 前缀规则按路径分段编译成前缀树，一次遍历即可找到所有匹配的规则。
+
+_SPLIT_RE = re.compile(r'[\\/]+')
+
+# 把路径拆成分段，同时兼容 Windows 和 macOS/Linux 的分隔符
+def split_path(path):
+    return [part for part in _SPLIT_RE.split(path) if part]
+
+class _TrieNode:
+    __slots__ = ('children', 'rule_index')
+
+    def __init__(self):
+        self.children = {}
+        self.rule_index = None
+
+class PathRemapper:
+    def __init__(self, rules=()):
+        self.rules = []
+        self.trie = _TrieNode()
+        self.name_rules = []  # (规则序号, 目录名分段)
+        self.cache = {}
+        self.prefixes = {}  # 原目录（带末尾分隔符） -> 映射后的目录前缀
+        self.dir_prefixes = []  # 路径表目录序号 -> 映射后的目录前缀，由 remap_all 填充
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        to = rule.get('to', '')
+        if not to:
+            return
+        index = len(self.rules)
+        if rule.get('from'):
+            node = self.trie
+            for part in split_path(rule['from']):
+                node = node.children.setdefault(part, _TrieNode())
+            if node.rule_index is None:
+                node.rule_index = index
+        elif rule.get('root_name'):
+            self.name_rules.append((index, split_path(rule['root_name'])))
+        else:
+            return
+        self.rules.append(rule)
+        self.cache.clear()
+        self.prefixes.clear()
+        self.dir_prefixes = []
+
+    # 返回 (规则序号, 匹配部分之后的剩余分段)，没有规则匹配时返回 None
+    def _match(self, parts):
+        best = None
+        node = self.trie
+        for depth, part in enumerate(parts):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.rule_index is not None and (best is None or node.rule_index < best[0]):
+                best = (node.rule_index, depth + 1)
+        for index, name_parts in self.name_rules:
+            if best is not None and best[0] < index:
+                break
+            n = len(name_parts)
+            for start in range(len(parts) - n + 1):
+                if parts[start:start + n] == name_parts:
+                    best = (index, start + n)
+                    break
+        if best is None:
+            return None
+        return best[0], parts[best[1]:]
+
+    # 拼接新路径，并按当前平台统一分隔符
+    def _join(self, to, rest):
+        parts = split_path(to) + list(rest)
+        prefix = os.sep if to[:1] in ('/', '\\') else ''
+        return prefix + os.sep.join(parts)
+
+    # 重映射目录，没有规则匹配时返回 None，结果按目录缓存
+    def remap_dir(self, directory):
+        if directory in self.cache:
+            return self.cache[directory]
+        matched = self._match(split_path(directory))
+        result = None
+        if matched is not None:
+            index, rest = matched
+            result = self._join(self.rules[index]['to'], rest)
+        self.cache[directory] = result
+        return result
+
+    # 目录映射后的前缀（带末尾分隔符），没有规则匹配时为原目录
+    def _prefix(self, directory):
+        prefix = self.prefixes.get(directory)
+        if prefix is None:
+            new_dir = self.remap_dir(directory.rstrip('/\\'))
+            if new_dir is None:
+                prefix = directory
+            else:
+                prefix = new_dir if new_dir.endswith(os.sep) else new_dir + os.sep
+            self.prefixes[directory] = prefix
+        return prefix
+
+    # 重映射单个路径，没有规则匹配时原样返回。所在目录查前缀缓存，再拼上文件名
+    def remap(self, path):
+        k = max(path.rfind('/'), path.rfind('\\'))
+        if k < 0:
+            new_path = self.remap_dir(path)
+            return path if new_path is None else new_path
+        return self._prefix(path[:k + 1]) + path[k + 1:]
+
+    # 一次性重映射整个目录表（PathTable.directories() 的顺序即目录序号），之后显示结果时只需要查表
+    def remap_all(self, directories):
+        self.dir_prefixes = [self._prefix(directory) for directory in directories]
+        return self.dir_prefixes
+
+    # 路径表中第 i 个条目映射后的路径，直接用目录序号查 remap_all 的结果
+    def remap_entry(self, paths, i):
+        return self.dir_prefixes[paths.entry_dir[i]] + paths.name(i)
+
+    @classmethod
+    def from_settings(cls, settings):
+        rules = list(settings.get('rules', []))
+        # 兼容旧的单条规则设置
+        if settings.get('root_folder_name') and settings.get('new_root_path'):
+            rules.append({'root_name': settings['root_folder_name'], 'to': settings['new_root_path']})
+        return cls(rules)
@@ -0,0 +1,74 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 搜索结果缓存
+# 按 (目标文件内容哈希, 索引标识, 索引版本, 度量方式, 特征权重) 缓存完整的排序结果（行号和分数），
+# 同一个目标再次搜索或者只是改大 top_n 时直接返回。按内存占用做 LRU 淘汰，索引更新时清除对应的缓存。
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024  # 缓存占用的内存上限
+
+# 计算文件内容哈希，按 (路径, 大小, 修改时间) 记住结果，同一个文件不重复读取
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+def file_content_hash(file_path):
+    st = os.stat(file_path)
+    stamp = (file_path, st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        digest = _hash_cache.get(stamp)
+    if digest is not None:
+        return digest
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_cache[stamp] = digest
+    return digest
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (rows, scores)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+
+    # 缓存键，weights 为 {特征名: 权重} 或 None
+    @staticmethod
+    def make_key(target_hash, index_id, index_version, metric, weights=None):
+        weights_key = tuple(sorted(weights.items())) if weights else None
+        return (target_hash, index_id, index_version, metric, weights_key)
+
+    # 返回 (按相似度排好序的行号, 对应的分数)，没有缓存时返回 None
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, rows, scores):
+        size = rows.nbytes + scores.nbytes
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[0].nbytes + old[1].nbytes
+            self.entries[key] = (rows, scores)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (old_rows, old_scores) = self.entries.popitem(last=False)
+                self.current_bytes -= old_rows.nbytes + old_scores.nbytes
+
+    # 索引更新后清除该索引的所有缓存结果
+    def invalidate(self, index_id=None):
+        with self.lock:
+            for key in [k for k in self.entries if index_id is None or k[1] == index_id]:
+                rows, scores = self.entries.pop(key)
+                self.current_bytes -= rows.nbytes + scores.nbytes
+
+result_cache_instance = ResultCache()
@@ -0,0 +1,114 @@
+import os
+import tkinter as tk
+from tkinter import ttk
+
+# 搜索结果表格：结果保存在旁边的列表（模型）中，Treeview 只按需插入用户滚动到的行。
+# 一开始只插入第一页，滚动条接近底部时再追加下一页；路径重映射和文件名拆分也只对插入的行做一次，
+# 上万条结果时界面仍然即时响应，不再需要隐藏的白色路径行。
+
+PAGE_SIZE = 200  # 每次插入的行数
+LOAD_MORE_AT = 0.9  # 可见区域底部超过已插入行的这个比例时追加下一页
+SOURCE_ROW = 'source'
+
+# 秒数格式化为 分:秒
+def format_offset(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+class ResultView(tk.Frame):
+    # remap: 显示和打开文件前的路径映射函数；on_open(路径, 起始秒数或 None): 双击行时调用；on_context_menu(event): 右键时调用
+    def __init__(self, master, remap=None, on_open=None, on_context_menu=None, height=8, **kwargs):
+        super().__init__(master, **kwargs)
+        self.remap = remap or (lambda path: path)
+        self.on_open = on_open
+        self.on_context_menu = on_context_menu
+        self.tree = ttk.Treeview(self, columns=('rank', 'name', 'score', 'offset'), show='headings',
+                                 height=height, selectmode='browse')
+        for column, width, anchor in (('rank', 50, tk.E), ('name', 300, tk.W), ('score', 90, tk.E),
+                                      ('offset', 70, tk.E)):
+            self.tree.column(column, width=width, anchor=anchor, stretch=(column == 'name'))
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.bind('<Double-1>', self._on_double_click)
+        self.tree.bind('<Button-3>', self._on_right_click)
+        self.items = []
+        self.source = None
+        self.loaded = 0
+        self.score_format = '{}'
+        self.resolved = {}
+
+    # 显示一组结果。items: [(路径, 分数, 起始秒数或 None)]；source 为目标文件路径，显示在第一行用于试听
+    def show(self, items, score_label="Score", score_format='{}', source=None, offset_label=""):
+        self.tree.delete(*self.tree.get_children())
+        self.items = list(items)
+        self.source = source
+        self.loaded = 0
+        self.score_format = score_format
+        self.resolved = {}
+        self.tree.heading('rank', text="#")
+        self.tree.heading('name', text="文件")
+        self.tree.heading('score', text=score_label)
+        self.tree.heading('offset', text=offset_label)
+        if source is not None:
+            self.tree.insert('', tk.END, iid=SOURCE_ROW,
+                             values=("", f">>> 双击我试听原音频 - {os.path.basename(self.remap(source))}", "", ""))
+        self._load_page()
+        self.tree.yview_moveto(0)
+
+    def clear(self):
+        self.show([])
+
+    def _load_page(self):
+        end = min(self.loaded + PAGE_SIZE, len(self.items))
+        for i in range(self.loaded, end):
+            _, score, offset = self.items[i]
+            self.tree.insert('', tk.END, iid=str(i),
+                             values=(f"[{i + 1}]", os.path.basename(self.path(i)), self.score_format.format(score),
+                                     format_offset(offset) if offset is not None else ""))
+        self.loaded = end
+
+    # 滚动时由 Treeview 调用，转发给滚动条，并在接近底部时追加下一页
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loaded < len(self.items) and float(last) >= LOAD_MORE_AT:
+            self._load_page()
+
+    # 第 i 个结果映射后的路径（只在第一次用到时映射）
+    def path(self, i):
+        if i not in self.resolved:
+            self.resolved[i] = self.remap(self.items[i][0])
+        return self.resolved[i]
+
+    # 前 n 行（包括原音频行）的 [(路径, 起始秒数或 None)]，用于预先解码试听片段
+    def top_items(self, n):
+        items = [(self.remap(self.source), None)] if self.source is not None else []
+        items += [(self.path(i), self.items[i][2]) for i in range(min(n, len(self.items)))]
+        return items[:n]
+
+    # 当前选中行对应的 (文件路径, 起始秒数或 None)，没有选中时为 (None, None)
+    def selected_item(self):
+        selection = self.tree.selection()
+        if not selection:
+            return None, None
+        if selection[0] == SOURCE_ROW:
+            return self.remap(self.source), None
+        i = int(selection[0])
+        return self.path(i), self.items[i][2]
+
+    def selected_path(self):
+        return self.selected_item()[0]
+
+    def _on_double_click(self, event):
+        row = self.tree.identify_row(event.y)
+        if row and self.on_open is not None:
+            self.tree.selection_set(row)
+            self.on_open(*self.selected_item())
+
+    def _on_right_click(self, event):
+        row = self.tree.identify_row(event.y)
+        if row:
+            self.tree.selection_set(row)
+            if self.on_context_menu is not None:
+                self.on_context_menu(event)
@@ -0,0 +1,358 @@
+import os
+import threading
+import numpy as np
+import joblib
+from feature_index import PathTable, append_journal, read_journal
+from audio_decoder import ANALYSIS_SR
+from audio_worker import HOP_LENGTH, FRAME_BLOCK, FRAME_FEATURES
+
+# 片段定位：给一段几秒到几十秒的片段，找出它来自库中的哪首曲目以及在曲目中的位置。
+# 特征提取时把每首曲目的逐帧 chroma/mfcc（每 FRAME_BLOCK 帧取均值）以 float16 追加写入 <特征文件>.frames，
+# 偏移量表和路径表写入 <特征文件>.frames.idx。查询时先用均值向量粗筛候选曲目，
+# 再把片段在每个候选曲目上滑动，用 FFT 批量计算归一化互相关（NCC），取峰值作为匹配分数和位置。
+# 增量更新时新曲目的帧序列直接追加到数据文件末尾，路径和偏移量的变化追加到 <特征文件>.frames.journal，
+# 不重写整个文件；日志记录过多或数据文件中失效的帧过多时才合并（compact_frame_store）。
+
+FRAME_STORE_FORMAT = 'frame-store'
+FRAME_STORE_VERSION = 1
+FRAME_SECONDS = FRAME_BLOCK * HOP_LENGTH / ANALYSIS_SR  # 帧序列中每一帧对应的时长
+COARSE_CANDIDATES = 2000  # 粗筛保留的候选曲目数
+BATCH_ELEMENTS = 1 << 22  # 每批 FFT 的 (曲目数 x 长度 x 维度) 上限，控制内存占用
+JOURNAL_COMPACT_RECORDS = 200  # 增量日志超过这么多条记录时合并回偏移量表
+DEAD_FRAMES_RATIO = 0.25  # 数据文件中失效的帧（已删除或被替换的曲目）超过有效帧的这个比例时重写数据文件
+
+_update_lock = threading.Lock()
+
+def get_frame_file(feature_file):
+    return feature_file + '.frames'
+
+def _index_file(frame_file):
+    return frame_file + '.idx'
+
+def _journal_file(frame_file):
+    return frame_file + '.journal'
+
+# 按日志记录修改 {路径: (偏移量, 帧数)}：先重命名，再删除被删除和重新提取的曲目，最后加入新曲目
+def _apply_journal_record(entries, record):
+    added, removals, renames = record
+    if renames:
+        # 重命名到已有路径时，移动过去的曲目覆盖原来的条目
+        moved = {renames[path]: entries.pop(path) for path in list(entries) if path in renames}
+        entries.update(moved)
+    for path in list(removals) + [path for path, _, _ in added]:
+        entries.pop(path, None)
+    for path, offset, length in added:
+        entries[path] = (offset, length)
+    return entries
+
+# 帧序列写入器，构建完成前写入临时文件，close() 时一次性替换，取消时 abort() 删除
+class FrameStoreWriter:
+    def __init__(self, frame_file):
+        self.frame_file = frame_file
+        self.tmp_file = frame_file + '.tmp'
+        self.paths = []
+        self.offsets = []
+        self.lengths = []
+        self.total = 0
+        self.dim = None
+        self.sums = None
+        self.sq_sums = None
+        self.data = open(self.tmp_file, 'wb')
+
+    def add(self, path, frames):
+        frames = np.ascontiguousarray(frames, dtype=np.float16)
+        if self.dim is None:
+            self.dim = frames.shape[1]
+            self.sums = np.zeros(self.dim, dtype=np.float64)
+            self.sq_sums = np.zeros(self.dim, dtype=np.float64)
+        self.data.write(frames.tobytes())
+        self.paths.append(path)
+        self.offsets.append(self.total)
+        self.lengths.append(len(frames))
+        self.total += len(frames)
+        values = frames.astype(np.float64)
+        self.sums += values.sum(axis=0)
+        self.sq_sums += (values * values).sum(axis=0)
+
+    def close(self, roots=None):
+        self.data.close()
+        dim = self.dim or 0
+        count = max(self.total, 1)
+        mean = self.sums / count if self.sums is not None else np.zeros(dim)
+        var = self.sq_sums / count - mean * mean if self.sq_sums is not None else np.ones(dim)
+        std = np.sqrt(np.maximum(var, 0))
+        std[std < 1e-6] = 1.0
+        state = {
+            'format': FRAME_STORE_FORMAT,
+            'version': FRAME_STORE_VERSION,
+            'dim': dim,
+            'frame_seconds': FRAME_SECONDS,
+            'features': FRAME_FEATURES,
+            'paths': PathTable.from_paths(self.paths, roots).to_state(),
+            'offsets': np.asarray(self.offsets, dtype=np.int64),
+            'lengths': np.asarray(self.lengths, dtype=np.int32),
+            # 各维度的均值和标准差，计算互相关前用来做 z-score，避免 mfcc 的第 0 维主导结果
+            'mean': mean.astype(np.float32),
+            'std': std.astype(np.float32),
+        }
+        os.replace(self.tmp_file, self.frame_file)
+        joblib.dump(state, _index_file(self.frame_file))
+        # 完整写入后增量日志已经包含在文件中
+        if os.path.exists(_journal_file(self.frame_file)):
+            os.remove(_journal_file(self.frame_file))
+
+    def abort(self):
+        self.data.close()
+        if os.path.exists(self.tmp_file):
+            os.remove(self.tmp_file)
+
+# 删除帧序列文件及其偏移量表、增量日志（重新构建时不再保存片段定位数据）
+def remove_frame_store(frame_file):
+    with _update_lock:
+        for path in (frame_file, _index_file(frame_file), _journal_file(frame_file)):
+            if os.path.exists(path):
+                os.remove(path)
+
+class FrameStore:
+    def __init__(self, frame_file):
+        state = joblib.load(_index_file(frame_file))
+        self.frame_file = frame_file
+        self.paths = PathTable.from_state(state['paths'])
+        self.offsets = state['offsets']
+        self.lengths = state['lengths']
+        self.dim = state['dim']
+        self.frame_seconds = state['frame_seconds']
+        self.mean = state['mean']
+        self.std = state['std']
+        self.state = state
+        self.journal_records = self._replay_journal()
+        # 数据文件按需映射，不整体读入内存；追加过的数据文件中可能有不再被引用的帧
+        total = os.path.getsize(frame_file) // (self.dim * 2) if self.dim else 0
+        self.data = (np.memmap(frame_file, dtype=np.float16, mode='r', shape=(total, self.dim))
+                     if total else np.zeros((0, self.dim), dtype=np.float16))
+        self._lookup = None
+
+    # 把增量日志应用到路径表和偏移量表，返回日志记录数
+    def _replay_journal(self):
+        records = read_journal(_journal_file(self.frame_file))
+        if not records:
+            return 0
+        entries = {path: (int(offset), int(length))
+                   for path, offset, length in zip(self.paths.iter_paths(), self.offsets, self.lengths)}
+        for record in records:
+            entries = _apply_journal_record(entries, record)
+        roots = [root for root in self.paths.roots if root]
+        self.paths = PathTable.from_paths(list(entries), roots)
+        self.offsets = np.asarray([offset for offset, _ in entries.values()], dtype=np.int64)
+        self.lengths = np.asarray([length for _, length in entries.values()], dtype=np.int32)
+        return len(records)
+
+    @staticmethod
+    def exists(frame_file):
+        return os.path.exists(frame_file) and os.path.exists(_index_file(frame_file))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def iter_paths(self):
+        return self.paths.iter_paths()
+
+    def lookup(self):
+        if self._lookup is None:
+            self._lookup = {path: i for i, path in enumerate(self.iter_paths())}
+        return self._lookup
+
+    def sequence(self, i):
+        start = self.offsets[i]
+        return self.data[start:start + self.lengths[i]]
+
+    # 数据文件中不再被引用的帧数
+    def dead_frames(self):
+        return len(self.data) - int(self.lengths.sum())
+
+    # 把当前的路径表和偏移量表（已应用增量日志）写回 .idx 并删除日志，数据文件不变
+    def save_index(self):
+        self.state.update(paths=self.paths.to_state(), offsets=self.offsets, lengths=self.lengths)
+        tmp_file = _index_file(self.frame_file) + '.tmp'
+        joblib.dump(self.state, tmp_file)
+        os.replace(tmp_file, _index_file(self.frame_file))
+        if os.path.exists(_journal_file(self.frame_file)):
+            os.remove(_journal_file(self.frame_file))
+        self.journal_records = 0
+
+    # 只修改根目录表，数据文件不变（增量日志中的完整路径同时合并进路径表）
+    def change_root(self, old_root, new_root):
+        self.paths.roots = [new_root if root == old_root else root for root in self.paths.roots]
+        self.save_index()
+
+# 完整重写帧序列文件：只复制仍然有效的序列，回收已删除曲目占用的空间，并重新计算 z-score 统计量
+def _rewrite_frame_store(frame_file, frames=None, removals=(), renames=None):
+    frames = frames or {}
+    renames = renames or {}
+    removed = set(removals) | set(frames)
+    targets = set(renames.values())
+    writer = FrameStoreWriter(frame_file)
+    try:
+        roots = None
+        if FrameStore.exists(frame_file):
+            store = FrameStore(frame_file)
+            roots = [root for root in store.paths.roots if root]
+            for i, original in enumerate(store.iter_paths()):
+                path = renames.get(original, original)
+                # 被重命名覆盖的曲目不再保留
+                if path not in removed and not (path == original and path in targets):
+                    writer.add(path, store.sequence(i))
+            del store
+        for path, sequence in frames.items():
+            writer.add(path, sequence)
+        writer.close(roots)
+    except BaseException:
+        writer.abort()
+        raise
+
+# 合并增量日志：失效的帧不多时只重写偏移量表，否则重写整个数据文件
+def compact_frame_store(frame_file):
+    store = FrameStore(frame_file)
+    if store.dead_frames() > DEAD_FRAMES_RATIO * int(store.lengths.sum()):
+        del store
+        _rewrite_frame_store(frame_file)
+    elif store.journal_records:
+        store.save_index()
+
+# 增量更新帧序列文件：删除、重命名并追加新提取的曲目。
+# 新序列追加到数据文件末尾，路径变化追加到增量日志，每次更新只写入变化的部分；
+# 日志记录数或追加的帧数超过阈值时合并（z-score 统计量在重写数据文件时更新）
+def update_frame_store(frame_file, frames, removals=(), renames=None):
+    renames = renames or {}
+    if not (frames or removals or renames):
+        return
+    with _update_lock:
+        if not FrameStore.exists(frame_file) or os.path.getsize(frame_file) == 0:
+            # 还没有帧序列（或是空文件，维度未知）时直接完整写入
+            _rewrite_frame_store(frame_file, frames, removals, renames)
+            return
+        added = []
+        with open(frame_file, 'ab') as f:
+            size = f.seek(0, os.SEEK_END)
+            for path, sequence in frames.items():
+                sequence = np.ascontiguousarray(sequence, dtype=np.float16)
+                row_bytes = sequence.shape[1] * 2
+                # 上次追加中断时数据文件末尾可能不是整帧，补齐后再写
+                if size % row_bytes:
+                    size += f.write(b'\0' * (row_bytes - size % row_bytes))
+                added.append((path, size // row_bytes, len(sequence)))
+                size += f.write(sequence.tobytes())
+        # 先写数据再写日志，中断时最多在数据文件末尾留下没有被引用的帧
+        append_journal(_journal_file(frame_file), (added, list(removals), dict(renames)))
+        records = read_journal(_journal_file(frame_file))
+        appended = [(offset, length) for record in records for _, offset, length in record[0]]
+        total = max((offset + length for offset, length in appended), default=0)
+        # 追加的帧中有多少替换了旧序列只有加载偏移量表才知道，追加量较大时合并一次再检查
+        if (len(records) > JOURNAL_COMPACT_RECORDS
+                or sum(length for _, length in appended) > DEAD_FRAMES_RATIO * total):
+            compact_frame_store(frame_file)
+
+# 片段按全库统计量做 z-score，再减去片段自身的均值（互相关时窗口均值的影响随之消除）
+def _prepare_query(query_frames, store):
+    query = (np.asarray(query_frames, dtype=np.float32) - store.mean) / store.std
+    query -= query.mean(axis=0)
+    return query
+
+# 对一批曲目计算片段在每个位置上的归一化互相关，返回每首曲目的 (最大 NCC, 位置)
+def _correlate_batch(query, query_norm, sequences, store):
+    m = len(query)
+    n = 1
+    while n < max(len(seq) for seq in sequences):
+        n *= 2
+    batch = np.zeros((len(sequences), n, store.dim), dtype=np.float32)
+    for b, seq in enumerate(sequences):
+        batch[b, :len(seq)] = (seq.astype(np.float32) - store.mean) / store.std
+    # 互相关：irfft(FFT(x) * conj(FFT(q)))，各维度的结果在频域直接相加
+    spectrum = np.fft.rfft(batch, axis=1)
+    query_spectrum = np.conj(np.fft.rfft(query, n=n, axis=0))
+    correlation = np.fft.irfft(np.einsum('bfd,fd->bf', spectrum, query_spectrum), n=n, axis=1)
+
+    results = []
+    for b, seq in enumerate(sequences):
+        positions = len(seq) - m + 1
+        x = batch[b, :len(seq)].astype(np.float64)
+        # 每个窗口去均值后的能量：sum(x^2) - sum(x)^2 / m，用前缀和一次算出所有窗口
+        cs = np.vstack([np.zeros((1, store.dim)), np.cumsum(x, axis=0)])
+        cs2 = np.vstack([np.zeros((1, store.dim)), np.cumsum(x * x, axis=0)])
+        window_sum = cs[m:m + positions] - cs[:positions]
+        window_sq = cs2[m:m + positions] - cs2[:positions]
+        energy = (window_sq - window_sum * window_sum / m).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ncc = correlation[b, :positions] / (query_norm * np.sqrt(energy))
+        ncc[~np.isfinite(ncc)] = -1.0
+        best = int(np.argmax(ncc))
+        results.append((float(ncc[best]), best))
+    return results
+
+# 在候选曲目（帧序列文件中的序号，None 为全部）中定位片段，返回按匹配度从高到低的 [(序号, NCC, 起始秒数)]
+def locate_clip(query_frames, store, candidates=None, top_n=10, stop_event=None, progress=None):
+    query = _prepare_query(query_frames, store)
+    m = len(query)
+    query_norm = np.sqrt((query.astype(np.float64) ** 2).sum())
+    if m == 0 or query_norm == 0:
+        return []
+    if candidates is None:
+        candidates = range(len(store))
+    # 比片段短的曲目不可能包含它；按长度排序后分批，同一批补零的浪费最少
+    candidates = sorted((i for i in candidates if store.lengths[i] >= m), key=lambda i: store.lengths[i])
+
+    matches = []
+    done = 0
+    start = 0
+    while start < len(candidates):
+        if stop_event is not None and stop_event.is_set():
+            return []
+        end = start + 1
+        while (end < len(candidates)
+               and (end - start + 1) * int(store.lengths[candidates[end]]) * 2 * store.dim <= BATCH_ELEMENTS):
+            end += 1
+        batch = candidates[start:end]
+        for i, (score, position) in zip(batch, _correlate_batch(query, query_norm,
+                                                                 [store.sequence(i) for i in batch], store)):
+            matches.append((i, score, position * store.frame_seconds))
+        done += len(batch)
+        if progress is not None:
+            progress(done, len(candidates))
+        start = end
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:top_n]
+
+# 片段定位的完整流程：提取片段的帧序列和均值特征，用均值向量粗筛，再逐个候选计算互相关
+# 返回 [(路径, NCC, 起始秒数)]
+# silence_thresh 与构建索引时的提取参数一致，粗筛用的均值向量才可比
+def find_clip(clip_file, index, frame_file, top_n=10, candidates=COARSE_CANDIDATES, stop_event=None, progress=None,
+              silence_thresh=None):
+    from extraction_scheduler import extract_files
+    from similarity_metrics import rank, DEFAULT_WEIGHTS
+    from feature_schema import compatible_columns
+
+    query = {}
+    extracted, failures = extract_files([clip_file], max_workers=1, stop_event=stop_event,
+                                        on_frames=lambda path, frames: query.update(frames=frames),
+                                        silence_thresh=silence_thresh)
+    if clip_file in failures:
+        raise RuntimeError(failures[clip_file])
+    if clip_file not in extracted:
+        return []
+    store = FrameStore(frame_file)
+
+    # 粗筛：片段的均值向量和整首曲目的均值向量不会完全一致，保留较多候选，库小于候选数时不筛选
+    # （只用与当前提取参数一致的特征列，没有可用的列时不筛选）
+    rows = None
+    usable = compatible_columns(index)
+    weights = {name: weight for name, weight in DEFAULT_WEIGHTS.items() if name in usable}
+    if candidates is not None and len(index) > candidates and weights:
+        rows, _ = rank(index, extracted[clip_file], 'cosine', weights, top_k=candidates)
+    if rows is None:
+        store_rows = None
+    else:
+        lookup = store.lookup()
+        store_rows = [lookup[path] for path in (index.path(row) for row in rows) if path in lookup]
+
+    matches = locate_clip(query['frames'], store, store_rows, top_n, stop_event, progress)
+    return [(store.paths.path(i), score, offset) for i, score, offset in matches]
@@ -0,0 +1,81 @@
+# 相似度度量
+# 每种度量对整个特征库只做一次矩阵-向量乘法（BLAS），再用构建索引时预计算的行范数和 z-score 统计量换算成距离。
+# 多种特征（mfcc、chroma）的距离按权重加权平均，分数越小越相似，某行缺少的特征不参与平均。
+# 界面启动时只需要度量名称，numpy 在真正计算时才导入。
+
+DEFAULT_METRIC = 'inverse_cosine'
+
+# 度量名 -> 界面上显示的名称
+METRICS = {
+    'inverse_cosine': '反余弦 |1/(1-cosine)|',
+    'cosine': '余弦距离',
+    'euclidean': '欧氏距离 (z-score)',
+}
+
+DEFAULT_WEIGHTS = {'mfcc': 1.0, 'chroma': 1.0}
+
+# 解析界面上输入的权重，例如 "mfcc=2, chroma=1"
+def parse_weights(text):
+    weights = {}
+    for part in text.replace('，', ',').split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        weights[name.strip()] = float(value)
+    return weights
+
+def format_weights(weights):
+    return ', '.join(f'{name}={value:g}' for name, value in weights.items())
+
+# 一种特征下目标与所有行的距离，缺少该特征的行为 NaN
+def feature_distances(index, name, target_vector, metric):
+    import numpy as np
+
+    matrix = index.features[name]
+    arrays = index.metric_arrays(name)
+    target = np.asarray(target_vector, dtype=np.float32).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == 'euclidean':
+            stats = index.metric_stats().get(name)
+            std = stats['std'] if stats is not None else np.ones(len(target), dtype=np.float32)
+            scaled_target = target / std
+            # |x/s - t/s|^2 = |x/s|^2 + |t/s|^2 - 2 x·(t/s^2)
+            dot = matrix @ (scaled_target / std)
+            squared = arrays['scaled_sq'] + np.dot(scaled_target, scaled_target) - 2 * dot
+            distances = np.sqrt(np.maximum(squared, 0))
+        else:
+            similarity = (matrix @ target) * arrays['inv_norm'] / np.linalg.norm(target)
+            if metric == 'cosine':
+                distances = 1 - similarity
+            elif metric == 'inverse_cosine':
+                distances = np.abs(1 / similarity)
+            else:
+                raise ValueError(f"Unknown metric: {metric}")
+    distances[~arrays['valid']] = np.nan
+    return distances
+
+# 计算目标与索引中所有行的加权距离，返回按距离从小到大排好序的前 top_k 行 (行号, 分数)
+def rank(index, target_features, metric=DEFAULT_METRIC, weights=None, top_k=None):
+    import numpy as np
+
+    weights = weights or DEFAULT_WEIGHTS
+    total = np.zeros(len(index), dtype=np.float64)
+    weight_sum = np.zeros(len(index), dtype=np.float64)
+    for name, weight in weights.items():
+        if weight <= 0 or name not in target_features or name not in index.features:
+            continue
+        distances = feature_distances(index, name, target_features[name], metric)
+        present = ~np.isnan(distances)
+        total[present] += weight * distances[present]
+        weight_sum[present] += weight
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(weight_sum > 0, total / weight_sum, np.inf).astype(np.float32)
+
+    # 只对前 top_k 个做完整排序
+    if top_k is not None and top_k < len(scores):
+        rows = np.argpartition(scores, top_k)[:top_k]
+        rows = rows[np.argsort(scores[rows], kind='stable')]
+    else:
+        rows = np.argsort(scores, kind='stable')
+    return rows.astype(np.int32), scores[rows]
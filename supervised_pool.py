@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+import pickle
+import queue
+import types
+import importlib
+import importlib.util
+import threading
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import Future
+
+# 带超时和自动替换的进程池
+# 每个任务在子进程中执行，超过墙钟时间的任务所在的进程会被杀掉并换一个新进程，
+# 进程崩溃（例如解码库段错误）也只会让当前任务失败，不会像 ProcessPoolExecutor 那样整个池子 BrokenProcessPool。
+
+DEFAULT_TASK_TIMEOUT = 120.0  # 单个任务的墙钟超时时间（秒）
+WORKER_MAIN_MODULE = 'audio_worker'  # spawn 启动的工作进程只导入这个轻量模块，而不是 GUI 主程序
+WORKER_INITIALIZER = 'audio_worker:warm_up'  # 工作进程启动后立即预热
+
+# 工作进程内 BLAS / OpenMP / FFT / numba 各自的线程池大小。每个进程都按核心数开线程时，
+# 15 个进程 x 16 个线程会远远超过核心数，互相抢占反而变慢，所以在工作进程启动时显式固定
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS')
+
+class TaskTimeout(Exception):
+    pass
+
+class WorkerCrashed(Exception):
+    pass
+
+# 当前进程可以使用的核心数（考虑 CPU 亲和性设置）
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# 自动决定 进程数 x 每进程线程数：特征提取的大部分时间花在单线程的解码和逐帧计算上，
+# 默认每个核心一个进程、每个进程一个线程；指定的进程数少于核心数时，剩余核心平分给各进程的内部线程
+def plan_workers(max_workers=None, cores=None):
+    cores = cores or available_cores()
+    processes = max_workers or cores
+    return processes, max(cores // processes, 1)
+
+# 在工作进程中限制内部库的线程数。环境变量对之后才加载的库生效，
+# 已经加载的 BLAS/OpenMP（fork 方式继承自主进程，spawn 方式在导入工作模块时加载）
+# 通过可选依赖 threadpoolctl 在运行时限制，numba 通过 set_num_threads 限制
+def limit_threads(threads):
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+    numba = sys.modules.get('numba')
+    if numba is not None:
+        try:
+            numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+        except Exception:
+            pass
+
+# 当前进程中各内部线程池的线程数 {库: 线程数}（需要 threadpoolctl），用于确认限制已经生效
+def inner_thread_counts():
+    counts = {}
+    try:
+        from threadpoolctl import threadpool_info
+        for info in threadpool_info():
+            counts[info['internal_api']] = max(counts.get(info['internal_api'], 0), info['num_threads'])
+    except ImportError:
+        pass
+    numba = sys.modules.get('numba')
+    if numba is not None:
+        counts['numba'] = numba.get_num_threads()
+    return counts
+
+# 初始化函数可以写成 "模块:函数" 字符串，由工作进程自己导入，主进程不必提前导入重量级模块
+def _resolve(func):
+    if isinstance(func, str):
+        module_name, _, func_name = func.partition(':')
+        return getattr(importlib.import_module(module_name), func_name)
+    return func
+
+# 工作进程启动后先限制内部库的线程数，再执行初始化函数。线程数只在子进程中设置，
+# 不修改主进程的环境变量（主进程的其他线程同时启动的子进程不会受影响）
+def _worker_main(task_queue, result_queue, initializer, initargs, threads=None):
+    if threads:
+        limit_threads(threads)
+    if initializer is not None:
+        try:
+            _resolve(initializer)(*initargs)
+        except Exception as e:
+            print(f"Worker initializer failed: {e}")
+    while True:
+        item = task_queue.get()
+        if item is None:
+            break
+        task_id, func, args, kwargs = item
+        result_queue.put(('start', task_id, os.getpid()))
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            # 无法序列化的异常转换成 RuntimeError，保证主进程一定能收到结果
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(f"{type(e).__name__}: {e}")
+            result_queue.put(('error', task_id, e))
+        else:
+            result_queue.put(('done', task_id, result))
+
+# spawn 方式（Windows/macOS）下子进程会重新导入主模块。启动进程时临时把主模块换成轻量的工作模块，
+# 子进程就不会再导入 GUI、tkinter 等与计算无关的模块
+@contextlib.contextmanager
+def _lightweight_main(ctx, main_module):
+    if main_module is None or ctx.get_start_method() == 'fork':
+        yield
+        return
+    spec = importlib.util.find_spec(main_module)
+    if spec is None:
+        yield
+        return
+    # 只需要模块名（子进程按名字导入），主进程不必真正导入它
+    stand_in = types.ModuleType('__main__')
+    stand_in.__spec__ = spec
+    stand_in.__file__ = spec.origin
+    original = sys.modules['__main__']
+    sys.modules['__main__'] = stand_in
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = original
+
+class _Worker:
+    def __init__(self, ctx, result_queue, initializer, initargs, main_module=None, threads=None):
+        # 每个进程有自己的任务队列，这样超时被杀掉时只会丢失它自己正在执行的任务
+        self.task_queue = ctx.Queue()
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(self.task_queue, result_queue, initializer, initargs, threads),
+                                   daemon=True)
+        with _lightweight_main(ctx, main_module):
+            self.process.start()
+        self.task_id = None
+        self.started_at = None
+        self.timeout = None
+
+    @property
+    def busy(self):
+        return self.task_id is not None
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+
+# threads_per_worker: 每个工作进程内部库的线程数，None 时按核心数自动决定，0 表示不限制
+class SupervisedPool:
+    def __init__(self, max_workers=None, timeout=DEFAULT_TASK_TIMEOUT, initializer=None, initargs=(),
+                 main_module=None, threads_per_worker=None):
+        processes, threads = plan_workers(max_workers)
+        self.max_workers = processes
+        self.threads_per_worker = threads if threads_per_worker is None else threads_per_worker
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self.main_module = main_module
+        self.ctx = multiprocessing.get_context()
+        self.result_queue = self.ctx.Queue()
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()  # 等待分配的 (task_id, func, args, kwargs, timeout)
+        self.futures = {}
+        self.cancelled = set()  # 需要中止的正在执行的任务
+        self.ids = itertools.count()
+        self.workers = [self._spawn() for _ in range(self.max_workers)]
+        self.shutdown_event = threading.Event()
+        self.supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self.supervisor.start()
+
+    def _spawn(self):
+        return _Worker(self.ctx, self.result_queue, self.initializer, self.initargs, self.main_module,
+                       self.threads_per_worker)
+
+    # 调整进程数，由监督线程在进程空闲时增减
+    def resize(self, max_workers):
+        self.max_workers = max(1, max_workers)
+
+    # 取消一组任务：还没开始的直接取消，正在执行的杀掉进程并换新
+    def cancel(self, futures):
+        with self.lock:
+            ids = {task_id for task_id, future in self.futures.items() if future in futures}
+            self.cancelled.update(ids)
+        for future in futures:
+            future.cancel()
+
+    # 提交任务，返回 concurrent.futures.Future，可以和 wait/as_completed 一起使用
+    def submit(self, func, *args, timeout=None, **kwargs):
+        future = Future()
+        task_id = next(self.ids)
+        with self.lock:
+            self.futures[task_id] = future
+        self.pending.put((task_id, func, args, kwargs, self.timeout if timeout is None else timeout))
+        return future
+
+    def _assign(self):
+        for worker in self.workers:
+            if worker.busy:
+                continue
+            try:
+                task_id, func, args, kwargs, timeout = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            with self.lock:
+                future = self.futures.get(task_id)
+            if future is None or not future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.futures.pop(task_id, None)
+                continue
+            worker.task_id = task_id
+            worker.started_at = time.monotonic()
+            worker.timeout = timeout
+            worker.task_queue.put((task_id, func, args, kwargs))
+
+    def _finish(self, task_id, result=None, error=None):
+        with self.lock:
+            future = self.futures.pop(task_id, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        for worker in self.workers:
+            if worker.task_id == task_id:
+                worker.task_id = None
+                worker.started_at = None
+
+    # 换掉超时或已经退出的进程，并让它正在执行的任务失败
+    def _replace(self, index, error):
+        worker = self.workers[index]
+        task_id = worker.task_id
+        worker.kill()
+        self.workers[index] = self._spawn()
+        if task_id is not None:
+            self._finish(task_id, error=error)
+
+    def _adjust_size(self):
+        while len(self.workers) < self.max_workers:
+            self.workers.append(self._spawn())
+        if len(self.workers) > self.max_workers:
+            for worker in [w for w in self.workers if not w.busy][:len(self.workers) - self.max_workers]:
+                self.workers.remove(worker)
+                worker.task_queue.put(None)
+
+    def _supervise(self):
+        while not self.shutdown_event.is_set():
+            self._assign()
+            try:
+                kind, task_id, payload = self.result_queue.get(timeout=0.1)
+                if kind == 'start':
+                    # 以子进程真正开始执行的时间计算超时
+                    for worker in self.workers:
+                        if worker.task_id == task_id:
+                            worker.started_at = time.monotonic()
+                elif kind == 'done':
+                    self._finish(task_id, result=payload)
+                else:
+                    self._finish(task_id, error=payload)
+            except queue.Empty:
+                pass
+            self._adjust_size()
+            now = time.monotonic()
+            with self.lock:
+                cancelled, self.cancelled = self.cancelled, set()
+            for index, worker in enumerate(self.workers):
+                if worker.task_id in cancelled:
+                    self._replace(index, TaskTimeout("Task cancelled"))
+                    continue
+                if not worker.busy:
+                    if not worker.process.is_alive():
+                        self.workers[index] = self._spawn()
+                    continue
+                if worker.timeout is not None and now - worker.started_at > worker.timeout:
+                    self._replace(index, TaskTimeout(f"Task exceeded {worker.timeout:.0f}s timeout"))
+                elif not worker.process.is_alive():
+                    self._replace(index, WorkerCrashed(f"Worker exited with code {worker.process.exitcode}"))
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if self.shutdown_event.is_set():
+            return
+        if cancel_futures:
+            while True:
+                try:
+                    task_id = self.pending.get_nowait()[0]
+                except queue.Empty:
+                    break
+                with self.lock:
+                    future = self.futures.pop(task_id, None)
+                if future is not None:
+                    future.cancel()
+        if wait:
+            while ((any(worker.busy for worker in self.workers) or not self.pending.empty())
+                   and self.supervisor.is_alive()):
+                time.sleep(0.05)
+        self.shutdown_event.set()
+        self.supervisor.join(timeout=5)
+        for worker in self.workers:
+            if worker.busy or not wait:
+                worker.kill()
+            else:
+                worker.task_queue.put(None)
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.kill()
+        with self.lock:
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(WorkerCrashed("Pool shut down"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=exc_type is None, cancel_futures=exc_type is not None)
+        return False
+
+# 整个程序共享的常驻进程池：第一次使用时创建，之后所有提取和搜索都复用，直到程序退出
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+# threads_per_worker 与 SupervisedPool 相同，只在第一次创建时生效
+def get_shared_pool(max_workers=None, threads_per_worker=None):
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = SupervisedPool(max_workers=max_workers, initializer=WORKER_INITIALIZER,
+                                          main_module=WORKER_MAIN_MODULE, threads_per_worker=threads_per_worker)
+        return _shared_pool
+
+# 在后台线程中启动并预热共享进程池，不阻塞界面
+def start_shared_pool(max_workers=None):
+    threading.Thread(target=get_shared_pool, args=(max_workers,), daemon=True).start()
+
+def shutdown_shared_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        pool, _shared_pool = _shared_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
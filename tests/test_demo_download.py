@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import demo_download
+from demo_download import download_file, make_session, DownloadError, PermanentDownloadError, PART_SUFFIX
+
+CONTENT = bytes(range(256)) * 64  # 16KB 测试文件
+
+# 本地 http.server 代替下载服务器：按路径选择行为，记录每个请求的路径和 Range 头
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        name = self.path.strip('/')
+        server = self.server
+        with server.lock:
+            server.requests.append((name, self.headers.get('Range')))
+            hits = sum(1 for path, _ in server.requests if path == name)
+        if name == 'missing.wav':
+            return self._empty(404)
+        if name == 'busy.wav' and hits <= 2:
+            return self._empty(503)
+        if name == 'limited.wav' and hits <= 1:
+            return self._empty(429, [('Retry-After', '0')])
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if name == 'short.wav':
+            # 声明的总长度比实际发送的多：连接正常结束，但文件不完整
+            body = CONTENT[:len(CONTENT) // 2]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes 0-{len(body) - 1}/{len(CONTENT)}')
+        elif range_header:
+            start = int(range_header.split('=')[1].split('-')[0])
+            body = CONTENT[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}')
+        else:
+            body = CONTENT
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def session(monkeypatch):
+    # 测试中不需要真的等待退避时间
+    monkeypatch.setattr(demo_download, 'BACKOFF_BASE', 0.01)
+    session = make_session(2)
+    yield session
+    session.close()
+
+def test_resumes_part_file_with_range(server, session, tmp_path):
+    part = tmp_path / ('song.wav' + PART_SUFFIX)
+    part.write_bytes(CONTENT[:1000])
+    status, file_path = download_file(session, server.url + 'song.wav', str(tmp_path), retries=0, timeout=5)
+    assert status == 'downloaded'
+    assert open(file_path, 'rb').read() == CONTENT
+    assert server.requests == [('song.wav', 'bytes=1000-')]
+    assert not part.exists()
+
+def test_existing_file_is_not_downloaded_again(server, session, tmp_path):
+    (tmp_path / 'song.wav').write_bytes(CONTENT)
+    assert download_file(session, server.url + 'song.wav', str(tmp_path), timeout=5)[0] == 'exists'
+    assert server.requests == []
+
+@pytest.mark.parametrize('name, attempts', [('busy.wav', 3), ('limited.wav', 2)])
+def test_retries_server_errors_and_rate_limits(server, session, tmp_path, name, attempts):
+    status, file_path = download_file(session, server.url + name, str(tmp_path), retries=3, timeout=5)
+    assert status == 'downloaded'
+    assert open(file_path, 'rb').read() == CONTENT
+    assert len(server.requests) == attempts
+
+def test_gives_up_after_retries(server, session, tmp_path):
+    with pytest.raises(DownloadError):
+        download_file(session, server.url + 'busy.wav', str(tmp_path), retries=1, timeout=5)
+    assert len(server.requests) == 2
+    assert not (tmp_path / 'busy.wav').exists()
+
+def test_not_found_fails_without_retry(server, session, tmp_path):
+    with pytest.raises(PermanentDownloadError):
+        download_file(session, server.url + 'missing.wav', str(tmp_path), retries=3, timeout=5)
+    assert len(server.requests) == 1
+    assert os.listdir(tmp_path) == []
+
+def test_short_body_is_rejected_by_size_check(server, session, tmp_path):
+    with pytest.raises(DownloadError, match="Incomplete download"):
+        download_file(session, server.url + 'short.wav', str(tmp_path), retries=0, timeout=5)
+    assert len(server.requests) == 1
+    # 不完整的文件不会被改名为正式文件名，.part 保留用于之后续传
+    assert not (tmp_path / 'short.wav').exists()
+    assert (tmp_path / ('short.wav' + PART_SUFFIX)).exists()
+
+def test_download_all_counts(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(demo_download, 'BACKOFF_BASE', 0.01)
+    done = []
+    counts = demo_download.download_all([server.url + name for name in ('a.wav', 'busy.wav', 'missing.wav')],
+                                        str(tmp_path), max_workers=2, retries=3, timeout=5,
+                                        on_done=lambda url, path, error: done.append((url, error)))
+    assert counts == {'downloaded': 2, 'exists': 0, 'failed': 1}
+    assert len(done) == 3
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import threading
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distributed_extract
+from distributed_extract import (create_work_units, claim_unit, process_unit, reclaim_expired_leases, run_worker,
+                                 queue_status, _lease_owner, _unit_dirs)
+
+FILES = [f'/lib/track{i}.wav' for i in range(12)]
+
+# 不启动进程池，提取函数只记录每个文件被处理的次数
+class FakeExtractor:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.before = None  # 提取过程中执行的回调，用于模拟租约在处理中途过期
+
+    def __call__(self, file_list, max_workers=None, stop_event=None, silence_thresh=None, memory_budget=None):
+        if self.before is not None:
+            self.before(file_list)
+        if self.delay:
+            threading.Event().wait(self.delay)
+        with self.lock:
+            self.counts.update(file_list)
+        return {path: {} for path in file_list}, {}
+
+@pytest.fixture
+def extractor(monkeypatch):
+    fake = FakeExtractor(delay=0.05)
+    monkeypatch.setattr(distributed_extract, 'extract_files', fake)
+    monkeypatch.setattr(distributed_extract, 'get_shared_pool', lambda *args: None)
+    return fake
+
+@pytest.fixture
+def queue_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(distributed_extract, 'scan_audio_files', lambda search_path: list(FILES))
+    queue = str(tmp_path / 'queue')
+    create_work_units('/lib', queue, unit_size=3)
+    return queue
+
+def lease_path(queue_dir, unit_name):
+    return os.path.join(_unit_dirs(queue_dir)[1], unit_name + '.lease')
+
+def run_workers(queue_dir, worker_ids, lease_seconds=3):
+    results = {}
+
+    def work(worker_id):
+        results[worker_id] = run_worker(queue_dir, lease_seconds, worker_id=worker_id, workers=1, threads_per_worker=1)
+
+    threads = [threading.Thread(target=work, args=(worker_id,)) for worker_id in worker_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+        assert not thread.is_alive()
+    return results
+
+def assert_all_done_once(queue_dir, extractor):
+    assert extractor.counts == Counter(FILES)
+    status = queue_status(queue_dir)
+    assert status['done'] == status['units'] == 4
+    assert status['pending'] == 0
+    assert os.listdir(_unit_dirs(queue_dir)[1]) == []
+
+# 两个工作节点同时领取，每个单元只被处理一次
+def test_two_workers_process_each_unit_once(queue_dir, extractor):
+    results = run_workers(queue_dir, ['a', 'b'])
+    assert sum(results.values()) == 4
+    assert_all_done_once(queue_dir, extractor)
+
+# 失效节点留下的过期租约被回收，单元由存活的节点接手并只处理一次
+def test_expired_lease_is_taken_over(queue_dir, extractor):
+    unit_name = claim_unit(queue_dir, 'dead')
+    path = lease_path(queue_dir, unit_name)
+    assert _lease_owner(path) == 'dead'
+    os.utime(path, (0, 0))
+
+    results = run_workers(queue_dir, ['a', 'b'])
+    assert sum(results.values()) == 4
+    assert_all_done_once(queue_dir, extractor)
+
+# 未过期的租约不会被回收
+def test_live_lease_is_not_reclaimed(queue_dir):
+    unit_name = claim_unit(queue_dir, 'a')
+    assert reclaim_expired_leases(queue_dir, lease_seconds=60) == 0
+    assert _lease_owner(lease_path(queue_dir, unit_name)) == 'a'
+    assert claim_unit(queue_dir, 'b') != unit_name
+
+# 慢节点的租约在处理中途过期并被其他节点重新领取，慢节点结束时不能删除新领取者的租约
+def test_release_after_lease_loss_keeps_new_owner(queue_dir, extractor):
+    unit_name = claim_unit(queue_dir, 'slow')
+    path = lease_path(queue_dir, unit_name)
+    taken_over = []
+
+    def expire_and_steal(file_list):
+        os.utime(path, (0, 0))
+        assert reclaim_expired_leases(queue_dir, lease_seconds=60) == 1
+        taken_over.append(claim_unit(queue_dir, 'fast'))
+
+    extractor.before = expire_and_steal
+    assert process_unit(queue_dir, unit_name, 'slow', lease_seconds=60)
+    assert taken_over == [unit_name]
+    assert _lease_owner(path) == 'fast'
+
+    # 新领取者处理完后释放自己的租约；分片写入是幂等的
+    extractor.before = None
+    assert process_unit(queue_dir, unit_name, 'fast', lease_seconds=60)
+    assert not os.path.exists(path)
+    with open(os.path.join(_unit_dirs(queue_dir)[0], unit_name + '.json'), 'r', encoding='utf-8') as f:
+        unit_files = json.load(f)
+    assert all(extractor.counts[file_path] == 2 for file_path in unit_files)
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_index import FeatureIndex, compute_metric_stats
+from feature_manager_gai import FeatureManager
+
+def batch(prefix, count, mean, seed):
+    rng = np.random.default_rng(seed)
+    return {f'/lib/{prefix}{i}.wav': {'mfcc': rng.normal(mean, 1.0, 13).astype(np.float32)} for i in range(count)}
+
+def assert_stats_match(index):
+    expected = compute_metric_stats(index.features)['mfcc']
+    stats = index.metric_stats()['mfcc']
+    np.testing.assert_allclose(stats['mean'], expected['mean'], rtol=1e-5)
+    np.testing.assert_allclose(stats['std'], expected['std'], rtol=1e-5)
+
+# 增量加入分布不同的一批之后，z-score 统计量反映全部条目，而不是第一批
+def test_metric_stats_follow_incremental_updates():
+    index = FeatureIndex.from_dict(batch('a', 20, 0.0, 1))
+    first = index.metric_stats()['mfcc']['mean'].copy()
+    updated = index.apply_changes(batch('b', 20, 10.0, 2), [], {})
+    assert_stats_match(updated)
+    assert np.all(updated.metric_stats()['mfcc']['mean'] > first + 4)
+    # 原索引不受影响
+    np.testing.assert_array_equal(index.metric_stats()['mfcc']['mean'], first)
+
+def test_metric_stats_follow_removals():
+    index = FeatureIndex.from_dict({**batch('a', 20, 0.0, 1), **batch('b', 5, 10.0, 2)})
+    index.metric_stats()
+    updated = index.apply_changes({}, [f'/lib/b{i}.wav' for i in range(5)], {})
+    assert_stats_match(updated)
+
+# 从空索引开始逐批写入（下载流水线），保存（合并增量日志）后的统计量覆盖全部条目
+def test_saved_stats_cover_all_batches(tmp_path):
+    manager = FeatureManager()
+    manager.set_feature_file(str(tmp_path / 'features.pkl'))
+    manager.save_features({}, roots=['/lib'], params={'silence_thresh': None})
+    manager.apply_changes(batch('a', 10, 0.0, 1))
+    # 两批之间有一次搜索，统计量按第一批计算
+    manager.load_features().metric_stats()
+    manager.apply_changes(batch('b', 10, 10.0, 2))
+    manager.save_features(manager.load_features())
+
+    reloaded = FeatureManager()
+    reloaded.set_feature_file(str(tmp_path / 'features.pkl'))
+    index = reloaded.load_features()
+    assert len(index) == 20
+    assert_stats_match(index)
+    assert index.metric_stats()['mfcc']['mean'].mean() == pytest.approx(5.0, abs=1.0)
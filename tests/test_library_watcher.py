@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library_watcher
+from library_watcher import LibraryWatcher, InotifyBackend, UPSERT, DELETE
+
+class FakeIndex:
+    def __init__(self, paths):
+        self.paths = list(paths)
+
+    def iter_paths(self):
+        return iter(self.paths)
+
+# 只记录 apply_changes 调用的特征管理器，索引中的路径由测试给定
+class FakeFeatureManager:
+    def __init__(self, feature_file, index_paths=()):
+        self.feature_file = feature_file
+        self.index = FakeIndex(index_paths)
+        self.applied = []
+
+    def load_features(self):
+        return self.index
+
+    def get_feature_file(self):
+        return self.feature_file
+
+    def get_quarantine(self):
+        return {}
+
+    def is_quarantined(self, path, quarantine):
+        return False
+
+    def get_memory_budget(self):
+        return None
+
+    def get_extraction_params(self):
+        return {}
+
+    def apply_changes(self, upserts, removals, renames, quarantine=None):
+        self.applied.append((upserts, removals, renames))
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    def install(index_paths=()):
+        manager = FakeFeatureManager(str(tmp_path / 'features.pkl'), index_paths)
+        extracted = []
+
+        def fake_extract_files(file_list, **kwargs):
+            extracted.extend(file_list)
+            return {path: {'mfcc': [0.0]} for path in file_list}, {}
+
+        monkeypatch.setattr(library_watcher, 'feature_manager_instance', manager)
+        monkeypatch.setattr(library_watcher, 'extract_files', fake_extract_files)
+        w = LibraryWatcher(str(tmp_path / 'library'))
+        w.needs_resync = False
+        os.makedirs(w.root, exist_ok=True)
+        return w, manager, extracted
+    return install
+
+# 先写 .part 再改名：旧路径从未入索引，目标文件必须被提取
+def test_rename_from_unindexed_temp_file_is_extracted(watcher):
+    w, manager, extracted = watcher()
+    part = os.path.join(w.root, 'renamed.wav.part')
+    final = os.path.join(w.root, 'renamed.wav')
+    with open(final, 'wb') as f:
+        f.write(b'RIFF')
+    w.on_rename(part, final)
+    w.flush()
+    assert extracted == [final]
+    upserts, removals, renames = manager.applied[-1]
+    assert list(upserts) == [final]
+    assert renames == {}
+
+def test_rename_of_indexed_file_is_not_reextracted(watcher, tmp_path):
+    old = str(tmp_path / 'library' / 'old.wav')
+    w, manager, extracted = watcher([old])
+    new = os.path.join(w.root, 'new.wav')
+    with open(new, 'wb') as f:
+        f.write(b'RIFF')
+    w.on_rename(old, new)
+    w.flush()
+    assert extracted == []
+    assert manager.applied[-1][2] == {old: new}
+
+# 目录改名：已入索引的文件随目录移动，目录中未入索引的文件按新增处理
+def test_directory_rename_extracts_unindexed_files(watcher, tmp_path):
+    indexed = str(tmp_path / 'library' / 'album' / 'a.wav')
+    w, manager, extracted = watcher([indexed])
+    new_dir = os.path.join(w.root, 'album2')
+    os.makedirs(new_dir)
+    for name in ('a.wav', 'b.wav'):
+        with open(os.path.join(new_dir, name), 'wb') as f:
+            f.write(b'RIFF')
+    w.on_rename(os.path.join(w.root, 'album'), new_dir)
+    w.flush()
+    assert extracted == [os.path.join(new_dir, 'b.wav')]
+    assert manager.applied[-1][2] == {indexed: os.path.join(new_dir, 'a.wav')}
+
+@pytest.mark.skipif(library_watcher._load_libc() is None, reason="inotify is only available on Linux")
+def test_inotify_reports_part_rename_as_upsert(tmp_path):
+    events = []
+    backend = InotifyBackend(str(tmp_path), library_watcher._load_libc(),
+                             lambda kind, path: events.append((kind, path)),
+                             lambda old, new: events.append(('rename', old, new)),
+                             lambda: None)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=backend.run, args=(stop_event,), daemon=True)
+    thread.start()
+    part = tmp_path / 'song.wav.part'
+    part.write_bytes(b'RIFF')
+    os.rename(part, tmp_path / 'song.wav')
+    deadline = time.monotonic() + 5
+    while (UPSERT, str(tmp_path / 'song.wav')) not in events and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop_event.set()
+    thread.join(timeout=5)
+    assert (UPSERT, str(tmp_path / 'song.wav')) in events
+    assert not any(event[0] == 'rename' for event in events)
+    assert not any(event[0] == DELETE for event in events)
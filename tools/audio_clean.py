@@ -1,76 +1,227 @@
 import os
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-from tqdm import tqdm  # 进度条库
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import soundfile as sf
 
-# 定义输入输出文件夹路径
-input_folder = r'F:\这个文件夹'  # 原始音频文件夹路径
-output_folder = r'F:\audio_clear'  # 清洗后音频保存的文件夹路径
+# 音频清洗：去掉音频中的静音段落，保持原始目录层级写入输出文件夹
+# 用 numpy 按帧计算 RMS 判断静音（与 pydub split_on_silence 的判定方式相同：
+# 长度达到 min_silence_len 且 RMS 低于阈值的窗口为静音，非静音段两侧各保留 keep_silence），
+# 每个文件在独立进程中处理，按块读取、按块写出，内存占用与文件长度无关。
+#   python tools/audio_clean.py 输入文件夹 输出文件夹 [--workers 8] [--silence-thresh -50]
 
-# 定义线程池的线程数量
-num_threads = 10  # 可根据系统的性能调节这个值
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# 创建输出文件夹（如果不存在）
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
+from audio_scanner import AudioScanner
 
-# 音频清洗函数：去掉静音段落
-def clean_audio(file_path, output_path, silence_thresh=-50, min_silence_len=1000, keep_silence=500):
+CLEAN_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.flac', '.flv', '.wma', '.aac')
+FRAME_MS = 10  # RMS 帧长（毫秒），静音边界的精度
+BLOCK_SECONDS = 30  # 每次读写的块长（秒）
+
+FFMPEG_BINARY = shutil.which('ffmpeg')
+FFPROBE_BINARY = shutil.which('ffprobe')
+_SOUNDFILE_FORMATS = {'.' + name.lower() for name in sf.available_formats()}
+
+# 读取采样率和声道数
+def probe_stream(file_path):
+    if os.path.splitext(file_path)[1].lower() in _SOUNDFILE_FORMATS:
+        try:
+            info = sf.info(file_path)
+            return 'soundfile', info.samplerate, info.channels
+        except Exception:
+            pass
+    if FFMPEG_BINARY is None or FFPROBE_BINARY is None:
+        raise RuntimeError("soundfile 无法读取该格式，并且没有找到 ffmpeg/ffprobe")
+    result = subprocess.run([FFPROBE_BINARY, '-v', 'error', '-select_streams', 'a:0',
+                             '-show_entries', 'stream=sample_rate,channels', '-of', 'csv=p=0', file_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        sample_rate, channels = result.stdout.decode().strip().splitlines()[0].split(',')[:2]
+        return 'ffmpeg', int(sample_rate), int(channels)
+    except (ValueError, IndexError):
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip() or "ffprobe 无法读取该文件")
+
+# 按块读取音频，产出 (帧数, 声道数) 的 float32 数组
+def read_blocks(file_path, backend, sample_rate, channels):
+    block_frames = BLOCK_SECONDS * sample_rate
+    if backend == 'soundfile':
+        with sf.SoundFile(file_path) as f:
+            while True:
+                block = f.read(block_frames, dtype='float32', always_2d=True)
+                if not len(block):
+                    break
+                yield block
+        return
+    process = subprocess.Popen([FFMPEG_BINARY, '-v', 'error', '-nostdin', '-i', file_path, '-vn',
+                                '-f', 'f32le', '-acodec', 'pcm_f32le', '-'],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        block_bytes = block_frames * channels * 4
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % (channels * 4)]
+            yield np.frombuffer(data, dtype='<f4').reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+# 第一遍：每帧（所有声道）的平方和，用于之后计算任意窗口的 RMS
+def frame_energies(file_path, backend, sample_rate, channels):
+    frame_len = max(sample_rate * FRAME_MS // 1000, 1)
+    energies = []
+    carry = np.zeros((0, channels), dtype=np.float32)
+    total = 0
+    for block in read_blocks(file_path, backend, sample_rate, channels):
+        total += len(block)
+        block = np.concatenate([carry, block]) if len(carry) else block
+        usable = len(block) // frame_len * frame_len
+        squared = np.square(block[:usable], dtype=np.float64).sum(axis=1)
+        energies.append(squared.reshape(-1, frame_len).sum(axis=1))
+        carry = block[usable:]
+    if len(carry):
+        energies.append(np.square(carry, dtype=np.float64).sum(axis=1).sum(keepdims=True))
+    return (np.concatenate(energies) if energies else np.zeros(0)), frame_len, total
+
+# 计算需要保留的帧：RMS 低于阈值、长度达到 min_silence_len 的窗口为静音，非静音部分两侧各保留 keep_silence
+def keep_mask(energies, frame_len, channels, silence_thresh, min_silence_len, keep_silence):
+    n = len(energies)
+    window = max(int(round(min_silence_len / FRAME_MS)), 1)
+    if n < window:
+        return np.ones(n, dtype=bool)
+    cumulative = np.concatenate([[0.0], np.cumsum(energies)])
+    window_energy = cumulative[window:] - cumulative[:-window]
+    # dBFS：相对满幅度 1.0 的 RMS
+    threshold = (10 ** (silence_thresh / 20)) ** 2 * window * frame_len * channels
+    silent_start = window_energy < threshold
+    # 静音窗口覆盖的所有帧都是静音
+    coverage = np.zeros(n + 1, dtype=np.int64)
+    starts = np.nonzero(silent_start)[0]
+    np.add.at(coverage, starts, 1)
+    np.add.at(coverage, starts + window, -1)
+    silent = np.cumsum(coverage[:n]) > 0
+    if silent.all():
+        return np.zeros(n, dtype=bool)
+    # 非静音帧向两侧扩展 keep_silence
+    pad = int(round(keep_silence / FRAME_MS))
+    loud = np.concatenate([[0], np.cumsum(~silent)])
+    lo = np.clip(np.arange(n) - pad, 0, n)
+    hi = np.clip(np.arange(n) + pad + 1, 0, n)
+    return (loud[hi] - loud[lo]) > 0
+
+# 第二遍：按块读取，只写出保留的帧，返回写出的采样数
+def write_kept(file_path, output_path, backend, sample_rate, channels, mask, frame_len):
+    ext = os.path.splitext(output_path)[1].lower()
+    # mp3 优先交给 ffmpeg 编码（较旧的 libsndfile 不能写 mp3）
+    if ext in _SOUNDFILE_FORMATS and (ext != '.mp3' or FFMPEG_BINARY is None):
+        info = sf.info(file_path) if backend == 'soundfile' else None
+        subtype = info.subtype if info is not None and info.format == ext[1:].upper() else None
+        sink = sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=channels,
+                            format=ext[1:].upper(), subtype=subtype)
+        write, close = sink.write, sink.close
+    else:
+        if FFMPEG_BINARY is None:
+            raise RuntimeError(f"没有找到 ffmpeg，无法写出 {ext} 格式")
+        # 通过管道把 PCM 交给 ffmpeg 编码，不落地中间文件
+        encoder = subprocess.Popen([FFMPEG_BINARY, '-v', 'error', '-y', '-f', 'f32le', '-ar', str(sample_rate),
+                                    '-ac', str(channels), '-i', '-', '-f', _ffmpeg_format(ext), output_path],
+                                   stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def write(block):
+            encoder.stdin.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+
+        def close():
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                raise RuntimeError(encoder.stderr.read().decode('utf-8', 'replace').strip())
+    written = 0
+    try:
+        position = 0
+        for block in read_blocks(file_path, backend, sample_rate, channels):
+            frames = np.arange(position, position + len(block)) // frame_len
+            position += len(block)
+            kept = block[mask[np.minimum(frames, len(mask) - 1)]]
+            if len(kept):
+                write(kept)
+                written += len(kept)
+    finally:
+        close()
+    return written
+
+def _ffmpeg_format(ext):
+    return {'.mp3': 'mp3', '.wma': 'asf', '.aac': 'adts', '.flv': 'flv', '.ogg': 'ogg'}.get(ext, ext[1:])
+
+# 清洗单个文件，返回 (状态, 原时长, 清洗后时长)
+def clean_audio(file_path, output_path, silence_thresh=-50, min_silence_len=1000, keep_silence=500, overwrite=False):
+    # 判断目标文件是否已经存在，如果存在则跳过
+    if os.path.exists(output_path) and not overwrite:
+        return 'exists', 0.0, 0.0
+    backend, sample_rate, channels = probe_stream(file_path)
+    energies, frame_len, total = frame_energies(file_path, backend, sample_rate, channels)
+    mask = keep_mask(energies, frame_len, channels, silence_thresh, min_silence_len, keep_silence)
+    if not mask.any():
+        return 'silent', total / sample_rate, 0.0
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # 先写入临时文件，完成后改名，中途失败不会留下不完整的输出
+    directory, name = os.path.split(output_path)
+    base, ext = os.path.splitext(name)
+    tmp_path = os.path.join(directory, f".{base}.partial{ext}")
     try:
-        # 判断目标文件是否已经存在，如果存在则跳过
-        if os.path.exists(output_path):
-            print(f"File {output_path} already exists, skipping...")
-            return
-
-        # 根据文件扩展名加载音频文件
-        extension = os.path.splitext(file_path)[1][1:]  # 获取文件扩展名，不包括点
-        audio = AudioSegment.from_file(file_path, format=extension)
-        
-        # 使用 split_on_silence 以去掉静音段落
-        chunks = split_on_silence(
-            audio,
-            min_silence_len=min_silence_len,  # 静音段的最小长度（毫秒）
-            silence_thresh=silence_thresh,  # 静音的分贝阈值
-            keep_silence=keep_silence  # 保留的静音部分时长（毫秒）
-        )
-        
-        if chunks:
-            # 将音频片段重新拼接
-            cleaned_audio = AudioSegment.silent(duration=0)
-            for chunk in chunks:
-                cleaned_audio += chunk
-            
-            # 创建输出文件的文件夹路径（如果不存在）
-            output_dir = os.path.dirname(output_path)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-
-            # 保存清洗后的音频文件
-            cleaned_audio.export(output_path, format=extension)
-        else:
-            print(f"Skipping {file_path}, no non-silent segments found.")
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-
-# 递归遍历输入文件夹中的所有音频文件
-audio_files = []
-for root, dirs, files in os.walk(input_folder):
-    for file in files:
-        if file.endswith((".wav", ".mp3", ".ogg", ".flv", ".wma", ".aac")):
-            input_path = os.path.join(root, file)
-            # 构建输出文件的路径，保持原始目录层级
-            relative_path = os.path.relpath(input_path, input_folder)
-            output_path = os.path.join(output_folder, relative_path)
-            audio_files.append((input_path, output_path))
-
-# 使用线程池并行处理音频文件
-with ThreadPoolExecutor(max_workers=num_threads) as executor:
-    # 提交所有的音频清洗任务
-    futures = {executor.submit(clean_audio, input_path, output_path): (input_path, output_path) for input_path, output_path in audio_files}
-
-    # 使用 tqdm 显示进度条
-    for future in tqdm(as_completed(futures), total=len(futures), desc="Processing Audio Files"):
-        future.result()  # 获取每个任务的结果，以捕捉异常
-
-print("音频清洗完成！")
+        kept_samples = write_kept(file_path, tmp_path, backend, sample_rate, channels, mask, frame_len)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return 'cleaned', total / sample_rate, kept_samples / sample_rate
+
+# 递归遍历输入文件夹中的所有音频文件，输出路径保持原始目录层级
+def collect_jobs(input_folder, output_folder):
+    jobs = []
+    for input_path in AudioScanner(input_folder, extensions=CLEAN_EXTENSIONS):
+        relative_path = os.path.relpath(input_path, input_folder)
+        jobs.append((input_path, os.path.join(output_folder, relative_path)))
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="去掉音频中的静音段落")
+    parser.add_argument('input_folder', help="原始音频文件夹")
+    parser.add_argument('output_folder', help="清洗后音频保存的文件夹")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument('--silence-thresh', type=float, default=-50, help="静音阈值 (dBFS)")
+    parser.add_argument('--min-silence-len', type=int, default=1000, help="静音段的最小长度（毫秒）")
+    parser.add_argument('--keep-silence', type=int, default=500, help="非静音段两侧保留的静音（毫秒）")
+    parser.add_argument('--overwrite', action='store_true', help="覆盖已经存在的输出文件")
+    args = parser.parse_args()
+
+    jobs = collect_jobs(args.input_folder, args.output_folder)
+    counts = {'cleaned': 0, 'exists': 0, 'silent': 0, 'error': 0}
+    seconds_in = seconds_out = 0.0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(clean_audio, input_path, output_path, args.silence_thresh,
+                                   args.min_silence_len, args.keep_silence, args.overwrite): input_path
+                   for input_path, output_path in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                status, before, after = future.result()
+            except Exception as e:
+                print(f"\nError processing {futures[future]}: {e}")
+                status, before, after = 'error', 0.0, 0.0
+            counts[status] += 1
+            seconds_in += before
+            seconds_out += after
+            print(f"\rProcessing Audio Files: {done}/{len(jobs)}", end='', flush=True)
+    print()
+    print(f"音频清洗完成！清洗 {counts['cleaned']}，已存在跳过 {counts['exists']}，全部静音 {counts['silent']}，"
+          f"失败 {counts['error']}；音频 {seconds_in:.0f}s -> {seconds_out:.0f}s，"
+          f"耗时 {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
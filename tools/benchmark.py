@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import argparse
+from collections import defaultdict
+
+# 性能测试脚本，在仓库根目录的模块上运行
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_scanner import AudioScanner
+
+# 解码吞吐量测试：按 后端 x 格式 统计每秒解码的音频时长（倍速）和文件大小（MB/s）
+def benchmark_decoders(folder, limit_per_format=20, backends=None):
+    import audio_decoder
+
+    files_by_format = defaultdict(list)
+    for file_path in AudioScanner(folder):
+        ext = os.path.splitext(file_path)[1].lower()
+        if len(files_by_format[ext]) < limit_per_format:
+            files_by_format[ext].append(file_path)
+
+    print(f"{'backend':<10} {'format':<6} {'files':>5} {'audio s':>9} {'wall s':>8} {'x realtime':>11} {'MB/s':>8}")
+    for ext, file_list in sorted(files_by_format.items()):
+        for name in backends or audio_decoder.BACKENDS:
+            if not audio_decoder.backend_available(name, ext):
+                continue
+            # 先解码一次预热（首次调用会加载重采样器/编译 numba 内核）
+            try:
+                audio_decoder.decode_audio(file_list[0], backend=name, duration=1.0)
+            except Exception:
+                pass
+            audio_seconds = 0.0
+            total_bytes = 0
+            ok = 0
+            start = time.perf_counter()
+            for file_path in file_list:
+                try:
+                    y, sr = audio_decoder.decode_audio(file_path, backend=name)
+                except Exception:
+                    continue
+                audio_seconds += len(y) / sr
+                total_bytes += os.path.getsize(file_path)
+                ok += 1
+            wall = time.perf_counter() - start
+            if not ok:
+                print(f"{name:<10} {ext:<6} {'failed':>5}")
+                continue
+            print(f"{name:<10} {ext:<6} {ok:>5} {audio_seconds:>9.1f} {wall:>8.2f} "
+                  f"{audio_seconds / wall:>10.1f}x {total_bytes / wall / 1e6:>8.2f}")
+        print(f"{'auto':<10} {ext:<6} -> {', '.join(audio_decoder.backends_for('x' + ext)) or 'none'}")
+
+# 启动耗时测试：在新的解释器中导入 GUI 并显示第一个窗口，统计耗时和启动时导入的重量级模块
+STARTUP_SCRIPT = r'''
+import sys, time, json
+start = time.perf_counter()
+import GuiSimilarSong
+app = GuiSimilarSong.AudioSimilarityApp()
+app.update()
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('librosa', 'scipy', 'numpy', 'joblib', 'soundfile', 'numba') if m in sys.modules]
+app.destroy()
+GuiSimilarSong.shutdown_shared_pool()
+print(json.dumps({'window_seconds': elapsed, 'heavy_modules': heavy}))
+'''
+
+def benchmark_startup(budget, runs=3):
+    import json
+    import subprocess
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=repo_root,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        total = time.perf_counter() - start
+        if proc.returncode != 0:
+            print(proc.stderr.strip())
+            return False
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result['process_seconds'] = total
+        results.append(result)
+        print(f"time to first window: {result['window_seconds']:.3f}s "
+              f"(including interpreter start: {total:.3f}s), heavy modules: {result['heavy_modules'] or 'none'}")
+
+    best = min(r['window_seconds'] for r in results)
+    heavy = sorted({m for r in results for m in r['heavy_modules']})
+    ok = best <= budget and not heavy
+    print(f"best {best:.3f}s, budget {budget:.3f}s -> {'PASS' if ok else 'FAIL'}")
+    if heavy:
+        print(f"heavy modules imported at startup: {', '.join(heavy)}")
+    return ok
+
+# 进程数 x 线程数测试：同一批文件用不同的 进程数 x 每进程内部线程数 提取特征，比较吞吐量。
+# 配置写成 PxT，T 为 0 表示不限制内部线程（各库按核心数开线程，即超额订阅的情况）
+def benchmark_threads(folder, limit=40, configs=None):
+    from supervised_pool import (SupervisedPool, available_cores, plan_workers, inner_thread_counts,
+                                 WORKER_INITIALIZER, WORKER_MAIN_MODULE)
+    from audio_worker import extract_segment
+
+    file_list = []
+    for file_path in AudioScanner(folder):
+        file_list.append(file_path)
+        if len(file_list) >= limit:
+            break
+    if not file_list:
+        print("no audio files found")
+        return
+    cores = available_cores()
+    if not configs:
+        processes, threads = plan_workers(cores=cores)
+        configs = [(cores, 0), (processes, threads)]
+        if cores >= 4:
+            configs.append((cores // 2, 2))
+    print(f"cores: {cores}, files: {len(file_list)}, auto split: {'x'.join(map(str, plan_workers(cores=cores)))}")
+    print(f"{'config':<8} {'inner threads':<28} {'wall s':>8} {'files/s':>8}")
+    for processes, threads in configs:
+        with SupervisedPool(max_workers=processes, initializer=WORKER_INITIALIZER, main_module=WORKER_MAIN_MODULE,
+                            threads_per_worker=threads) as pool:
+            inner = pool.submit(inner_thread_counts).result()
+            # 每个进程先跑一个任务预热（导入、numba 编译）
+            for future in [pool.submit(extract_segment, file_list[0], 0.0, 1.0) for _ in range(processes)]:
+                future.exception()
+            start = time.perf_counter()
+            futures = [pool.submit(extract_segment, file_path) for file_path in file_list]
+            failed = sum(1 for future in futures if future.exception() is not None)
+            wall = time.perf_counter() - start
+        label = f"{processes}x{threads or '-'}"
+        inner_text = ', '.join(f"{name}={n}" for name, n in sorted(inner.items())) or 'n/a'
+        print(f"{label:<8} {inner_text:<28} {wall:>8.2f} {(len(file_list) - failed) / wall:>8.2f}")
+
+def _parse_config(text):
+    processes, _, threads = text.lower().partition('x')
+    return int(processes), int(threads or 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="SimilarSong 性能测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_decode = subparsers.add_parser('decode', help="各解码后端在各格式上的吞吐量")
+    parser_decode.add_argument('folder')
+    parser_decode.add_argument('--limit', type=int, default=20, help="每种格式最多测试的文件数")
+    parser_decode.add_argument('--backend', action='append', help="只测试指定后端，可重复")
+
+    parser_startup = subparsers.add_parser('startup', help="GUI 启动到显示窗口的耗时，超出预算时返回非零")
+    parser_startup.add_argument('--budget', type=float, default=1.0, help="时间预算（秒）")
+    parser_startup.add_argument('--runs', type=int, default=3)
+
+    parser_threads = subparsers.add_parser('threads', help="进程数 x 内部线程数 对特征提取吞吐量的影响")
+    parser_threads.add_argument('folder')
+    parser_threads.add_argument('--limit', type=int, default=40, help="最多测试的文件数")
+    parser_threads.add_argument('--config', action='append', type=_parse_config,
+                                help="PxT，例如 16x1；T 为 0 表示不限制内部线程，可重复")
+
+    args = parser.parse_args()
+    if args.command == 'threads':
+        benchmark_threads(args.folder, args.limit, args.config)
+    elif args.command == 'decode':
+        benchmark_decoders(args.folder, args.limit, args.backend)
+    elif args.command == 'startup':
+        if not benchmark_startup(args.budget, args.runs):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
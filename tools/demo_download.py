@@ -1,54 +1,167 @@
 import os
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
+from requests.adapters import HTTPAdapter
 
-# 配置部分
-URL_FILE = r"E:\FILES\WorkSpace\Coding\project\songSim\not_downloaded.txt"  # 包含 URL 的文件
-DOWNLOAD_DIR = r'E:\FILES\WorkSpace\Coding\project\songSim\demoMusic'  # 下载内容的目录
-MAX_THREADS = 10  # 最大线程数
+# 批量下载 demo 音频
+#   python tools/demo_download.py URL列表文件 下载目录 [--workers 10] [--retries 5]
+# 所有线程共用一个 Session 的连接池（同一主机的连接复用），并发数有上限；
+# 下载先写入 <文件名>.part，中断后再次运行会用 HTTP Range 从断点续传；
+# 失败（连接错误、超时、5xx、429、长度不符）按指数退避重试；
+# 下载完成并且大小与 Content-Length 一致后才原子改名为正式文件名，目录中不会出现被当成“已下载”的半截文件。
 
-# 确保下载目录存在
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+DEFAULT_WORKERS = 10
+DEFAULT_RETRIES = 5
+DEFAULT_TIMEOUT = 30  # 连接/读取超时（秒）
+BACKOFF_BASE = 1.0  # 第 n 次重试前等待 BACKOFF_BASE * 2^n 秒（加随机抖动）
+BACKOFF_MAX = 60.0
+CHUNK_SIZE = 64 * 1024
+PART_SUFFIX = '.part'
 
-def download_file(url):
-    try:
-        # 从 URL 中提取文件名
-        filename = os.path.basename(url)
-        file_path = os.path.join(DOWNLOAD_DIR, filename)
-
-        # 下载文件
-        response = requests.get(url, stream=True)
-        response.raise_for_status()  # 如果响应状态码不是 200，将抛出异常
-
-        # 获取文件总大小（字节）
-        total_size = int(response.headers.get('content-length', 0))
-
-        # 写入文件并显示进度条
-        with open(file_path, 'wb') as f, tqdm(
-            desc=filename,
-            total=total_size,
-            unit='B',
-            unit_scale=True,
-            unit_divisor=1024,
-            ascii=True
-        ) as bar:
-            for chunk in response.iter_content(chunk_size=8192):
+class DownloadError(Exception):
+    pass
+
+# 不可重试的错误（例如 404）
+class PermanentDownloadError(DownloadError):
+    pass
+
+# URL 对应的本地文件名
+def url_filename(url):
+    return unquote(os.path.basename(urlparse(url).path))
+
+# 读取 URL 列表，忽略空行
+def read_urls(url_file):
+    with open(url_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+# 所有下载线程共用的 Session，连接池大小与并发数一致
+def make_session(max_workers=DEFAULT_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# 从响应头得到完整文件的大小，未知时返回 None
+def _expected_size(response, resume_from):
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        total = content_range.rpartition('/')[2]
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        return int(length) + (resume_from if response.status_code == 206 else 0)
+    return None
+
+def _backoff(attempt, retry_after=None):
+    if retry_after is not None and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+# 下载一次：从 .part 已有的长度续传，完成并校验大小后改名，返回文件大小
+def _download_once(session, url, file_path, timeout, stop_event=None):
+    part_path = file_path + PART_SUFFIX
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={resume_from}-'} if resume_from else {}
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as response:
+        if response.status_code == 416:
+            # 已有部分与服务器上的文件不一致（或已经完整），从头下载
+            os.remove(part_path)
+            raise DownloadError("Range not satisfiable, restarting")
+        if response.status_code in (429,) or response.status_code >= 500:
+            error = DownloadError(f"HTTP {response.status_code}")
+            error.retry_after = response.headers.get('Retry-After')
+            raise error
+        if response.status_code >= 400:
+            raise PermanentDownloadError(f"HTTP {response.status_code}")
+        if response.status_code != 206:
+            # 服务器不支持 Range，只能从头开始
+            resume_from = 0
+        expected = _expected_size(response, resume_from)
+        with open(part_path, 'ab' if resume_from else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if stop_event is not None and stop_event.is_set():
+                    raise DownloadError("Cancelled")
                 f.write(chunk)
-                bar.update(len(chunk))
+    size = os.path.getsize(part_path)
+    if expected is not None and size != expected:
+        # 保留 .part，下次重试从断点继续
+        raise DownloadError(f"Incomplete download: {size} of {expected} bytes")
+    os.replace(part_path, file_path)
+    return size
 
-        print(f"下载完成: {file_path}")
+# 下载单个 URL 到 download_dir，失败时按指数退避重试，返回 (状态, 本地路径)
+# 状态为 'downloaded' 或 'exists'；重试用尽或不可重试时抛出 DownloadError
+def download_file(session, url, download_dir, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT, stop_event=None):
+    file_path = os.path.join(download_dir, url_filename(url))
+    if os.path.exists(file_path):
+        return 'exists', file_path
+    for attempt in range(retries + 1):
+        try:
+            _download_once(session, url, file_path, timeout, stop_event)
+            return 'downloaded', file_path
+        except PermanentDownloadError:
+            raise
+        except (DownloadError, requests.RequestException, OSError) as e:
+            if stop_event is not None and stop_event.is_set():
+                raise DownloadError("Cancelled")
+            if attempt == retries:
+                raise DownloadError(f"{type(e).__name__}: {e}") from e
+            time.sleep(_backoff(attempt, getattr(e, 'retry_after', None)))
 
-    except Exception as e:
-        print(f"下载失败 ({url}): {e}")
+# 并发下载一组 URL，每个 URL 结束时调用 on_done(url, 路径, 错误)，返回各状态的数量
+def download_all(urls, download_dir, max_workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT,
+                 on_done=None, stop_event=None):
+    os.makedirs(download_dir, exist_ok=True)
+    stop_event = stop_event or threading.Event()
+    counts = {'downloaded': 0, 'exists': 0, 'failed': 0}
+    session = make_session(max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(download_file, session, url, download_dir, retries, timeout, stop_event): url
+                       for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    status, file_path = future.result()
+                    error = None
+                except DownloadError as e:
+                    status, file_path, error = 'failed', None, str(e)
+                counts[status] += 1
+                if on_done is not None:
+                    on_done(url, file_path, error)
+    finally:
+        session.close()
+    return counts
 
 def main():
-    with open(URL_FILE, 'r') as file:
-        urls = [line.strip() for line in file if line.strip()]
+    parser = argparse.ArgumentParser(description="批量下载 demo 音频（连接复用、断点续传、失败重试）")
+    parser.add_argument('url_file', help="每行一个 URL 的文本文件")
+    parser.add_argument('download_dir', help="下载目录")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="并发下载数")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="每个文件的最大重试次数")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="连接/读取超时（秒）")
+    args = parser.parse_args()
+
+    urls = read_urls(args.url_file)
+    done = 0
+
+    def on_done(url, file_path, error):
+        nonlocal done
+        done += 1
+        if error is not None:
+            print(f"\n下载失败 ({url}): {error}")
+        print(f"\r总进度: {done}/{len(urls)}", end='', flush=True)
 
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        # 使用 tqdm 进度条显示总进度
-        list(tqdm(executor.map(download_file, urls), total=len(urls), desc="总进度"))
+    counts = download_all(urls, args.download_dir, args.workers, args.retries, args.timeout, on_done)
+    print()
+    print(f"下载完成: 新下载 {counts['downloaded']}，已存在 {counts['exists']}，失败 {counts['failed']}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+
+# 下载 -> 特征提取 -> 增量加入索引 的流水线
+#   python tools/download_index_pipeline.py URL列表文件 下载目录 特征文件 [--download-workers 10] [--extract-workers 8]
+# 每个文件下载完成后立即进入提取队列，提取结果按批通过 FeatureManager.apply_changes 增量写入特征文件（增量日志），
+# 下载和提取同时进行，不需要再分别运行 demo_download.py、undownload_filenames.py 和界面上的“特征提取”。
+# 特征文件带有片段定位数据（.frames）或查重指纹（.fp）时一并更新。
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from demo_download import read_urls, download_all, DEFAULT_WORKERS, DEFAULT_RETRIES, DEFAULT_TIMEOUT
+from feature_manager_gai import feature_manager_instance
+
+DEFAULT_BATCH_SIZE = 200  # 每提取这么多个文件写入一次索引
+DEFAULT_FLUSH_SECONDS = 30.0  # 距上次写入超过这么久也写入一次
+
+_DONE = object()
+
+class DownloadIndexPipeline:
+    def __init__(self, download_dir, feature_file, download_workers=DEFAULT_WORKERS, extract_workers=None,
+                 retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, keep_frames=False, keep_fingerprints=False, skip_silence=False,
+                 memory_budget=None):
+        from audio_worker import SILENCE_THRESH_DB
+        from segment_search import FrameStore, get_frame_file
+        from fingerprint_index import FingerprintIndex, get_fingerprint_file
+
+        self.download_dir = download_dir
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.memory_budget = memory_budget
+        self.stop_event = threading.Event()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.counts = {'downloaded': 0, 'download_failed': 0, 'extracted': 0, 'extract_failed': 0, 'indexed': 0}
+
+        feature_manager_instance.set_feature_file(feature_file)
+        if not os.path.exists(feature_file):
+            # 新建空索引，记录提取参数，之后每批增量加入
+            params = {'silence_thresh': SILENCE_THRESH_DB if skip_silence else None}
+            feature_manager_instance.save_features({}, roots=[download_dir], params=params)
+        self.params = feature_manager_instance.get_extraction_params()
+        self.index = feature_manager_instance.load_features()
+        self.quarantine = feature_manager_instance.get_quarantine()
+
+        self.frame_file = get_frame_file(feature_file)
+        self.keep_frames = keep_frames or FrameStore.exists(self.frame_file)
+        self.fingerprint_file = get_fingerprint_file(feature_file)
+        self.keep_fingerprints = keep_fingerprints or FingerprintIndex.exists(self.fingerprint_file)
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self.upserts = {}
+        self.failures = {}
+        self.frames = {}
+        self.landmarks = {}
+        self.last_flush = time.monotonic()
+
+    # 下载线程的回调：新下载的文件、以及已存在但还没有进入索引的文件放入提取队列
+    def _on_download(self, url, file_path, error):
+        with self.lock:
+            if error is not None:
+                self.counts['download_failed'] += 1
+                print(f"\n下载失败 ({url}): {error}")
+                return
+            self.counts['downloaded'] += 1
+        if file_path not in self.index and not feature_manager_instance.is_quarantined(file_path, self.quarantine):
+            self.queue.put(file_path)
+        self._report()
+
+    def _downloaded_files(self):
+        while True:
+            file_path = self.queue.get()
+            if file_path is _DONE:
+                return
+            yield file_path
+
+    def _on_frames(self, file_path, frames):
+        with self.lock:
+            self.frames[file_path] = frames
+
+    def _on_landmarks(self, file_path, landmarks):
+        with self.lock:
+            self.landmarks[file_path] = landmarks
+
+    def _on_file_done(self, file_path, features, error):
+        with self.lock:
+            if error is not None:
+                self.failures[file_path] = error
+                self.counts['extract_failed'] += 1
+            elif features is not None:
+                self.upserts[file_path] = features
+                self.counts['extracted'] += 1
+            full = len(self.upserts) + len(self.failures) >= self.batch_size
+            due = time.monotonic() - self.last_flush >= self.flush_seconds
+        if full or due:
+            self.flush()
+        self._report()
+
+    # 把当前批次写入索引（以及帧序列/指纹文件），写入后立即可以被搜索到
+    def flush(self):
+        from segment_search import update_frame_store
+        from fingerprint_index import update_fingerprint_index
+
+        with self.lock:
+            upserts, failures, frames, landmarks = self.upserts, self.failures, self.frames, self.landmarks
+            self._reset_batch()
+        if not (upserts or failures):
+            return
+        feature_manager_instance.apply_changes(upserts, quarantine=failures)
+        if self.keep_frames:
+            update_frame_store(self.frame_file, frames)
+        if self.keep_fingerprints:
+            update_fingerprint_index(self.fingerprint_file, landmarks)
+        with self.lock:
+            self.counts['indexed'] += len(upserts)
+
+    def _report(self):
+        c = self.counts
+        print(f"\r下载 {c['downloaded']} (失败 {c['download_failed']}) | 提取 {c['extracted']} (失败 {c['extract_failed']}) "
+              f"| 已入索引 {c['indexed']}", end='', flush=True)
+
+    def run(self, urls):
+        from extraction_scheduler import ExtractionScheduler
+
+        def produce():
+            try:
+                download_all(urls, self.download_dir, self.download_workers, self.retries, self.timeout,
+                             on_done=self._on_download, stop_event=self.stop_event)
+            finally:
+                self.queue.put(_DONE)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            scheduler = ExtractionScheduler(max_workers=self.extract_workers, stop_event=self.stop_event,
+                                            memory_budget=self.memory_budget, **self.params)
+            scheduler.run(self._downloaded_files(), self._on_file_done,
+                          self._on_frames if self.keep_frames else None,
+                          self._on_landmarks if self.keep_fingerprints else None)
+        except KeyboardInterrupt:
+            self.stop_event.set()
+        finally:
+            producer.join(timeout=5)
+            # 已经提取完成的部分不丢弃
+            self.flush()
+            self._report()
+            print()
+        return self.counts
+
+def main():
+    from supervised_pool import shutdown_shared_pool
+
+    parser = argparse.ArgumentParser(description="下载并增量加入特征索引")
+    parser.add_argument('url_file', help="每行一个 URL 的文本文件")
+    parser.add_argument('download_dir', help="下载目录")
+    parser.add_argument('feature_file', help="特征文件，不存在时新建")
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_WORKERS, help="并发下载数")
+    parser.add_argument('--extract-workers', type=int, default=None, help="提取进程数，默认为 CPU 核数")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="每批写入索引的文件数")
+    parser.add_argument('--flush-seconds', type=float, default=DEFAULT_FLUSH_SECONDS, help="最长写入间隔（秒）")
+    parser.add_argument('--frames', action='store_true', help="同时保存片段定位数据")
+    parser.add_argument('--fingerprints', action='store_true', help="同时保存查重指纹")
+    parser.add_argument('--skip-silence', action='store_true', help="新建索引时特征均值跳过静音帧")
+    parser.add_argument('--memory-budget', type=int, default=None, help="解码内存上限（MB），默认为物理内存的一半")
+    args = parser.parse_args()
+
+    pipeline = DownloadIndexPipeline(args.download_dir, args.feature_file, args.download_workers, args.extract_workers,
+                                     args.retries, args.timeout, args.batch_size, args.flush_seconds,
+                                     args.frames, args.fingerprints, args.skip_silence,
+                                     args.memory_budget << 20 if args.memory_budget else None)
+    try:
+        counts = pipeline.run(read_urls(args.url_file))
+    finally:
+        shutdown_shared_pool()
+    print(f"完成: 下载 {counts['downloaded']}，加入索引 {counts['indexed']}，"
+          f"下载失败 {counts['download_failed']}，提取失败 {counts['extract_failed']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import argparse
+
+# 对账：URL 列表、磁盘上的音频库、特征索引三方比对，一次给出
+#   未下载（URL 列表中有、磁盘上没有）
+#   已下载未入索引（磁盘上有、索引中没有，且不在隔离列表中）
+#   索引中失效的条目（索引中有、磁盘上已经不存在）
+#   空文件 / 不完整文件（0 字节、下载中断留下的 .part、--check-headers 时 WAV 头声明的长度大于文件大小）
+#   python tools/reconcile_library.py 音频库目录 [--urls URL列表文件] [--feature-file 特征文件] [--output-dir 输出目录]
+# 磁盘只扫描一次（AudioScanner 并行列目录，文件大小取自目录项），三方都转换成集合后用集合运算求差，
+# 不再需要 get_file_names.py / undownload_filenames.py 写出再读回的中间文件。
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from audio_scanner import AudioScanner, AUDIO_EXTENSIONS
+from demo_download import read_urls, url_filename, PART_SUFFIX
+
+# 统一路径写法，Windows 上不区分大小写
+def path_key(path):
+    return os.path.normcase(os.path.normpath(path))
+
+# WAV (RIFF) 头中声明的文件长度大于实际大小时说明文件被截断；其他格式的头不记录总长度，不检查
+def is_truncated_wav(file_path, size):
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(12)
+    except OSError:
+        return True
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return False
+    return int.from_bytes(header[4:8], 'little') + 8 > size
+
+# 扫描音频库，返回 ({路径: 大小}, [.part 文件])
+def scan_library(library_dir):
+    files = {}
+    parts = []
+    for file_path, size in AudioScanner(library_dir, extensions=AUDIO_EXTENSIONS + (PART_SUFFIX,), with_size=True):
+        if file_path.lower().endswith(PART_SUFFIX):
+            parts.append(file_path)
+        else:
+            files[file_path] = size
+    return files, parts
+
+# 三方对账，返回 {类别: 排序后的列表}
+def reconcile(library_dir, urls=None, feature_file=None, check_headers=False):
+    files, parts = scan_library(library_dir)
+    disk_keys = {path_key(path): path for path in files}
+    report = {}
+
+    if urls is not None:
+        # 下载工具把每个 URL 保存为 下载目录/<URL 文件名>，这里按文件名比对（与 undownload_filenames.py 一致）
+        names = {os.path.basename(path) for path in files}
+        report['not_downloaded'] = sorted(url for url in urls if url_filename(url) not in names)
+
+    if feature_file is not None:
+        from feature_manager_gai import feature_manager_instance
+
+        feature_manager_instance.set_feature_file(feature_file)
+        index = feature_manager_instance.load_features()
+        quarantine = feature_manager_instance.get_quarantine()
+        library_key = os.path.join(path_key(library_dir), '')
+        indexed = set()
+        gone = []
+        for path in index.iter_paths():
+            key = path_key(feature_manager_instance.remap_path(path))
+            indexed.add(key)
+            if key in disk_keys:
+                continue
+            # 库目录之外的条目不在本次扫描范围内，单独确认是否存在
+            if key.startswith(library_key) or not os.path.exists(key):
+                gone.append(path)
+        quarantined = {path_key(path) for path in quarantine}
+        report['not_indexed'] = sorted(path for key, path in disk_keys.items()
+                                       if key not in indexed and key not in quarantined)
+        report['quarantined'] = sorted(path for key, path in disk_keys.items() if key in quarantined)
+        report['index_missing'] = sorted(gone)
+
+    report['empty'] = sorted(path for path, size in files.items() if size == 0)
+    truncated = list(parts)
+    if check_headers:
+        truncated += [path for path, size in files.items()
+                      if size and path.lower().endswith('.wav') and is_truncated_wav(path, size)]
+    report['truncated'] = sorted(truncated)
+    report['scanned'] = len(files)
+    return report
+
+REPORT_LABELS = [
+    ('not_downloaded', "未下载"),
+    ('not_indexed', "已下载未入索引"),
+    ('quarantined', "提取失败（隔离）"),
+    ('index_missing', "索引中文件已不存在"),
+    ('empty', "空文件"),
+    ('truncated', "不完整文件"),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="URL 列表、音频库、特征索引三方对账")
+    parser.add_argument('library_dir', help="音频库（下载）目录")
+    parser.add_argument('--urls', help="每行一个 URL 的文本文件")
+    parser.add_argument('--feature-file', help="特征文件")
+    parser.add_argument('--output-dir', help="把每一类结果写入该目录下的 <类别>.txt（未下载的 URL 可直接交给 demo_download.py）")
+    parser.add_argument('--check-headers', action='store_true', help="读取 WAV 文件头检查是否被截断")
+    parser.add_argument('--show', type=int, default=10, help="每一类在终端中显示的条数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    urls = read_urls(args.urls) if args.urls else None
+    report = reconcile(args.library_dir, urls, args.feature_file, args.check_headers)
+    print(f"扫描 {report['scanned']} 个音频文件，耗时 {time.perf_counter() - start:.1f}s")
+    for key, label in REPORT_LABELS:
+        if key not in report:
+            continue
+        items = report[key]
+        print(f"{label}: {len(items)}")
+        for item in items[:args.show]:
+            print(f"  {item}")
+        if len(items) > args.show:
+            print(f"  ... 另有 {len(items) - args.show} 条")
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            with open(os.path.join(args.output_dir, key + '.txt'), 'w', encoding='utf-8') as f:
+                f.writelines(item + '\n' for item in items)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import argparse
+
+# 检查特征文件每一列的提取参数（schema）是否与当前代码一致，只重新计算过期和缺失的列
+#   python tools/upgrade_index.py 特征文件 [--check] [--columns mfcc,chroma] [--workers 8]
+# 修改某种特征的参数（例如 n_mfcc）或新增特征类型之后运行，路径表和其他列保持不变，不需要完整重建。
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_manager_gai import feature_manager_instance
+
+def describe_schema(index):
+    from feature_schema import index_schema, feature_schema, compare_schema
+
+    recorded = index_schema(index)
+    current = feature_schema(index.meta.get('extraction', {}).get('silence_thresh'))
+    stale, missing = compare_schema(index)
+    for name in sorted(set(recorded) | set(current)):
+        if name in missing:
+            status = "缺失"
+        elif name in stale:
+            status = "过期"
+        else:
+            status = "一致"
+        print(f"{name:<10} {status}")
+        if name in stale and name in current:
+            old, new = recorded[name], current[name]
+            if old.get('unknown'):
+                print("    旧索引没有记录提取参数，维度与当前参数不一致")
+                continue
+            for key in sorted(set(old) | set(new)):
+                if old.get(key) != new.get(key):
+                    print(f"    {key}: {old.get(key)} -> {new.get(key)}")
+    return stale, missing
+
+def main():
+    from supervised_pool import shutdown_shared_pool
+
+    parser = argparse.ArgumentParser(description="按列检查并更新特征文件")
+    parser.add_argument('feature_file')
+    parser.add_argument('--check', action='store_true', help="只检查，不重新计算")
+    parser.add_argument('--columns', help="强制重新计算的列，逗号分隔（默认为过期和缺失的列）")
+    parser.add_argument('--workers', type=int, default=None, help="提取进程数")
+    args = parser.parse_args()
+    columns = [name.strip() for name in args.columns.split(',') if name.strip()] if args.columns else None
+    if columns is not None:
+        from feature_schema import FEATURE_COLUMNS
+
+        unknown = [name for name in columns if name not in FEATURE_COLUMNS]
+        if unknown:
+            parser.error(f"未知的特征列: {', '.join(unknown)}（可用: {', '.join(FEATURE_COLUMNS)}）")
+
+    feature_manager_instance.set_feature_file(args.feature_file)
+    index = feature_manager_instance.load_features()
+    print(f"{args.feature_file}: {len(index)} 首")
+    stale, missing = describe_schema(index)
+    if args.check:
+        sys.exit(1 if stale or missing else 0)
+
+    # 隔离列表中的文件不会重新提取，不计入进度
+    quarantine = index.meta.get('quarantine', {})
+    total = sum(1 for path in index.iter_paths() if not feature_manager_instance.is_quarantined(path, quarantine))
+    done = 0
+
+    def on_file_done(file_path, features, error):
+        nonlocal done
+        done += 1
+        if error is not None:
+            print(f"\nError processing {file_path}: {error}")
+        print(f"\r重新计算: {done}/{total}", end='', flush=True)
+
+    try:
+        recomputed = feature_manager_instance.recompute_columns(columns, args.workers, on_file_done=on_file_done)
+    finally:
+        shutdown_shared_pool()
+    print()
+    if recomputed is None:
+        # 被取消时特征文件没有修改
+        print("已取消，特征文件未修改")
+        sys.exit(1)
+    print(f"已重新计算: {', '.join(recomputed) or '无'}")
+
+if __name__ == '__main__':
+    main()